@@ -1,13 +1,38 @@
 # Standard Python libraries
+import collections
+import concurrent.futures
+import heapq
 import time
+import types
 
 # Third-party libraries
 import requests
 
+# Local libraries
+from so4t_cache import get_cached_ssl_verify, read_cache, save_ssl_verify, write_cache
+
+
+# Filters are immutable, so a cached filter string is only re-validated against the API once
+# per cache period (in seconds)
+FILTER_CACHE_PERIOD = 7 * 24 * 60 * 60
+
+# Maximum number of connections kept open to the API, e.g. for parallel requests with --shards
+CONNECTION_POOL_SIZE = 16
+
+# Maximum number of items in each date range of a sharded crawl (see stream_items_in_shards).
+# Only as many date ranges as there are parallel requests are held in memory at a time
+MAX_SHARD_SIZE = 10000
+
+# A request for all pages of an endpoint. The parameters are read-only, and the page number is
+# kept by each call of stream_pages(), so the same request can be sent by several threads at once
+ApiRequest = collections.namedtuple('ApiRequest', ['url', 'params'])
+
 
 class V2Client(object):
 
-    def __init__(self, url, key=None, token=None):
+    def __init__(self, url, key=None, token=None, probe=True):
+        # If probe is False, the connection isn't tested until the first API call, which uses
+        # the SSL verification setting from the last successful connection test to this host
 
         print("Initializing API v2.3 client...")
 
@@ -37,32 +62,47 @@ class V2Client(object):
                 print("Missing required argument. Please provide an API key.")
                 raise SystemExit
 
+        # A session reuses connections between requests. It's shared by all the threads that use
+        # the client, so nothing about an individual request is stored in the session or client
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=CONNECTION_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
         # Test the API connection and set the SSL verification variable
-        self.ssl_verify = self.test_connection()
+        if probe:
+            self.ssl_verify = self.test_connection()
+        else:
+            self.ssl_verify = get_cached_ssl_verify(self.api_url)
+        # Until a request succeeds, a failed request means that the URL or credentials are wrong
+        self.connected = probe
 
 
     def test_connection(self):
+        # Returns whether SSL certificates can be verified. Verification is always tried first,
+        # so a host is only used without it while its certificate can't be verified; the result
+        # is cached per host for runs with --skip-probe
 
         url = self.api_url + "/tags"
         ssl_verify = True
 
         params = {}
-        if self.soe:
-            headers = {'X-API-Key': self.api_key}
-        else:
-            headers = {'X-API-Access-Token': self.token}
+        if not self.soe:
             params['team'] = self.team_slug
 
         print("Testing API 2.3 connection...")
         try:
-            response = requests.get(url, params=params, headers=headers)
+            response = self.session.get(url, params=params, verify=ssl_verify)
         except requests.exceptions.SSLError:
             print("SSL error. Trying again without SSL verification...")
-            response = requests.get(url, params=params, headers=headers, verify=False)
+            response = self.session.get(url, params=params, verify=False)
             ssl_verify = False
         
         if response.status_code == 200:
             print("API connection successful")
+            save_ssl_verify(self.api_url, ssl_verify)
+            self.connected = True
             return ssl_verify
         else:
             print("Unable to connect to API. Please check your URL and API key/token.")
@@ -75,6 +115,55 @@ class V2Client(object):
         # filter_attributes should be a list variable containing strings of the attributes
         # base can be 'default', 'withbody', 'none', or 'total'
 
+        # Filter strings are cached on disk, keyed by API URL, base, and the sorted attributes
+        # A cached filter is used without any API call, unless it hasn't been validated within
+        # the cache period, in which case it's checked once and then trusted for another period
+        cache_key = f"{self.api_url}|{base}|{';'.join(sorted(filter_attributes))}"
+        filter_cache = read_cache('filters')
+        cached_filter = filter_cache.get(cache_key)
+        if cached_filter:
+            if time.time() - cached_filter['validation_date'] < FILTER_CACHE_PERIOD:
+                return cached_filter['filter']
+            if self.validate_filter(cached_filter['filter']):
+                filter_string = cached_filter['filter']
+            else:
+                filter_string = self.request_filter(filter_attributes, base)
+        else:
+            filter_string = self.request_filter(filter_attributes, base)
+
+        if not filter_string: # filter creation failed; don't cache the fallback
+            return filter_string
+
+        # Re-read the cache before writing, in case another client has updated it meanwhile
+        filter_cache = read_cache('filters')
+        filter_cache[cache_key] = {
+            'filter': filter_string,
+            'validation_date': int(time.time())
+        }
+        write_cache('filters', filter_cache)
+
+        return filter_string
+
+
+    def validate_filter(self, filter_string):
+        # Checks that a (cached) filter string is still recognized by the API
+
+        # Documentation for API endpoint: https://api.stackexchange.com/docs/read-filter
+        endpoint = f"/filters/{filter_string}"
+        endpoint_url = self.api_url + endpoint
+
+        print(f"Validating cached filter: {filter_string}")
+        response = self.get_items(endpoint_url, {})
+        if response and response[0].get('filter') == filter_string:
+            return True
+        else:
+            print(f"Cached filter is no longer valid: {filter_string}")
+            return False
+
+
+    def request_filter(self, filter_attributes, base):
+        # Creates a new filter via the API
+
         # Filter documentation: https://api.stackexchange.com/docs/filters
         # Documentation for API endpoint: https://api.stackexchange.com/docs/create-filter
         endpoint = "/filters/create"
@@ -91,13 +180,26 @@ class V2Client(object):
             params['include'] = ';'.join(filter_attributes)
 
         response = self.get_items(endpoint_url, params)
+        if not response: # API call failed; details have already been printed by get_items
+            print("Unable to create filter. Using the default filter instead.")
+            return ''
+
         filter_string = response[0]['filter']
         print(f"Filter created: {filter_string}")
 
         return filter_string
 
 
-    def get_all_questions(self, filter_string=''):
+    def get_all_questions(self, filter_string='', activity_since=None, shards=1):
+
+        return list(self.stream_all_questions(filter_string, activity_since, shards))
+
+
+    def stream_all_questions(self, filter_string='', activity_since=None, shards=1):
+        # Generator that yields questions as each page is received
+        # If activity_since (epoch seconds) is provided, only questions with activity (e.g. new
+        # or edited answers and comments) since then are returned
+        # If shards is more than 1, questions are fetched in that many date ranges in parallel
 
         # API endpoint documentation: https://api.stackexchange.com/docs/questions
         endpoint = "/questions"
@@ -109,11 +211,90 @@ class V2Client(object):
         }
         if filter_string:
             params['filter'] = filter_string
+        if activity_since:
+            params['sort'] = 'activity'
+            params['min'] = activity_since
+        elif shards > 1:
+            return self.stream_items_in_shards(endpoint, 'question_id', params, shards)
     
-        return self.get_items(endpoint_url, params)
+        return self.stream_items(endpoint_url, params)
+
 
+    def get_questions_by_ids(self, question_ids, filter_string=''):
 
-    def get_all_articles(self, filter_string=''):
+        # API endpoint documentation: https://api.stackexchange.com/docs/questions-by-ids
+        return list(self.stream_items_by_ids("/questions/{ids}", question_ids, filter_string))
+
+
+    def get_all_answers(self, filter_string=''):
+
+        return list(self.stream_all_answers(filter_string))
+
+
+    def stream_all_answers(self, filter_string=''):
+        # Generator that yields answers as each page is received
+
+        # API endpoint documentation: https://api.stackexchange.com/docs/answers
+        endpoint = "/answers"
+        endpoint_url = self.api_url + endpoint
+
+        params = {
+            'page': 1,
+            'pagesize': 100,
+        }
+        if filter_string:
+            params['filter'] = filter_string
+
+        return self.stream_items(endpoint_url, params)
+
+
+    def get_answers_by_ids(self, answer_ids, filter_string=''):
+
+        # API endpoint documentation: https://api.stackexchange.com/docs/answers-by-ids
+        return list(self.stream_items_by_ids("/answers/{ids}", answer_ids, filter_string))
+
+
+    def get_all_comments(self, filter_string='', from_date=None):
+
+        return list(self.stream_all_comments(filter_string, from_date))
+
+
+    def stream_all_comments(self, filter_string='', from_date=None):
+        # Generator that yields comments as each page is received
+        # If from_date (epoch seconds, inclusive) is provided, only comments created since then
+        # are returned
+
+        # API endpoint documentation: https://api.stackexchange.com/docs/comments
+        endpoint = "/comments"
+        endpoint_url = self.api_url + endpoint
+
+        params = {
+            'page': 1,
+            'pagesize': 100,
+        }
+        if filter_string:
+            params['filter'] = filter_string
+        if from_date:
+            params['fromdate'] = from_date
+
+        return self.stream_items(endpoint_url, params)
+
+
+    def get_all_articles(self, filter_string='', activity_since=None, shards=1, from_date=None,
+                         to_date=None):
+
+        return list(self.stream_all_articles(filter_string, activity_since, shards, from_date,
+                                             to_date))
+
+
+    def stream_all_articles(self, filter_string='', activity_since=None, shards=1, from_date=None,
+                            to_date=None):
+        # Generator that yields articles as each page is received
+        # If activity_since (epoch seconds) is provided, only articles with activity since then
+        # are returned
+        # If from_date and/or to_date (epoch seconds, inclusive) are provided, only articles
+        # created in that date range are returned
+        # If shards is more than 1, articles are fetched in that many date ranges in parallel
 
         # API endpoint documentation: https://api.stackexchange.com/docs/articles
         endpoint = "/articles"
@@ -125,11 +306,32 @@ class V2Client(object):
         }
         if filter_string:
             params['filter'] = filter_string
+        if from_date:
+            params['fromdate'] = from_date
+        if to_date:
+            params['todate'] = to_date
+        if activity_since:
+            params['sort'] = 'activity'
+            params['min'] = activity_since
+        elif shards > 1:
+            return self.stream_items_in_shards(endpoint, 'article_id', params, shards)
 
-        return self.get_items(endpoint_url, params)
+        return self.stream_items(endpoint_url, params)
+
+
+    def get_articles_by_ids(self, article_ids, filter_string=''):
+
+        # API endpoint documentation: https://api.stackexchange.com/docs/articles-by-ids
+        return list(self.stream_items_by_ids("/articles/{ids}", article_ids, filter_string))
     
 
     def get_all_users(self, filter_string=''):
+
+        return list(self.stream_all_users(filter_string))
+
+
+    def stream_all_users(self, filter_string=''):
+        # Generator that yields users as each page is received
         
         # API endpoint documentation: https://api.stackexchange.com/docs/users
         endpoint = "/users"
@@ -142,51 +344,236 @@ class V2Client(object):
         if filter_string:
             params['filter'] = filter_string
 
-        return self.get_items(endpoint_url, params)
+        return self.stream_items(endpoint_url, params)
     
 
-    def get_reputation_history(self, user_ids, filter_string=''):
+    def get_posts_by_user_ids(self, post_type, user_ids, filter_string='', from_date=None,
+                              to_date=None):
+        # Returns the posts of a type ('questions', 'answers', 'comments', or 'articles') owned
+        # by any of the users
+        # If from_date and/or to_date (epoch seconds, inclusive) are provided, only posts created
+        # in that date range are returned
+
+        # API endpoint documentation: https://api.stackexchange.com/docs/questions-on-users (and
+        # answers-on-users, comments-on-users)
+        params = {}
+        if from_date:
+            params['fromdate'] = from_date
+        if to_date:
+            params['todate'] = to_date
+
+        return list(self.stream_items_by_ids(f"/users/{{ids}}/{post_type}", user_ids,
+                                             filter_string, params=params))
+
+
+    def get_reputation_history(self, user_ids, filter_string='', from_date=None, to_date=None):
+
+        return list(self.stream_reputation_history(user_ids, filter_string, from_date, to_date))
+
+
+    def stream_reputation_history(self, user_ids, filter_string='', from_date=None,
+                                  to_date=None):
+        # Generator that yields reputation events as each page is received
+        # If from_date and/or to_date (epoch seconds, inclusive) are provided, only events in
+        # that date range are returned
 
         # API endpoint documentation: https://api.stackexchange.com/docs/reputation-history
         # Documentation says User IDs need to be sent in batches of 100, semicolon-separated
         # However, testing shows that batches of 100 is too large, so batches of 50 are used
-        # User IDs also need to be converted from INT to STR
-        batch_size = 50
-        user_ids = [str(user_id) for user_id in user_ids]
-        user_id_batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
-
-        reputation_history = []
-        for batch in user_id_batches:
-            user_id_string = ';'.join(batch) # Convert list of user IDs into a string
-            endpoint = f"/users/{user_id_string}/reputation-history"
-            endpoint_url = self.api_url + endpoint
-
-            params = {
+        params = {}
+        if from_date:
+            params['fromdate'] = from_date
+        if to_date:
+            params['todate'] = to_date
+
+        return self.stream_items_by_ids("/users/{ids}/reputation-history", user_ids,
+                                        filter_string, batch_size=50, params=params)
+
+
+    def stream_items_by_ids(self, endpoint, ids, filter_string='', batch_size=100, params=None):
+        # Generator for the API endpoints that take a semicolon-separated list of IDs, such as
+        # /questions/{ids}. The IDs are sent in batches, since there's a limit to how many IDs
+        # each request can have; `endpoint` should contain an "{ids}" placeholder
+
+        # IDs need to be converted from INT to STR
+        ids = [str(item_id) for item_id in ids]
+        id_batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        for batch in id_batches:
+            id_string = ';'.join(batch) # Convert list of IDs into a string
+            endpoint_url = self.api_url + endpoint.format(ids=id_string)
+
+            batch_params = {
                 'page': 1,
                 'pagesize': 100,
             }
             if filter_string:
-                params['filter'] = filter_string
-
-            reputation_history += self.get_items(endpoint_url, params)
+                batch_params['filter'] = filter_string
+            if params:
+                batch_params.update(params)
 
-        return reputation_history
+            yield from self.stream_items(endpoint_url, batch_params)
     
 
-    def get_items(self, endpoint_url, params):
-        
-        # SO Business and Basic require a team slug parameter
+    def stream_items_in_shards(self, endpoint, id_field, params, shard_count):
+        '''
+        Generator that fetches all items of an endpoint (e.g. "/questions") in parallel, by
+        splitting them into date ranges (shards) by creation date, with roughly the same number
+        of items each, and fetching each shard with its own sequence of pages.
+
+        Compared to paging through the whole endpoint, each request asks for a lower page
+        number (which is faster for the server), and items can't shift between pages while the
+        crawl is in progress: an item's creation date doesn't change, and items created after
+        the crawl started are outside of all shards. Adjacent shards overlap by one second, so
+        no items are missed at the boundaries, and the items are de-duplicated by `id_field`.
+
+        Items are yielded shard by shard, newest first. If `params` has a 'fromdate' and/or
+        'todate', only that date range is split into shards. Shards have at most MAX_SHARD_SIZE
+        items, and no more than `shard_count` of them are fetched (and held in memory) at a
+        time, so memory use doesn't grow with the size of the dataset.
+        '''
+        endpoint_url = self.api_url + endpoint
+        from_date = params.get('fromdate', 1)
+        to_date = min(params.get('todate', int(time.time())), int(time.time()))
+        shards = self.get_date_shards(endpoint, shard_count, from_date, to_date)
+        print(f"Getting {endpoint_url} in {len(shards)} date ranges, using {shard_count} "
+              "parallel requests...")
+
+        item_ids = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shard_count) as executor:
+            pending = collections.deque()
+            for from_date, to_date in reversed(shards):
+                if len(pending) >= shard_count:
+                    yield from self.get_new_items(pending.popleft().result(), id_field, item_ids)
+                shard_params = dict(params, fromdate=from_date, todate=to_date + 1,
+                                    sort='creation', order='desc')
+                pending.append(executor.submit(self.get_items, endpoint_url, shard_params))
+            while pending:
+                yield from self.get_new_items(pending.popleft().result(), id_field, item_ids)
+
+
+    def get_new_items(self, items, id_field, item_ids):
+        # Generator that yields the items whose IDs aren't in `item_ids` yet, and adds them to it
+
+        for item in items:
+            if item[id_field] not in item_ids:
+                item_ids.add(item[id_field])
+                yield item
+
+
+    def get_date_shards(self, endpoint, shard_count, from_date, to_date,
+                        max_shard_size=MAX_SHARD_SIZE):
+        '''
+        Splits the creation dates of an endpoint's items, from `from_date` to `to_date`, into
+        date ranges with roughly equal numbers of items. The number of items in each date range
+        is estimated with the API's 'total' filter. The date range with the most items is split
+        in half until all of them have no more than their share of the items, nor more than
+        `max_shard_size` items (or the maximum number of estimates is reached)
+
+        The date ranges always cover all dates from `from_date` to `to_date`. A date range is
+        only left out if the API counted no items in it; if a count fails, the date range it
+        was for isn't split any further
+
+        Returns:
+            list of (from_date, to_date) tuples, oldest first; both dates are inclusive
+        '''
+        total = self.get_item_count(endpoint, {'fromdate': from_date, 'todate': to_date})
+        if total is None:
+            print("Unable to split the items into date ranges. Getting them in a single date "
+                  "range instead...")
+            return [(from_date, to_date)]
+        target = max(1, min(-(-total // shard_count), max_shard_size)) # items per shard
+        max_estimates = 4 * (shard_count + -(-total // target))
+
+        # Heap of date ranges, with the most items first. Each date range has its (estimated)
+        # number of items, and whether that number was counted by the API or only estimated
+        shards = [(-total, from_date, to_date, True)]
+        for _ in range(max_estimates):
+            count, from_date, to_date, counted = heapq.heappop(shards)
+            count = -count
+            if count <= target or from_date == to_date:
+                heapq.heappush(shards, (-count, from_date, to_date, counted))
+                break
+            middle_date = (from_date + to_date) // 2
+            first_half_count = self.get_item_count(
+                endpoint, {'fromdate': from_date, 'todate': middle_date})
+            if first_half_count is None: # keep the date range as it is
+                heapq.heappush(shards, (-count, from_date, to_date, counted))
+                break
+            heapq.heappush(shards, (-first_half_count, from_date, middle_date, True))
+            second_half_count = max(0, count - first_half_count)
+            heapq.heappush(shards, (-second_half_count, middle_date + 1, to_date, False))
+
+        # Date ranges that the API counted no items in (e.g. before the instance was created)
+        # are skipped
+        return sorted((from_date, to_date) for count, from_date, to_date, counted in shards
+                      if count or not counted)
+
+
+    def get_item_count(self, endpoint, params=None):
+        # Returns the total number of items for an endpoint (e.g. "/questions"), using the
+        # built-in 'total' filter, which returns a count instead of the items themselves
+        # Returns None if the count fails, so callers can tell a failure apart from no items
+
+        request = self.build_request(self.api_url + endpoint, dict(params or {}, filter='total'))
+        endpoint_url = request.url
+
+        response = self.session.get(endpoint_url, params=request.params, verify=self.ssl_verify)
+        if response.status_code != 200:
+            print(f"Unable to get item count from {endpoint_url}. "
+                  f"Status code: {response.status_code}")
+            print(response.text)
+            return None
+
+        try:
+            return response.json()['total']
+        except (requests.exceptions.JSONDecodeError, KeyError):
+            print(f"Unable to get item count from {endpoint_url}. Unexpected response: "
+                  f"{response.text}")
+            return None
+
+
+    def build_request(self, endpoint_url, params=None):
+        # Returns an ApiRequest with a read-only copy of the parameters (the caller's dictionary
+        # is never changed), including the team slug that SO Business and Basic require
+
+        params = dict(params or {})
         if not self.soe:
             params['team'] = self.team_slug
 
-        items = []
+        return ApiRequest(endpoint_url, types.MappingProxyType(params))
+
+
+    def get_items(self, endpoint_url, params):
+
+        return list(self.stream_items(endpoint_url, params))
+
+
+    def stream_items(self, endpoint_url, params):
+        # Generator that yields items one at a time, as each page is received
+
+        for page in self.stream_pages(endpoint_url, params):
+            yield from page
+
+
+    def stream_pages(self, endpoint_url, params):
+        # Generator that yields the list of items from each page as it is received
+        # Each response body is decoded only once, and nothing is kept after a page is yielded,
+        # so the caller can process a page while the next one is requested (i.e. memory use is
+        # independent of the size of the dataset)
+
+        # The page number is local to this call, so the client can be used by several threads
+        request = self.build_request(endpoint_url, params)
+        page = request.params.get('page')
+
         while True: # Keep performing API calls until all items are received
-            if params.get('page'):
-                print(f"Getting page {params['page']} from {endpoint_url}")
+            if page:
+                print(f"Getting page {page} from {endpoint_url}")
+                page_params = dict(request.params, page=page)
             else:
                 print(f"Getting data from {endpoint_url}")
-            response = requests.get(endpoint_url, headers=self.headers, params=params, 
-                                    verify=self.ssl_verify)
+                page_params = request.params
+            response = self.session.get(endpoint_url, params=page_params, verify=self.ssl_verify)
             
             if response.status_code != 200:
                 # Many API call failures result in an HTTP 400 status code (Bad Request)
@@ -195,27 +582,30 @@ class V2Client(object):
                 print(f"/{endpoint_url} API call failed with status code: {response.status_code}.")
                 print(response.text)
                 print(f"Failed request URL and params: {response.request.url}")
-                break
+                if not self.connected:
+                    print("Unable to connect to API. Please check your URL and API key/token.")
+                    raise SystemExit
+                return
+            self.connected = True
             
             try:
-                items += response.json().get('items')
+                json_data = response.json()
             except requests.exceptions.JSONDecodeError:
                 print(f"Unexpected response from {endpoint_url}")
                 print(f"Expected JSON response, but received this instead: {response.text}")
                 raise SystemExit
 
-            if not response.json().get('has_more'):
-                break
+            yield json_data.get('items', [])
+
+            if not json_data.get('has_more'):
+                return
 
             # If the endpoint gets overloaded, it will send a backoff request in the response
             # Failure to backoff will result in a 502 error (throttle_violation)
             # Rate limiting documentation: https://api.stackexchange.com/docs/throttle
-            if response.json().get('backoff'):
-                backoff_time = response.json().get('backoff') + 1
+            if json_data.get('backoff'):
+                backoff_time = json_data.get('backoff') + 1
                 print(f"API backoff request received. Waiting {backoff_time} seconds...")
                 time.sleep(backoff_time)
 
-            params['page'] += 1
-
-        return items
-  
\ No newline at end of file
+            page += 1
@@ -4,10 +4,19 @@ import json
 # Third-party libraries
 import requests
 
+# Local libraries
+from so4t_cache import get_cached_ssl_verify, save_ssl_verify
+
+
+# Maximum number of connections kept open to the API
+CONNECTION_POOL_SIZE = 16
+
 
 class V3Client(object):
 
-    def __init__(self, url, token):
+    def __init__(self, url, token, probe=True):
+        # If probe is False, the connection isn't tested until the first API call, which uses
+        # the SSL verification setting from the last successful connection test to this host
 
         print("Initializing API v3 client...")
 
@@ -28,10 +37,22 @@ class V3Client(object):
         else: # Stack Overflow Enterprise
             self.api_url = url + "/api/v3"
 
-        self.ssl_verify = self.test_connection() # test the API connection
+        # Connections are reused between requests, including requests from different threads
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=CONNECTION_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if probe:
+            self.ssl_verify = self.test_connection() # test the API connection
+        else:
+            self.ssl_verify = get_cached_ssl_verify(self.api_url)
 
     
     def test_connection(self):
+        # Returns whether SSL certificates can be verified; verification is always tried first,
+        # and the result is cached per host for runs with --skip-probe
 
         endpoint = "/tags"
         endpoint_url = self.api_url + endpoint
@@ -39,14 +60,15 @@ class V3Client(object):
 
         print("Testing API v3 connection...")
         try:
-            response = requests.get(endpoint_url, headers=self.headers)
+            response = self.session.get(endpoint_url, verify=ssl_verify)
         except requests.exceptions.SSLError:
             print("SSL error. Trying again without SSL verification...")
-            response = requests.get(endpoint_url, headers=self.headers, verify=False)
+            response = self.session.get(endpoint_url, verify=False)
             ssl_verify = False
         
         if response.status_code == 200:
             print("API connection successful")
+            save_ssl_verify(self.api_url, ssl_verify)
             return ssl_verify
         else:
             print("Unable to connect to API. Please check your URL and API token.")
@@ -112,19 +134,26 @@ class V3Client(object):
             return users
 
 
-    def send_api_call(self, method, endpoint, params={}):
+    def send_api_call(self, method, endpoint, params=None):
+        # The caller's params are never changed; the page number is local to each call, so the
+        # client can be used by several threads at once
 
-        get_response = getattr(requests, method, None) # get the method from the requests library
+        get_response = getattr(self.session, method, None) # get the method from the session
         endpoint_url = self.api_url + endpoint
+        if params is None or isinstance(params, dict):
+            params = dict(params or {})
+            page = params.get('page')
+        else: # e.g. a list, sent as the JSON body of a POST request
+            page = None
 
         data = []
         while True:
+            if page:
+                params['page'] = page
             if method == 'get':
-                response = get_response(endpoint_url, headers=self.headers, params=params, 
-                                        verify=self.ssl_verify)
+                response = get_response(endpoint_url, params=params, verify=self.ssl_verify)
             else:
-                response = get_response(endpoint_url, headers=self.headers, json=params, 
-                                        verify=self.ssl_verify)
+                response = get_response(endpoint_url, json=params, verify=self.ssl_verify)
 
             if response.status_code not in [200, 201, 204]:
                 print(f"API call to {endpoint_url} failed with status code {response.status_code}")
@@ -137,12 +166,12 @@ class V3Client(object):
                 print(f"API request successfully sent to {endpoint_url}")
                 return
 
-            if type(params) == dict and params.get('page'): # check request for pagination
-                print(f"Received page {params['page']} from {endpoint_url}")
+            if page: # check request for pagination
+                print(f"Received page {page} from {endpoint_url}")
                 data += json_data['items']
-                if params['page'] == json_data['totalPages']:
+                if page == json_data['totalPages']:
                     break
-                params['page'] += 1
+                page += 1
             else:
                 print(f"API request successfully sent to {endpoint_url}")
                 data = json_data
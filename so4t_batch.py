@@ -0,0 +1,174 @@
+'''
+Runs the report for several Stack Overflow for Teams instances at once, from a manifest file.
+
+Each instance is run as a separate process (the 'report' command), in its own output directory,
+so the instances don't share memory, data files, or failures. The number of instances that run at
+the same time is limited in total, and per API host, since instances on the same host (e.g.
+several teams on stackoverflowteams.com) share the host's rate limits.
+
+The manifest is a JSON file with a list of instances, for example:
+[
+    {"url": "https://stackoverflowteams.com/c/TEAM-NAME", "token": "YOUR_TOKEN"},
+    {"name": "enterprise", "url": "https://SUBDOMAIN.stackenterprise.co",
+        "key": "YOUR_KEY", "token": "YOUR_TOKEN", "args": ["--web-client"]}
+]
+The optional "name" is used for the output directory (by default, the team name or the host
+name), and the optional "args" are added to the arguments of that instance's report.
+'''
+
+# Standard Python libraries
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+
+
+# How often (in seconds) to check whether running reports have finished
+POLL_INTERVAL = 0.5
+
+
+def run_batch(manifest_file, output_directory, max_concurrent, max_per_host, report_args):
+    '''
+    Runs the report for every instance in the manifest and waits for all of them to finish
+
+    Args:
+        manifest_file: path of the manifest (JSON list of instances)
+        output_directory: directory in which each instance gets a directory for its output
+        max_concurrent: maximum number of reports that run at the same time
+        max_per_host: maximum number of reports that run at the same time for one API host
+        report_args: list of arguments added to the report of every instance
+    '''
+    instances = read_manifest(manifest_file)
+    print(f"Running reports for {len(instances)} instances, {max_concurrent} at a time "
+          f"(at most {max_per_host} per host)...")
+
+    pending = list(instances)
+    running = {} # process -> instance
+    host_counts = {}
+    failed = []
+    batch_start_time = time.time()
+
+    while pending or running:
+        # Start as many pending instances as the limits allow, in manifest order
+        for instance in list(pending):
+            if len(running) >= max_concurrent:
+                break
+            if host_counts.get(instance['host'], 0) >= max_per_host:
+                continue
+            pending.remove(instance)
+            running[start_report(instance, output_directory, report_args)] = instance
+            host_counts[instance['host']] = host_counts.get(instance['host'], 0) + 1
+
+        time.sleep(POLL_INTERVAL)
+
+        for process, instance in list(running.items()):
+            if process.poll() is None:
+                continue
+            del running[process]
+            host_counts[instance['host']] -= 1
+            instance['log'].close()
+
+            elapsed_time = round(time.time() - instance['start_time'])
+            if process.returncode == 0:
+                print(f"Finished {instance['name']} in {elapsed_time} seconds")
+            else:
+                failed.append(instance['name'])
+                print(f"Failed {instance['name']} after {elapsed_time} seconds "
+                      f"(exit code {process.returncode}). See {instance['log'].name}")
+
+    print(f"Batch finished in {round(time.time() - batch_start_time)} seconds: "
+          f"{len(instances) - len(failed)} succeeded, {len(failed)} failed")
+    if failed:
+        print(f"Failed instances: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+def start_report(instance, output_directory, report_args):
+    # Starts the report for an instance as a separate process, and returns the process
+
+    instance_directory = os.path.join(output_directory, instance['name'])
+    os.makedirs(instance_directory, exist_ok=True)
+    instance['log'] = open(os.path.join(instance_directory, 'so4t_user_report.log'), 'w')
+    instance['start_time'] = time.time()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'so4t_user_report.py')
+    command = [sys.executable, script, 'report', '--url', instance['url']]
+    command += report_args + instance.get('args', [])
+
+    # Credentials are passed in the environment rather than as arguments, so they aren't shown
+    # in the list of running processes
+    env = dict(os.environ)
+    env.pop('SO4T_KEY', None)
+    env.pop('SO4T_TOKEN', None)
+    if instance.get('key'):
+        env['SO4T_KEY'] = instance['key']
+    if instance.get('token'):
+        env['SO4T_TOKEN'] = instance['token']
+    env['PYTHONUNBUFFERED'] = '1' # so the log file is written as the report runs
+
+    print(f"Starting {instance['name']} ({instance['url']})...")
+    return subprocess.Popen(command, cwd=instance_directory, env=env, stdout=instance['log'],
+                            stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+
+
+def read_manifest(manifest_file):
+    # Returns the list of instances in the manifest, each with a unique name and its API host
+
+    try:
+        with open(manifest_file, 'r') as f:
+            instances = json.load(f)
+    except FileNotFoundError:
+        print(f"Manifest file not found: {manifest_file}")
+        raise SystemExit
+    except json.JSONDecodeError as e:
+        print(f"Manifest file is not valid JSON: {manifest_file} ({e})")
+        raise SystemExit
+
+    if not isinstance(instances, list) or not instances:
+        print("The manifest must contain a list of instances, each with a 'url'.")
+        raise SystemExit
+
+    names = set()
+    for instance in instances:
+        if not isinstance(instance, dict) or not instance.get('url'):
+            print(f"Each instance in the manifest must have a 'url'. Invalid entry: {instance}")
+            raise SystemExit
+        instance['url'] = instance['url'].rstrip('/')
+        instance['host'] = get_api_host(instance['url'])
+        instance.setdefault('name', get_instance_name(instance['url']))
+        if not is_safe_name(instance['name']):
+            print(f"Invalid instance name in the manifest: {instance['name']}. The name is used "
+                  "for the instance's output directory, so it can't contain a path separator "
+                  "or '..'. Add a different 'name' to this instance.")
+            raise SystemExit
+        if instance['name'] in names:
+            print(f"Duplicate instance name in the manifest: {instance['name']}. Add a unique "
+                  "'name' to each of these instances.")
+            raise SystemExit
+        names.add(instance['name'])
+
+    return instances
+
+
+def is_safe_name(name):
+    # Whether the name can be used as a directory inside the output directory, on any platform
+
+    return (isinstance(name, str) and name not in ['', '.'] and '..' not in name
+            and '/' not in name and '\\' not in name)
+
+
+def get_api_host(url):
+    # All Business and Basic teams share the same API host
+
+    if "stackoverflowteams.com" in url:
+        return "api.stackoverflowteams.com"
+    return urllib.parse.urlsplit(url).netloc
+
+
+def get_instance_name(url):
+
+    if "stackoverflowteams.com" in url:
+        return url.split("https://stackoverflowteams.com/c/")[1]
+    return urllib.parse.urlsplit(url).netloc.replace(':', '_')
@@ -0,0 +1,90 @@
+# Standard Python libraries
+import json
+import os
+import threading
+import urllib.parse
+
+
+# Cached data (sessions, filters, etc.) is kept separate from the exported report data, since
+# some of it is sensitive (e.g. authentication cookies) and none of it is useful on its own
+CACHE_DIRECTORY = '.so4t_cache'
+
+# Serializes read-modify-write updates of a cache by threads of the same process
+cache_lock = threading.Lock()
+
+
+def read_cache(cache_name):
+    """
+    Reads a named cache from the cache directory
+
+    Args:
+        cache_name: str, name of the cache (without file extension)
+
+    Returns:
+        cache: dictionary with the cached data; empty if the cache doesn't exist or is unreadable
+    """
+
+    file_path = os.path.join(CACHE_DIRECTORY, cache_name + '.json')
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def write_cache(cache_name, cache, private=False):
+    """
+    Writes a named cache to the cache directory. The file is written to a temporary file first
+    and then moved into place, so a reader never sees a partially written cache
+
+    Args:
+        cache_name: str, name of the cache (without file extension)
+        cache: dictionary to be cached; must be JSON serializable
+        private: bool, if True the file is only readable by the current user
+    """
+
+    if not os.path.exists(CACHE_DIRECTORY):
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+
+    file_path = os.path.join(CACHE_DIRECTORY, cache_name + '.json')
+    temp_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    # A private file is created with its permissions already set, so its contents are never
+    # readable by other users, even briefly. A temporary file left by an interrupted run of the
+    # same process ID and thread is replaced
+    try:
+        os.remove(temp_file_path)
+    except FileNotFoundError:
+        pass
+    mode = 0o600 if private else 0o666 # the umask still applies
+    file_descriptor = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with os.fdopen(file_descriptor, 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(temp_file_path, file_path)
+
+
+def get_cached_ssl_verify(url):
+    """
+    Returns whether SSL certificates should be verified for the host of a URL, based on the
+    result of the last successful connection test (see save_ssl_verify). Defaults to True.
+    Only used when the connection test is skipped, since the certificate may have been fixed
+    """
+
+    host = urllib.parse.urlsplit(url).netloc
+    ssl_verify = read_cache('ssl_verify').get(host, True)
+    if not ssl_verify:
+        print(f"Warning: SSL verification is turned off for {host}, since the last connection "
+              "test couldn't verify its certificate. Run without --skip-probe to test it again.")
+    return ssl_verify
+
+
+def save_ssl_verify(url, ssl_verify):
+    # Saves the result of a connection test, so runs that skip the test (--skip-probe) don't
+    # need to repeat a failed SSL handshake before falling back to an unverified connection
+
+    host = urllib.parse.urlsplit(url).netloc
+    with cache_lock:
+        cache = read_cache('ssl_verify')
+        if cache.get(host) != ssl_verify:
+            cache[host] = ssl_verify
+            write_cache('ssl_verify', cache)
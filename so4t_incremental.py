@@ -0,0 +1,255 @@
+# Standard Python libraries
+import json
+import os
+
+# Local libraries
+from so4t_metrics import (METRIC_COUNTERS, count_answer, count_article, count_comment,
+                          count_question, count_reputation_event, finalize_user_metrics,
+                          get_answer_response_time, initialize_deleted_user, validate_user_id)
+
+
+# The metrics state always covers the full history of the instance
+START_DATE = 0
+END_DATE = 2524626000 # 2050-01-01
+
+
+class MetricsState(object):
+    """
+    Persisted per-user metrics, along with a ledger of what each post contributed to them. When
+    a post is new, edited, or deleted, only its own contribution is updated (e.g. an edited
+    question has its old contribution subtracted and its new one added), so updating the metrics
+    takes time proportional to the amount of changed data rather than the full history
+
+    The state is saved as a JSON file with the following keys:
+        sync_date: int, when the data in the state was last fetched (epoch seconds)
+        users: dictionary of user ID -> metric counters, answer response times, and post count
+        posts: dictionary of post key (e.g. 'question/123') -> owner, metric contributions,
+            and (for questions) the keys of its answers and comments
+        recent_reputation_events: list of keys of reputation events counted at or after the
+            sync date, which the next sync will receive again and must not count twice
+    """
+
+    def __init__(self, state=None):
+
+        state = state or {}
+        self.sync_date = state.get('sync_date')
+        self.users = state.get('users', {})
+        self.posts = state.get('posts', {})
+        self.recent_reputation_events = set(state.get('recent_reputation_events', []))
+        self.counted_reputation_events = set()
+        self.next_sync_date = self.sync_date
+
+
+    @classmethod
+    def load(cls, file_path):
+        # Returns the saved state, or None if there isn't one
+
+        try:
+            with open(file_path, 'r') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return None
+
+
+    def save(self, file_path):
+
+        state = {
+            'sync_date': self.next_sync_date,
+            'users': self.users,
+            'posts': self.posts,
+            'recent_reputation_events': sorted(self.counted_reputation_events)
+        }
+
+        directory = os.path.dirname(file_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # The state is written to a temporary file first, so an interrupted run can't corrupt it
+        temp_file_path = file_path + '.tmp'
+        with open(temp_file_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(temp_file_path, file_path)
+
+        print(f'Metrics state saved: {file_path}')
+
+
+    def start_sync(self, sync_date):
+        # Must be called before applying data fetched from the API; sync_date is the time the
+        # fetch started, so the next sync can pick up from there
+
+        self.next_sync_date = sync_date
+
+
+    def apply_questions(self, questions):
+        # Adds new questions and replaces edited ones, along with all of their answers/comments
+
+        for question in questions:
+            question_key = f"question/{question['question_id']}"
+            self.remove_post(question_key) # also removes the question's answers and comments
+
+            self.add_post(question_key, question['owner'],
+                          get_post_metrics(count_question, question))
+            child_keys = []
+            for answer in question.get('answers', []):
+                answer_key = f"answer/{answer['answer_id']}"
+                self.remove_post(answer_key)
+                self.add_post(answer_key, answer['owner'], get_post_metrics(count_answer, answer),
+                              get_answer_response_time(answer, question))
+                child_keys.append(answer_key)
+                child_keys += self.apply_comments(answer.get('comments', []))
+            child_keys += self.apply_comments(question.get('comments', []))
+
+            self.posts[question_key]['children'] = child_keys
+
+
+    def apply_comments(self, comments):
+        # Returns the post keys of the comments
+
+        comment_keys = []
+        for comment in comments:
+            comment_key = f"comment/{comment['comment_id']}"
+            self.remove_post(comment_key)
+            self.add_post(comment_key, comment['owner'], get_post_metrics(count_comment, comment))
+            comment_keys.append(comment_key)
+
+        return comment_keys
+
+
+    def apply_articles(self, articles):
+
+        for article in articles:
+            article_key = f"article/{article['article_id']}"
+            self.remove_post(article_key)
+            self.add_post(article_key, article['owner'], get_post_metrics(count_article, article))
+
+
+    def apply_reputation_history(self, reputation_history):
+        # Reputation events never change, so new events are simply added to the user's total
+
+        for event in reputation_history:
+            event_key = get_reputation_event_key(event)
+            if event_key in self.recent_reputation_events: # already counted by the previous sync
+                continue
+            if event['creation_date'] >= self.next_sync_date:
+                self.counted_reputation_events.add(event_key)
+
+            user = self.get_user_state(event['user_id'])
+            count_reputation_event(user, event, START_DATE, END_DATE)
+
+
+    def remove_posts(self, post_type, post_ids):
+        # Removes deleted posts; post_type is 'question', 'answer', 'comment', or 'article'
+
+        for post_id in post_ids:
+            self.remove_post(f"{post_type}/{post_id}")
+
+
+    def get_post_ids(self, post_type):
+        # Returns the IDs of all posts of a type (e.g. 'question') in the state
+
+        prefix = post_type + '/'
+        return [int(post_key[len(prefix):]) for post_key in self.posts
+                if post_key.startswith(prefix)]
+
+
+    def add_post(self, post_key, owner, metrics, answer_response_time=None):
+
+        user_id = validate_user_id(owner)
+        user = self.get_user_state(user_id, owner['display_name'])
+        for counter, value in metrics.items():
+            user[counter] += value
+        user['post_count'] += 1
+        if answer_response_time is not None:
+            user['answer_response_times'][post_key] = answer_response_time
+
+        self.posts[post_key] = {
+            'user_id': user_id,
+            'metrics': metrics
+        }
+
+
+    def remove_post(self, post_key):
+
+        post = self.posts.pop(post_key, None)
+        if not post: # new post
+            return
+
+        user = self.users[str(post['user_id'])]
+        for counter, value in post['metrics'].items():
+            user[counter] -= value
+        user['post_count'] -= 1
+        user['answer_response_times'].pop(post_key, None)
+
+        for child_key in post.get('children', []):
+            self.remove_post(child_key)
+
+
+    def get_user_state(self, user_id, display_name=None):
+
+        try:
+            user = self.users[str(user_id)]
+        except KeyError:
+            user = {'user_id': user_id, 'display_name': display_name, 'post_count': 0,
+                    'answer_response_times': {}}
+            user.update(dict.fromkeys(METRIC_COUNTERS, 0))
+            self.users[str(user_id)] = user
+
+        if display_name and not user['display_name']:
+            user['display_name'] = display_name
+
+        return user
+
+
+    def get_users(self, users):
+        """
+        Fills in the metrics for a list of users from the state. Users who own posts but are
+        not in the list (i.e. deleted users) are added to it
+
+        Args:
+            users: list of user dictionaries, with the fields from add_new_user_fields()
+
+        Returns:
+            users: list of user dictionaries with their metrics calculated
+        """
+
+        user_ids = set()
+        for user in users:
+            user_ids.add(str(user['user_id']))
+            user_state = self.users.get(str(user['user_id']))
+            if user_state:
+                fill_user_metrics(user, user_state)
+
+        for user_id, user_state in self.users.items():
+            if user_id in user_ids or not user_state['post_count']:
+                continue
+            deleted_user = initialize_deleted_user(user_state['user_id'],
+                                                   user_state['display_name'])
+            fill_user_metrics(deleted_user, user_state)
+            users.append(deleted_user)
+
+        for user in users:
+            finalize_user_metrics(user)
+
+        return users
+
+
+def get_post_metrics(count_function, post):
+    # Returns the (non-zero) metric counters that a post contributes to its owner
+
+    metrics = dict.fromkeys(METRIC_COUNTERS, 0)
+    count_function(metrics, post, START_DATE, END_DATE)
+
+    return {counter: value for counter, value in metrics.items() if value}
+
+
+def get_reputation_event_key(event):
+
+    return (f"{event['user_id']}/{event['creation_date']}/{event.get('post_id')}/"
+            f"{event.get('reputation_history_type')}/{event['reputation_change']}")
+
+
+def fill_user_metrics(user, user_state):
+
+    for counter in METRIC_COUNTERS:
+        user[counter] = user_state[counter]
+    user['answer_response_times'] = list(user_state['answer_response_times'].values())
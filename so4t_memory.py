@@ -0,0 +1,164 @@
+'''
+Memory profiling of the stages of the report, and the memory budget.
+
+With profiling enabled, Python's tracemalloc module records every memory allocation. For each
+stage (e.g. getting the API data, or processing it), the profiler records the peak memory used
+during the stage, the memory still in use (retained) after it, and the lines of code that
+allocated most of the retained memory. Tracing allocations makes the script noticeably slower
+and uses extra memory itself, so it's only meant for finding out where the memory goes.
+
+The memory budget doesn't need tracemalloc: it compares the memory used by the process (its
+resident set size) and estimates of what the next stage needs against the budget.
+'''
+
+# Standard Python libraries
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+# Number of allocation sites recorded for each stage
+TOP_ALLOCATION_COUNT = 10
+
+# Approximate memory used by the Python objects decoded from a JSON file, relative to the size of
+# the file (measured on exported data, with a margin)
+JSON_MEMORY_FACTOR = 3
+
+MEGABYTE = 1024 * 1024
+
+
+class MemoryProfiler(object):
+    """
+    Usage:
+        profiler = MemoryProfiler(enabled=True, budget=4096 * MEGABYTE)
+        with profiler.stage('process_api_data'):
+            users = process_api_data(api_data, start_date, end_date)
+        profiler.save(file_path)
+
+    If profiling isn't enabled, stages aren't recorded, but the budget can still be checked
+    """
+
+    def __init__(self, enabled=False, budget=None):
+
+        self.enabled = enabled
+        self.budget = budget # bytes, or None for no budget
+        self.stages = []
+        if enabled:
+            tracemalloc.start()
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        if not self.enabled:
+            yield
+            return
+
+        start_time = time.time()
+        start_snapshot = take_snapshot()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            memory, peak_memory = tracemalloc.get_traced_memory()
+            # Allocation sites are compared with the start of the stage, so they show where the
+            # memory that the stage kept came from
+            statistics = take_snapshot().compare_to(start_snapshot, 'lineno')
+            top_allocations = [
+                {'location': str(statistic.traceback[0]),
+                 'size': statistic.size_diff,
+                 'count': statistic.count_diff}
+                for statistic in statistics[:TOP_ALLOCATION_COUNT] if statistic.size_diff > 0
+            ]
+            self.stages.append({
+                'stage': name,
+                'seconds': round(time.time() - start_time, 2),
+                'peak_memory': peak_memory,
+                'retained_memory': memory - start_memory,
+                'process_peak_memory': get_peak_memory_usage(),
+                'top_allocations': top_allocations
+            })
+
+
+    def exceeds_budget(self, estimated_memory=0):
+        # Returns whether the memory in use, plus the estimated memory of the next stage, is more
+        # than the budget. Without a way to measure the memory in use, only the estimate counts
+
+        if not self.budget:
+            return False
+
+        return (get_memory_usage() or 0) + estimated_memory > self.budget
+
+
+    def save(self, file_path):
+
+        if not self.enabled:
+            return
+
+        print("Memory use by stage:")
+        for stage in self.stages:
+            print(f"    {stage['stage']}: peak {format_size(stage['peak_memory'])}, "
+                  f"retained {format_size(stage['retained_memory'])}")
+            for allocation in stage['top_allocations'][:3]:
+                print(f"        {format_size(allocation['size'])} at {allocation['location']}")
+
+        with open(file_path, 'w') as f:
+            json.dump(self.stages, f, indent=4)
+        print(f"Memory profile saved: {file_path}")
+
+
+def take_snapshot():
+    # Allocations by tracemalloc and the import system aren't part of the report's memory use
+
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ])
+
+
+def get_memory_usage():
+    # Returns the memory (resident set size) of this process in bytes, or None if it's unknown
+    # (it's read from /proc, which only exists on Linux)
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_peak_memory_usage():
+    # Returns the highest memory (resident set size) of this process so far in bytes, if known
+
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak_memory if sys.platform == 'darwin' else peak_memory * 1024
+
+
+def estimate_json_memory(file_paths):
+    # Returns the approximate memory needed to load JSON files, or None if one is missing
+
+    try:
+        return sum(os.path.getsize(file_path) for file_path in file_paths) * JSON_MEMORY_FACTOR
+    except OSError:
+        return None
+
+
+def format_size(size):
+
+    return f"{size / MEGABYTE:.1f} MB"
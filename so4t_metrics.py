@@ -0,0 +1,402 @@
+# Standard Python libraries
+import collections
+import concurrent.futures
+import itertools
+import json
+import statistics
+
+
+# Registry of the per-user metrics that are counted from the data. Each metric is the sum, over
+# a type of item owned by the user ('question', 'answer', 'comment', 'article', or 'reputation'
+# event) that was created in the date range, of one of the item's fields; or the number of those
+# items if `field` is None. If `condition` is set, only the items for which it's True count.
+# A new metric only needs to be added here: the counting functions below are compiled from the
+# registry, so all of the metrics of a type of item are updated in the same pass over the items
+Metric = collections.namedtuple('Metric', ['name', 'item_type', 'field', 'condition'])
+
+METRICS = [
+    Metric('question_count', 'question', None, None),
+    Metric('questions_with_no_answers', 'question', None,
+           lambda question: question['answer_count'] == 0),
+    Metric('question_upvotes', 'question', 'up_vote_count', None),
+    Metric('question_downvotes', 'question', 'down_vote_count', None),
+    Metric('answer_count', 'answer', None, None),
+    Metric('answer_upvotes', 'answer', 'up_vote_count', None),
+    Metric('answer_downvotes', 'answer', 'down_vote_count', None),
+    Metric('answers_accepted', 'answer', None, lambda answer: answer['is_accepted']),
+    Metric('article_count', 'article', None, None),
+    Metric('article_upvotes', 'article', 'score', None),
+    Metric('comment_count', 'comment', None, None),
+    Metric('net_reputation', 'reputation', 'reputation_change', None)
+]
+
+# Per-user counters that are summed when partial aggregates are merged
+METRIC_COUNTERS = [metric.name for metric in METRICS]
+
+# Metrics that are calculated from other per-user values when the metrics are finalized
+DERIVED_METRICS = {
+    'answer_response_time_median': ['answer_response_times'],
+    'total_upvotes': ['question_upvotes', 'answer_upvotes', 'article_upvotes'],
+    'total_downvotes': ['question_downvotes', 'answer_downvotes']
+}
+
+# Dataset that each type of item (and each per-user value that isn't a metric) comes from
+ITEM_DATASETS = {
+    'question': 'questions',
+    'answer': 'questions',
+    'comment': 'questions',
+    'article': 'articles',
+    'reputation': 'reputation_history'
+}
+FIELD_DATASETS = {
+    'answer_response_times': 'questions',
+    'sme_tags': 'tags'
+}
+
+# Number of items per chunk of data sent to a worker process
+CHUNK_SIZE = 1000
+
+
+class MetricsAggregator(object):
+    """
+    Calculates user metrics from a stream of questions (with their answers and comments),
+    articles, and reputation events. Each item is counted toward its user's metrics as soon as
+    it's received, and is not kept afterwards, so memory use depends on the number of users
+    rather than the amount of content
+
+    Usage:
+        aggregator = MetricsAggregator(users, start_date, end_date)
+        aggregator.add_questions(questions)
+        aggregator.add_articles(articles)
+        aggregator.add_reputation_history(reputation_history)
+        users = aggregator.get_users()
+    """
+
+    def __init__(self, users, start_date, end_date, partial=False, metrics=None):
+
+        self.users = users # users must already have the fields from add_new_user_fields()
+        self.start_date = start_date
+        self.end_date = end_date
+
+        # Only the metrics in `metrics` are counted (all of them, if it's None)
+        self.metrics = metrics
+        self.count_question = compile_counter('question', metrics)
+        self.count_answer = compile_counter('answer', metrics)
+        self.count_comment = compile_counter('comment', metrics)
+        self.count_article = compile_counter('article', metrics)
+        self.count_reputation_event = compile_counter('reputation', metrics)
+
+        # A partial aggregator (used by worker processes) doesn't know the full list of users, so
+        # every user it comes across is added, to be resolved when the partials are merged
+        self.partial = partial
+
+        # Index users by ID, so that each item is matched to its user with a single lookup
+        self.user_index = {user['user_id']: user for user in users}
+
+
+    def add_questions(self, questions):
+
+        for question in questions:
+            asker = self.get_user(question['owner'])
+            self.count_question(asker, question, self.start_date, self.end_date)
+
+            for answer in question.get('answers', []):
+                answerer = self.get_user(answer['owner'])
+                self.count_answer(answerer, answer, self.start_date, self.end_date)
+                record_answer_response_time(answerer, answer, question)
+
+                for comment in answer.get('comments', []):
+                    commenter = self.get_user(comment['owner'])
+                    self.count_comment(commenter, comment, self.start_date, self.end_date)
+
+            for comment in question.get('comments', []):
+                commenter = self.get_user(comment['owner'])
+                self.count_comment(commenter, comment, self.start_date, self.end_date)
+
+
+    def add_articles(self, articles):
+
+        for article in articles:
+            author = self.get_user(article['owner'])
+            self.count_article(author, article, self.start_date, self.end_date)
+
+
+    def add_reputation_history(self, reputation_history):
+
+        for event in reputation_history:
+            try:
+                user = self.user_index[event['user_id']]
+            except KeyError: # reputation events are only counted for known users
+                if not self.partial:
+                    continue
+                user = self.get_user({'user_id': event['user_id'], 'display_name': ''})
+            self.count_reputation_event(user, event, self.start_date, self.end_date)
+
+
+    def add_reputation_store(self, reputation_store):
+        # Alternative to add_reputation_history, which reads the net reputation of each known
+        # user for the date range directly from a ReputationStore (see so4t_reputation_store.py)
+
+        if self.metrics is not None and 'net_reputation' not in self.metrics:
+            return
+        for user in self.users:
+            user['net_reputation'] += reputation_store.get_net_reputation(
+                user['user_id'], self.start_date, self.end_date)
+
+
+    def get_user(self, owner):
+        # Returns the user for the owner of a post; if the user was deleted, they're added
+
+        user_id = validate_user_id(owner)
+        try:
+            return self.user_index[user_id]
+        except KeyError:
+            deleted_user = initialize_deleted_user(user_id, owner['display_name'])
+            self.users.append(deleted_user)
+            self.user_index[user_id] = deleted_user
+            return deleted_user
+
+
+    def merge_partial_users(self, partial_users, add_unknown_users=True):
+        """
+        Merges the users from a partial aggregator into this one. Counters and answer response
+        times are added to the matching user. Users that aren't known yet are deleted users,
+        which are added (in the order they were found), unless `add_unknown_users` is False
+        """
+
+        for partial_user in partial_users:
+            try:
+                user = self.user_index[partial_user['user_id']]
+            except KeyError:
+                if add_unknown_users:
+                    self.users.append(partial_user)
+                    self.user_index[partial_user['user_id']] = partial_user
+                continue
+
+            for counter in METRIC_COUNTERS:
+                user[counter] += partial_user[counter]
+            user['answer_response_times'] += partial_user['answer_response_times']
+
+
+    def get_users(self):
+        # Returns the users with their metrics finalized (e.g. median answer time, total votes)
+
+        for user in self.users:
+            finalize_user_metrics(user)
+
+        return self.users
+
+
+def aggregate_in_parallel(aggregator, datasets, processes):
+    """
+    Splits the work of an aggregator across a pool of worker processes. Each chunk of data is
+    aggregated by a worker into partial per-user metrics, which are merged back in the order the
+    chunks were read, so the result is identical to aggregating the data in a single process
+
+    Args:
+        aggregator: MetricsAggregator to merge the results into
+        datasets: list of (dataset name, chunks) tuples, in the order they should be merged,
+            where dataset name is 'questions', 'articles', or 'reputation_history' and chunks
+            is an iterable of chunks (lists of items, or JSON text of a list of items)
+        processes: number of worker processes
+    """
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        for dataset_name, chunks in datasets:
+            print(f"Processing {dataset_name} with {processes} processes...")
+            # Reputation events don't add deleted users, as they only count toward known users
+            add_unknown_users = dataset_name != 'reputation_history'
+
+            # Only a few chunks per worker are in flight at once, so memory use stays bounded
+            # even when the chunks are read from a stream
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(aggregate_chunk, dataset_name, chunk,
+                                               aggregator.start_date, aggregator.end_date,
+                                               aggregator.metrics))
+                if len(pending) >= processes * 2:
+                    aggregator.merge_partial_users(pending.popleft().result(), add_unknown_users)
+            while pending:
+                aggregator.merge_partial_users(pending.popleft().result(), add_unknown_users)
+
+
+def aggregate_chunk(dataset_name, chunk, start_date, end_date, metrics=None):
+    # Runs in a worker process. Returns the partial per-user metrics for a chunk of data
+
+    if isinstance(chunk, str): # JSON text of a list of items, to be decoded by the worker
+        chunk = json.loads(chunk)
+
+    aggregator = MetricsAggregator([], start_date, end_date, partial=True, metrics=metrics)
+    if dataset_name == 'questions':
+        aggregator.add_questions(chunk)
+    elif dataset_name == 'articles':
+        aggregator.add_articles(chunk)
+    elif dataset_name == 'reputation_history':
+        aggregator.add_reputation_history(chunk)
+
+    return aggregator.users
+
+
+def split_into_chunks(items, chunk_size=CHUNK_SIZE):
+    # Generator that splits an iterable of items into lists of up to `chunk_size` items
+
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def in_date_range(item, start_date, end_date):
+
+    return start_date < item['creation_date'] < end_date
+
+
+def record_answer_response_time(user, answer, question):
+    # Response times are recorded for all answers, regardless of the date range
+
+    user['answer_response_times'].append(get_answer_response_time(answer, question))
+
+
+def get_answer_response_time(answer, question):
+    # Returns the number of hours between a question being asked and the answer being posted
+
+    return (answer['creation_date'] - question['creation_date'])/60/60
+
+
+def compile_counter(item_type, metric_names=None):
+    # Returns a function that counts an item of the type in all of the registered metrics of the
+    # type (or only those in metric_names) if the item was created in the date range
+
+    metrics = [
+        (metric.name, metric.field, metric.condition) for metric in METRICS
+        if metric.item_type == item_type and (metric_names is None or metric.name in metric_names)
+    ]
+
+    def count(user, item, start_date, end_date):
+        if not metrics or not in_date_range(item, start_date, end_date):
+            return
+        for name, field, condition in metrics:
+            if condition is None or condition(item):
+                user[name] += 1 if field is None else item[field]
+
+    return count
+
+
+count_question = compile_counter('question')
+count_answer = compile_counter('answer')
+count_article = compile_counter('article')
+count_comment = compile_counter('comment')
+count_reputation_event = compile_counter('reputation')
+
+
+def get_required_metrics(field_names):
+    # Returns the names of the metrics needed to calculate the fields, e.g. a report's columns
+
+    required = set()
+    for field_name in field_names:
+        required.update(DERIVED_METRICS.get(field_name, [field_name]))
+
+    return [metric.name for metric in METRICS if metric.name in required]
+
+
+def get_required_datasets(field_names):
+    # Returns the names of the datasets needed to calculate the fields
+
+    item_types = {metric.name: metric.item_type for metric in METRICS}
+    datasets = set()
+    for field_name in field_names:
+        for name in DERIVED_METRICS.get(field_name, [field_name]):
+            if name in item_types:
+                datasets.add(ITEM_DATASETS[item_types[name]])
+            elif name in FIELD_DATASETS:
+                datasets.add(FIELD_DATASETS[name])
+
+    return datasets
+
+
+def finalize_user_metrics(user):
+
+    # Answers posted before the question (e.g. merged questions) have no meaningful response time
+    user['answer_response_times'] = [
+        answer_response_time for answer_response_time in user['answer_response_times']
+        if answer_response_time > 0
+    ]
+
+    if user['answer_response_times']:
+        user['answer_response_time_median'] = round(
+            statistics.median(user['answer_response_times']), 2)
+    else:
+        user['answer_response_time_median'] = ''
+
+    for name in ['total_upvotes', 'total_downvotes']:
+        user[name] = sum(user[metric_name] for metric_name in DERIVED_METRICS[name])
+
+
+def initialize_deleted_user(user_id, display_name):
+
+    user = {
+        'user_id': user_id,
+        'display_name': f"{display_name} (DELETED)",
+
+        'questions': [],
+        'question_count': 0,
+        'questions_with_no_answers': 0,
+        'question_upvotes': 0,
+        'question_downvotes': 0,
+
+        'answers': [],
+        'answer_count': 0,
+        'answer_upvotes': 0,
+        'answer_downvotes': 0,
+        'answers_accepted': 0,
+        'answer_response_times': [],
+
+        'articles': [],
+        'article_count': 0,
+        'article_upvotes': 0,
+
+        'comments': [],
+        'comment_count': 0,
+
+        'total_upvotes': 0,
+        'reputation_history': [],
+        'net_reputation': 0,
+
+        'searches': [],
+        'communities': [],
+        'sme_tags': [],
+        'watched_tags': [],
+
+        'moderator': '',
+        'email': '',
+        'title': '',
+        'department': '',
+        'external_id': '',
+        'account_id': '',
+        'account_longevity_days': '',
+        'account_inactivity_days': '',
+        'account_status': 'Deleted'
+    }
+
+    return user
+
+
+def validate_user_id(user):
+    """
+    Checks to see if a user_id is present. If not, the user has been deleted. In this case, the
+    user_id can be extracted from the display_name. For example, if a deleted user's display_name
+    is 'user123', the user_id will be 123."""
+
+    try:
+        user_id = user['user_id']
+    except KeyError: # if user_id is not present, the user was deleted
+        try:
+            user_id = int(user['display_name'].split('user')[1])
+        except IndexError:
+            # This shouldn't happen, but if it does, the user_id will be the display name
+            # This seems to only happen in the internal testing environment
+            user_id = user['display_name']
+
+    return user_id
@@ -0,0 +1,231 @@
+'''
+A precomputed index of the dated metrics of each user, for creating reports for many different
+date ranges from the same data.
+
+For each user, the index stores the dates of their questions, answers, articles, comments, and
+reputation events in sorted order, along with prefix sums (running totals) of the metrics that
+each of them adds, e.g. the upvotes of each question. The metrics for any date range are then
+found with two binary searches per type of post: the number of posts in the range is the
+difference between the two positions, and every other metric is the difference between the
+prefix sums at those positions.
+'''
+
+# Standard Python libraries
+import bisect
+import itertools
+import json
+import os
+
+# Local libraries
+from so4t_metrics import (count_answer, count_article, count_comment, count_question,
+                          finalize_user_metrics, get_answer_response_time,
+                          initialize_deleted_user, validate_user_id)
+
+
+# The index covers the full history; date ranges are applied when it's queried
+START_DATE = 0
+END_DATE = 2524626000 # 2050-01-01
+
+# For each type of dated item, the counter that counts the items (which is derived from the
+# positions in the index) and the counters that are stored as prefix sums
+SERIES = {
+    'question': ('question_count',
+                 ['questions_with_no_answers', 'question_upvotes', 'question_downvotes']),
+    'answer': ('answer_count', ['answer_upvotes', 'answer_downvotes', 'answers_accepted']),
+    'article': ('article_count', ['article_upvotes']),
+    'comment': ('comment_count', []),
+    'reputation': (None, ['net_reputation'])
+}
+
+COUNT_FUNCTIONS = {
+    'question': count_question,
+    'answer': count_answer,
+    'article': count_article,
+    'comment': count_comment
+}
+
+# Datasets the index is built from; the index is rebuilt if any of them changes
+SOURCE_FILES = ['questions.json', 'articles.json', 'reputation_history.json']
+
+
+class MetricsIndex(object):
+    """
+    Usage:
+        index = MetricsIndex.build(questions, articles, reputation_store)
+        users = index.get_users(users, start_date, end_date)
+
+    The index is a dictionary of user ID (as a string) -> user entry, in the order the users
+    were first found in the data. Each entry has the user's display name (used for deleted
+    users), their answer response times (which don't depend on the date range), and, for each
+    type of dated item, the sorted dates and prefix sums of the metrics
+    """
+
+    def __init__(self, users=None, sources=None):
+
+        self.users = users or {}
+        self.sources = sources or {}
+
+
+    @classmethod
+    def build(cls, questions, articles, reputation_store):
+        '''
+        Args:
+            questions: iterable of questions, with their answers and comments
+            articles: iterable of articles
+            reputation_store: ReputationStore with the reputation history
+
+        Returns:
+            MetricsIndex
+        '''
+        # Items are collected per user as (date, metrics) pairs, then sorted by date
+        items = {}
+
+        def add_item(series, owner, item):
+            user_id = validate_user_id(owner)
+            user_items = items.setdefault(user_id, {
+                'display_name': owner['display_name'],
+                'answer_response_times': [],
+                'items': {series_name: [] for series_name in SERIES}
+            })
+            metrics = {}
+            count_counter, sum_counters = SERIES[series]
+            for counter in [count_counter] + sum_counters:
+                metrics[counter] = 0
+            COUNT_FUNCTIONS[series](metrics, item, START_DATE, END_DATE)
+            user_items['items'][series].append(
+                (item['creation_date'], [metrics[counter] for counter in sum_counters]))
+            return user_items
+
+        # Users are added in the same order as the other processing modes add deleted users
+        for question in questions:
+            add_item('question', question['owner'], question)
+            for answer in question.get('answers', []):
+                answerer = add_item('answer', answer['owner'], answer)
+                answerer['answer_response_times'].append(
+                    get_answer_response_time(answer, question))
+                for comment in answer.get('comments', []):
+                    add_item('comment', comment['owner'], comment)
+            for comment in question.get('comments', []):
+                add_item('comment', comment['owner'], comment)
+
+        for article in articles:
+            add_item('article', article['owner'], article)
+
+        index = cls()
+        for user_id, user_items in items.items():
+            entry = index.get_entry(user_id, user_items['display_name'])
+            entry['answer_response_times'] = user_items['answer_response_times']
+            for series, series_items in user_items['items'].items():
+                if series_items:
+                    series_items.sort(key=lambda series_item: series_item[0])
+                    entry['series'][series] = get_series(
+                        [date for date, _ in series_items],
+                        [sums for _, sums in series_items])
+
+        # Reputation events are already sorted by user and date in the reputation store
+        for user_id in reputation_store.user_index:
+            first, last = reputation_store.get_user_range(user_id)
+            entry = index.get_entry(user_id)
+            reputation_changes = reputation_store.columns['reputation_change'][first:last]
+            entry['series']['reputation'] = get_series(
+                list(reputation_store.columns['creation_date'][first:last]),
+                [[reputation_change] for reputation_change in reputation_changes])
+            reputation_changes.release()
+
+        return index
+
+
+    @classmethod
+    def load(cls, file_path):
+        # Returns the saved index, or None if there isn't one
+
+        try:
+            with open(file_path, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        return cls(index['users'], index['sources'])
+
+
+    def save(self, file_path):
+
+        temp_file_path = file_path + '.tmp'
+        with open(temp_file_path, 'w') as f:
+            json.dump({'sources': self.sources, 'users': self.users}, f, separators=(',', ':'))
+        os.replace(temp_file_path, file_path)
+
+        print(f'Metrics index saved: {file_path}')
+
+
+    def get_entry(self, user_id, display_name=''):
+
+        try:
+            return self.users[str(user_id)]
+        except KeyError:
+            entry = {'user_id': user_id, 'display_name': display_name,
+                     'answer_response_times': [], 'series': {}}
+            self.users[str(user_id)] = entry
+            return entry
+
+
+    def get_users(self, users, start_date, end_date):
+        """
+        Calculates the metrics of a list of users for a date range. Users who own posts but are
+        not in the list (i.e. deleted users) are added to it
+
+        Args:
+            users: list of user dictionaries, with the fields from add_new_user_fields()
+            start_date: start of the date range (epoch seconds, exclusive)
+            end_date: end of the date range (epoch seconds, exclusive)
+
+        Returns:
+            users: list of user dictionaries with their metrics calculated
+        """
+        user_ids = set()
+        for user in users:
+            user_ids.add(str(user['user_id']))
+            entry = self.users.get(str(user['user_id']))
+            if entry:
+                fill_window_metrics(user, entry, start_date, end_date)
+
+        for user_id, entry in self.users.items():
+            # Only users with posts are added as deleted users (not users with only reputation)
+            has_posts = any(series_name != 'reputation' for series_name in entry['series'])
+            if user_id in user_ids or not has_posts:
+                continue
+            deleted_user = initialize_deleted_user(entry['user_id'], entry['display_name'])
+            fill_window_metrics(deleted_user, entry, start_date, end_date)
+            users.append(deleted_user)
+
+        for user in users:
+            finalize_user_metrics(user)
+
+        return users
+
+
+def get_series(dates, metrics):
+    # Returns the sorted dates of a type of item, with a prefix sum of each of its metrics
+
+    series = {'dates': dates, 'sums': []}
+    for counter_values in zip(*metrics):
+        series['sums'].append([0] + list(itertools.accumulate(counter_values)))
+
+    return series
+
+
+def fill_window_metrics(user, entry, start_date, end_date):
+
+    for series_name, (count_counter, sum_counters) in SERIES.items():
+        series = entry['series'].get(series_name)
+        if not series:
+            continue
+        # Items are in the date range if start_date < creation_date < end_date
+        first = bisect.bisect_right(series['dates'], start_date)
+        last = bisect.bisect_left(series['dates'], end_date, first)
+        if count_counter:
+            user[count_counter] += last - first
+        for counter, sums in zip(sum_counters, series['sums']):
+            user[counter] += sums[last] - sums[first]
+
+    user['answer_response_times'] += entry['answer_response_times']
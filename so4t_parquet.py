@@ -0,0 +1,282 @@
+'''
+Exports the user report and the raw datasets as Parquet files, a compressed columnar format
+with a typed schema. Tools like pandas, Spark, DuckDB, and most BI platforms can read only the
+columns they need from a Parquet file, rather than parsing an entire CSV.
+
+This module requires the pyarrow library, which is optional and only imported when Parquet
+output is requested.
+'''
+
+# Standard Python libraries
+import os
+import time
+
+# Third-party libraries
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    print("Parquet output requires the pyarrow library. To install it, run: "
+          "pip install pyarrow")
+    raise SystemExit
+
+
+COMPRESSION = 'zstd'
+
+# Number of rows held in memory before they're written to a Parquet file
+BATCH_SIZE = 10000
+
+# Column types of the user report; columns that aren't listed here are strings
+REPORT_COLUMN_TYPES = {
+    'User ID': pa.int64(),
+    'Net Reputation': pa.int64(),
+    'Account Longevity (Days)': pa.int64(),
+    'Account Inactivity (Days)': pa.int64(),
+    'Questions': pa.int64(),
+    'Questions With No Answers': pa.int64(),
+    'Question Upvotes': pa.int64(),
+    'Question Downvotes': pa.int64(),
+    'Answers': pa.int64(),
+    'Answer Upvotes': pa.int64(),
+    'Answer Downvotes': pa.int64(),
+    'Answers Accepted': pa.int64(),
+    'Median Answer Time (Hours)': pa.float64(),
+    'Articles': pa.int64(),
+    'Article Upvotes': pa.int64(),
+    'Comments': pa.int64(),
+    'Total Upvotes': pa.int64(),
+    'Total Downvotes': pa.int64(),
+    'Moderator': pa.bool_(),
+    'Account ID': pa.int64()
+}
+
+OWNER_FIELDS = [
+    ('owner_id', pa.int64()),
+    ('owner_display_name', pa.string())
+]
+
+# Schemas of the tables that the raw datasets are flattened into
+TABLE_SCHEMAS = {
+    'users': pa.schema([
+        ('user_id', pa.int64()),
+        ('account_id', pa.int64()),
+        ('display_name', pa.string()),
+        ('creation_date', pa.timestamp('s')),
+        ('last_access_date', pa.timestamp('s')),
+        ('is_deactivated', pa.bool_()),
+        ('link', pa.string())
+    ]),
+    'reputation_history': pa.schema([
+        ('user_id', pa.int64()),
+        ('creation_date', pa.timestamp('s')),
+        ('reputation_change', pa.int64()),
+        ('post_id', pa.int64()),
+        ('reputation_history_type', pa.string())
+    ]),
+    'questions': pa.schema([
+        ('question_id', pa.int64()),
+        *OWNER_FIELDS,
+        ('creation_date', pa.timestamp('s')),
+        ('last_activity_date', pa.timestamp('s')),
+        ('up_vote_count', pa.int64()),
+        ('down_vote_count', pa.int64()),
+        ('answer_count', pa.int64()),
+        ('comment_count', pa.int64()),
+        ('is_answered', pa.bool_()),
+        ('title', pa.string()),
+        ('tags', pa.list_(pa.string()))
+    ]),
+    'answers': pa.schema([
+        ('answer_id', pa.int64()),
+        ('question_id', pa.int64()),
+        *OWNER_FIELDS,
+        ('creation_date', pa.timestamp('s')),
+        ('up_vote_count', pa.int64()),
+        ('down_vote_count', pa.int64()),
+        ('is_accepted', pa.bool_()),
+        ('comment_count', pa.int64())
+    ]),
+    'comments': pa.schema([
+        ('comment_id', pa.int64()),
+        ('post_id', pa.int64()),
+        ('post_type', pa.string()),
+        *OWNER_FIELDS,
+        ('creation_date', pa.timestamp('s'))
+    ]),
+    'articles': pa.schema([
+        ('article_id', pa.int64()),
+        *OWNER_FIELDS,
+        ('creation_date', pa.timestamp('s')),
+        ('last_activity_date', pa.timestamp('s')),
+        ('score', pa.int64()),
+        ('comment_count', pa.int64()),
+        ('title', pa.string()),
+        ('tags', pa.list_(pa.string()))
+    ]),
+    'article_comments': pa.schema([
+        ('comment_id', pa.int64()),
+        ('article_id', pa.int64()),
+        *OWNER_FIELDS,
+        ('creation_date', pa.timestamp('s'))
+    ])
+}
+
+
+def export_report_to_parquet(data_name, data):
+    '''
+    Writes the rows of the user report (a list of dictionaries with the same keys as the CSV
+    report) to a Parquet file next to the CSV file
+
+    Args:
+        data_name: name of the report, used for the file name
+        data: list of dictionaries, one per row
+    '''
+    date = time.strftime("%Y-%m-%d")
+    file_name = f"{date}_{data_name}.parquet"
+
+    columns = list(data[0].keys()) if data else []
+    fields = [pa.field(column, REPORT_COLUMN_TYPES.get(column, pa.string()))
+              for column in columns]
+    schema = pa.schema(fields)
+
+    # The CSV report uses empty strings for missing values (e.g. the median answer time of a
+    # user with no answers), which become nulls
+    table = pa.table({
+        field.name: pa.array([convert_value(row[field.name], field.type) for row in data],
+                             type=field.type)
+        for field in fields
+    }, schema=schema)
+    pq.write_table(table, file_name, compression=COMPRESSION)
+
+    print(f'Parquet file created: {file_name}')
+
+
+def export_dataset_to_parquet(dataset_name, items):
+    '''
+    Flattens a raw dataset (e.g. questions with nested answers and comments) into tables with
+    a typed schema and writes each table to a Parquet file in the data directory. Rows are
+    written in batches, so `items` can be a stream of any length
+
+    Args:
+        dataset_name: 'users', 'reputation_history', 'questions', or 'articles'
+        items: iterable of the items of the dataset, as returned by the API
+    '''
+    flatten = DATASET_FLATTENERS[dataset_name]
+    directory = 'data'
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    writers = {}
+    batches = {}
+    for table_name in DATASET_TABLES[dataset_name]:
+        file_path = os.path.join(directory, table_name + '.parquet')
+        writers[table_name] = pq.ParquetWriter(file_path, TABLE_SCHEMAS[table_name],
+                                               compression=COMPRESSION)
+        batches[table_name] = []
+
+    try:
+        for item in items:
+            for table_name, row in flatten(item):
+                batch = batches[table_name]
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    write_batch(writers[table_name], batch)
+                    batch.clear()
+        for table_name, batch in batches.items():
+            write_batch(writers[table_name], batch)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for table_name in writers:
+        print(f'Parquet file created: {table_name}.parquet')
+
+
+def write_batch(writer, rows):
+
+    if not rows:
+        return
+    columns = {
+        field.name: [convert_value(row.get(field.name), field.type) for row in rows]
+        for field in writer.schema
+    }
+    writer.write_table(pa.table(columns, schema=writer.schema))
+
+
+def convert_value(value, column_type):
+    # Returns a value that fits the column type, or None if it doesn't
+
+    if value is None or value == '':
+        return None
+    if pa.types.is_integer(column_type) or pa.types.is_timestamp(column_type):
+        # Deleted users may have a display name rather than a numeric user ID
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+    if pa.types.is_floating(column_type):
+        return float(value)
+    if pa.types.is_boolean(column_type):
+        return bool(value)
+    if pa.types.is_string(column_type):
+        return str(value)
+
+    return value
+
+
+def get_owner_fields(post):
+    # The owner of a post by a deleted user has no user ID
+
+    owner = post.get('owner', {})
+    return {
+        'owner_id': owner.get('user_id'),
+        'owner_display_name': owner.get('display_name')
+    }
+
+
+def flatten_user(user):
+
+    yield 'users', user
+
+
+def flatten_reputation_event(event):
+
+    yield 'reputation_history', event
+
+
+def flatten_question(question):
+
+    yield 'questions', {**question, **get_owner_fields(question)}
+
+    for answer in question.get('answers', []):
+        yield 'answers', {**answer, **get_owner_fields(answer),
+                          'question_id': question['question_id']}
+        for comment in answer.get('comments', []):
+            yield 'comments', {**comment, **get_owner_fields(comment),
+                               'post_id': answer['answer_id'], 'post_type': 'answer'}
+
+    for comment in question.get('comments', []):
+        yield 'comments', {**comment, **get_owner_fields(comment),
+                           'post_id': question['question_id'], 'post_type': 'question'}
+
+
+def flatten_article(article):
+
+    yield 'articles', {**article, **get_owner_fields(article)}
+
+    for comment in article.get('comments', []):
+        yield 'article_comments', {**comment, **get_owner_fields(comment),
+                                   'article_id': article['article_id']}
+
+
+DATASET_FLATTENERS = {
+    'users': flatten_user,
+    'reputation_history': flatten_reputation_event,
+    'questions': flatten_question,
+    'articles': flatten_article
+}
+
+# Tables that each dataset is flattened into
+DATASET_TABLES = {
+    'users': ['users'],
+    'reputation_history': ['reputation_history'],
+    'questions': ['questions', 'answers', 'comments'],
+    'articles': ['articles', 'article_comments']
+}
@@ -0,0 +1,226 @@
+'''
+A compact, binary copy of the reputation history, which is usually the largest dataset by far.
+
+Reputation events are stored column by column in a file of fixed-width values, sorted by user
+and then by date:
+    user_id (int64), creation_date (int64), reputation_change (int32), post_id (int64, 0 if the
+    event has no post), and type (uint8 code into a table of reputation_history_type names)
+
+The file is memory-mapped when it's opened, so the columns are read directly from the operating
+system's file cache instead of being decoded into Python objects. Since each user's events are
+contiguous and sorted by date, the net reputation for a date range is found with two binary
+searches and a sum over a slice of one column.
+
+Values are written in the native byte order of the machine. The file is a cache that's rebuilt
+from reputation_history.json whenever the JSON file is newer, not a format for sharing data.
+'''
+
+# Standard Python libraries
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+
+
+MAGIC = b'SO4TREP1'
+
+# Magic, number of events, number of users, length of the type table (JSON)
+HEADER = struct.Struct('=8sQQQ')
+
+# Column names and array typecodes, in the order they're stored in the file
+COLUMNS = [
+    ('user_id', 'q'),
+    ('creation_date', 'q'),
+    ('reputation_change', 'i'),
+    ('post_id', 'q'),
+    ('type_code', 'B')
+]
+
+
+class ReputationStore(object):
+    """
+    Read-only access to a reputation store file created by build_reputation_store()
+
+    Usage:
+        with ReputationStore(file_path) as store:
+            net_reputation = store.get_net_reputation(user_id, start_date, end_date)
+    """
+
+    def __init__(self, file_path):
+
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        magic, event_count, user_count, type_table_length = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a reputation store file: {file_path}")
+        self.event_count = event_count
+
+        offset = HEADER.size
+        self.types = json.loads(bytes(self.buffer[offset:offset + type_table_length]))
+        offset = align(offset + type_table_length)
+
+        # Each column is a zero-copy view of the memory-mapped file
+        self.columns = {}
+        for column_name, typecode in COLUMNS:
+            self.columns[column_name], offset = self.get_view(offset, typecode, event_count)
+
+        # User directory: the user IDs, and the offset of the first event of each user
+        user_ids, offset = self.get_view(offset, 'q', user_count)
+        self.user_offsets, offset = self.get_view(offset, 'q', user_count + 1)
+        self.user_index = {user_id: index for index, user_id in enumerate(user_ids)}
+        user_ids.release()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+    def get_view(self, offset, typecode, count):
+        # Returns a typed view of `count` values starting at `offset`, and the offset after it
+
+        size = array.array(typecode).itemsize * count
+        view = self.buffer[offset:offset + size].cast(typecode)
+
+        return view, align(offset + size)
+
+
+    def get_user_range(self, user_id):
+        # Returns the indexes of the first and last (exclusive) events of a user
+
+        try:
+            index = self.user_index[user_id]
+        except KeyError:
+            return 0, 0
+
+        return self.user_offsets[index], self.user_offsets[index + 1]
+
+
+    def get_window_range(self, user_id, start_date, end_date):
+        # Returns the indexes of a user's events where start_date < creation_date < end_date
+
+        first, last = self.get_user_range(user_id)
+        creation_dates = self.columns['creation_date']
+        first = bisect.bisect_right(creation_dates, start_date, first, last)
+        last = bisect.bisect_left(creation_dates, end_date, first, last)
+
+        return first, last
+
+
+    def get_net_reputation(self, user_id, start_date, end_date):
+
+        first, last = self.get_window_range(user_id, start_date, end_date)
+
+        return sum(self.columns['reputation_change'][first:last])
+
+
+    def get_events(self, user_id):
+        # Returns a user's events as dictionaries, in the same format as the API, oldest first
+
+        first, last = self.get_user_range(user_id)
+        events = []
+        for index in range(first, last):
+            event = {
+                'user_id': user_id,
+                'creation_date': self.columns['creation_date'][index],
+                'reputation_change': self.columns['reputation_change'][index],
+                'reputation_history_type': self.types[self.columns['type_code'][index]]
+            }
+            if self.columns['post_id'][index]:
+                event['post_id'] = self.columns['post_id'][index]
+            events.append(event)
+
+        return events
+
+
+    def close(self):
+
+        # The views of the file must be released before the memory map can be closed
+        for view in list(self.columns.values()) + [getattr(self, 'user_offsets', None)]:
+            if view is not None:
+                view.release()
+        self.columns = {}
+        self.user_offsets = None
+        self.buffer.release()
+        self.mmap.close()
+
+
+def build_reputation_store(reputation_history, file_path):
+    '''
+    Writes reputation events to a reputation store file. The events are collected into
+    typed arrays (a few dozen bytes per event, rather than a dictionary each), sorted by user and
+    date, and written column by column
+
+    Args:
+        reputation_history: iterable of reputation events, as returned by the API
+        file_path: path of the reputation store file to create
+    '''
+    columns = {column_name: array.array(typecode) for column_name, typecode in COLUMNS}
+    type_codes = {}
+    for event in reputation_history:
+        event_type = event.get('reputation_history_type') or ''
+        try:
+            type_code = type_codes[event_type]
+        except KeyError:
+            type_code = type_codes[event_type] = len(type_codes)
+        columns['user_id'].append(event['user_id'])
+        columns['creation_date'].append(event['creation_date'])
+        columns['reputation_change'].append(event['reputation_change'])
+        columns['post_id'].append(event.get('post_id') or 0)
+        columns['type_code'].append(type_code)
+
+    user_ids = columns['user_id']
+    creation_dates = columns['creation_date']
+    order = sorted(range(len(user_ids)), key=lambda i: (user_ids[i], creation_dates[i]))
+    for column_name, typecode in COLUMNS:
+        column = columns[column_name]
+        columns[column_name] = array.array(typecode, (column[i] for i in order))
+
+    # Each user's events are contiguous, so the directory only needs where each user starts
+    directory_user_ids = array.array('q')
+    user_offsets = array.array('q')
+    for index, user_id in enumerate(columns['user_id']):
+        if not directory_user_ids or directory_user_ids[-1] != user_id:
+            directory_user_ids.append(user_id)
+            user_offsets.append(index)
+    user_offsets.append(len(columns['user_id']))
+
+    types = sorted(type_codes, key=type_codes.get)
+    type_table = json.dumps(types).encode('utf-8')
+
+    # The file is written to a temporary file first, so an interrupted run can't leave behind
+    # a partial file that looks up to date
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(order), len(directory_user_ids), len(type_table)))
+        write_aligned(f, type_table)
+        for column_name, _ in COLUMNS:
+            write_aligned(f, columns[column_name].tobytes())
+        write_aligned(f, directory_user_ids.tobytes())
+        write_aligned(f, user_offsets.tobytes())
+    os.replace(temp_file_path, file_path)
+
+    print(f"Reputation store created: {os.path.basename(file_path)} ({len(order)} events)")
+
+
+def align(offset):
+    # Columns start at multiples of 8 bytes, so that 64-bit values are aligned in memory
+
+    return (offset + 7) // 8 * 8
+
+
+def write_aligned(f, data):
+
+    f.write(data)
+    f.write(b'\0' * (align(len(data)) - len(data)))
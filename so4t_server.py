@@ -0,0 +1,371 @@
+'''
+A local HTTP server that answers queries about user metrics, so that questions like "how active
+was this department last quarter?" don't require running the whole script again.
+
+The data is loaded and indexed once (see so4t_metrics_index.py), then kept in memory. Metrics
+for a date range are calculated from the index the first time the date range is queried, and
+cached for later queries. The data directory is checked for changes periodically, and the data
+is reloaded in the background when it changes (e.g. after the 'fetch' command), while queries
+continue to be answered from the previous data.
+
+Endpoints (all GET, all responses are JSON):
+    /users          users and their metrics
+    /users/<id>     a single user and their metrics
+    /summary        totals of the metrics of the matching users
+    /status         when the data was loaded
+
+Query parameters for /users, /users/<id>, and /summary:
+    start_date, end_date    date range, in YYYY-MM-DD format (default: all data)
+    department, title       only users with this department/title (case-insensitive)
+    moderator               'true' or 'false'
+    account_status          e.g. 'Active', 'Deactivated', or 'Deleted'
+
+Additional query parameters for /users:
+    sort            field to sort by (default: net_reputation)
+    order           'desc' (default) or 'asc'
+    limit           maximum number of users to return, e.g. 10 for the top 10
+'''
+
+# Standard Python libraries
+import functools
+import heapq
+import http.server
+import json
+import statistics
+import threading
+import time
+import traceback
+import urllib.parse
+
+# Local libraries
+from so4t_metrics import METRIC_COUNTERS
+
+
+# Default date range, which includes all data
+START_DATE = 0
+END_DATE = 2524626000 # 2050-01-01
+
+# Fields of each user that are returned by the server
+USER_FIELDS = [
+    'user_id',
+    'display_name',
+    'net_reputation',
+    'account_longevity_days',
+    'account_inactivity_days',
+    'question_count',
+    'questions_with_no_answers',
+    'question_upvotes',
+    'question_downvotes',
+    'answer_count',
+    'answer_upvotes',
+    'answer_downvotes',
+    'answers_accepted',
+    'answer_response_time_median',
+    'article_count',
+    'article_upvotes',
+    'comment_count',
+    'total_upvotes',
+    'total_downvotes',
+    'sme_tags',
+    'communities',
+    'account_status',
+    'moderator',
+    'email',
+    'title',
+    'department',
+    'external_id',
+    'account_id'
+]
+
+# Number of date ranges whose metrics are kept in memory
+WINDOW_CACHE_SIZE = 32
+
+
+class QueryError(Exception):
+    # Raised for invalid query parameters; returned to the client as a 400 response
+    pass
+
+
+class MetricsSnapshot(object):
+    """
+    The data loaded at one point in time: the users (with their profile fields, but without
+    metrics) and the metrics index. A snapshot is never changed after it's created, so it can be
+    used by several requests at once, and replaced by a new snapshot when the data is reloaded
+    """
+
+    def __init__(self, users, index, sources):
+
+        self.users = users
+        self.index = index
+        self.sources = sources
+        self.loaded_at = int(time.time())
+        self.get_window = functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)(self.calculate_window)
+
+
+    def calculate_window(self, start_date, end_date):
+        # Returns a dictionary of user ID -> user with their metrics for the date range
+
+        # Each date range gets its own copies of the users, with empty metrics
+        users = [dict(user, answer_response_times=[]) for user in self.users]
+        users = self.index.get_users(users, start_date, end_date)
+
+        return {user['user_id']: user for user in users}
+
+
+class MetricsQueryEngine(object):
+    """
+    Answers queries from the current snapshot of the data, and reloads the data when it changes
+
+    Args:
+        load_data: function that returns (users, metrics index) from the data directory
+        get_sources: function that returns a dictionary of source file -> modification time,
+            which is used to detect when the data has changed
+    """
+
+    def __init__(self, load_data, get_sources):
+
+        self.load_data = load_data
+        self.get_sources = get_sources
+        self.reload_lock = threading.Lock()
+        self.snapshot = None
+        self.reload()
+
+
+    def reload(self):
+        # Loads the data if it changed since the last load. Returns True if it was reloaded
+
+        with self.reload_lock:
+            sources = self.get_sources()
+            if self.snapshot and self.snapshot.sources == sources:
+                return False
+            print("Loading data...")
+            users, index = self.load_data()
+            # Replacing the snapshot is atomic; requests in progress keep using the previous one
+            self.snapshot = MetricsSnapshot(users, index, sources)
+            print(f"Data loaded: {len(users)} users")
+            return True
+
+
+    def watch_for_changes(self, interval):
+        # Runs in a background thread, checking for changes to the data every `interval` seconds
+
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e: # keep serving the previous data if the new data can't load
+                print(f"Unable to reload data: {e}")
+
+
+    def get_users(self, query):
+
+        snapshot = self.snapshot
+        users = self.filter_users(snapshot, query)
+
+        sort_field = get_query_value(query, 'sort', 'net_reputation')
+        if sort_field not in USER_FIELDS:
+            raise QueryError(f"Unknown sort field: {sort_field}")
+        descending = get_query_value(query, 'order', 'desc') != 'asc'
+        limit = get_query_value(query, 'limit')
+
+        # Users without a value for the sort field (e.g. no median answer time) are sorted last.
+        # Missing values can be '' or None (e.g. the title of a deleted user, or of a user from
+        # API v3), which can't be compared with each other, so they're all sorted as ''
+        def sort_key(user):
+            value = user.get(sort_field)
+            has_value = value not in ('', None)
+            value = value if has_value else ''
+            return (has_value, value) if descending else (not has_value, value)
+
+        if limit:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise QueryError(f"Invalid limit: {limit}")
+            if descending:
+                users = heapq.nlargest(limit, users, key=sort_key)
+            else:
+                users = heapq.nsmallest(limit, users, key=sort_key)
+        else:
+            users = sorted(users, key=sort_key, reverse=descending)
+
+        return {
+            'start_date': get_query_value(query, 'start_date'),
+            'end_date': get_query_value(query, 'end_date'),
+            'count': len(users),
+            'users': [get_user_fields(user) for user in users]
+        }
+
+
+    def get_user(self, user_id, query):
+
+        snapshot = self.snapshot
+        start_date, end_date = get_date_range(query)
+        users = snapshot.get_window(start_date, end_date)
+        try:
+            user = users[int(user_id)]
+        except (KeyError, ValueError):
+            return None
+
+        return get_user_fields(user)
+
+
+    def get_summary(self, query):
+
+        users = self.filter_users(self.snapshot, query)
+
+        summary = {
+            'start_date': get_query_value(query, 'start_date'),
+            'end_date': get_query_value(query, 'end_date'),
+            'user_count': len(users)
+        }
+        for counter in METRIC_COUNTERS:
+            summary[counter] = sum(user[counter] for user in users)
+
+        answer_response_times = [answer_response_time for user in users
+                                 for answer_response_time in user['answer_response_times']]
+        if answer_response_times:
+            summary['answer_response_time_median'] = round(
+                statistics.median(answer_response_times), 2)
+        else:
+            summary['answer_response_time_median'] = None
+
+        return summary
+
+
+    def get_status(self):
+
+        snapshot = self.snapshot
+        return {
+            'loaded_at': snapshot.loaded_at,
+            'user_count': len(snapshot.users),
+            'cached_date_ranges': snapshot.get_window.cache_info().currsize
+        }
+
+
+    def filter_users(self, snapshot, query):
+        # Returns the users (with metrics for the date range) that match the query's filters
+
+        start_date, end_date = get_date_range(query)
+        users = snapshot.get_window(start_date, end_date).values()
+
+        filters = []
+        for field in ['department', 'title', 'account_status']:
+            value = get_query_value(query, field)
+            if value is not None:
+                filters.append((field, value.lower()))
+        moderator = get_query_value(query, 'moderator')
+        if moderator is not None:
+            if moderator.lower() not in ('true', 'false'):
+                raise QueryError(f"Invalid moderator value: {moderator}")
+            moderator = moderator.lower() == 'true'
+
+        return [
+            user for user in users
+            if all(str(user.get(field) or '').lower() == value for field, value in filters)
+            and (moderator is None or bool(user.get('moderator')) == moderator)
+        ]
+
+
+def get_query_value(query, name, default=None):
+
+    values = query.get(name)
+    return values[0] if values else default
+
+
+def get_date_range(query):
+    # Returns the start and end dates (epoch seconds) of the query, using the same defaults and
+    # format as the --start-date and --end-date arguments
+
+    dates = []
+    for name, default in [('start_date', START_DATE), ('end_date', END_DATE)]:
+        value = get_query_value(query, name)
+        if value is None:
+            dates.append(default)
+            continue
+        try:
+            dates.append(int(time.mktime(time.strptime(value, '%Y-%m-%d'))))
+        except ValueError:
+            raise QueryError(f"Invalid {name}: {value}. Must be YYYY-MM-DD format.")
+
+    return tuple(dates)
+
+
+def get_user_fields(user):
+
+    return {field: user.get(field) for field in USER_FIELDS}
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    engine = None # set by serve()
+
+    def do_GET(self):
+
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = url.path.rstrip('/')
+
+        try:
+            if path == '/users':
+                self.send_json(self.engine.get_users(query))
+            elif path.startswith('/users/'):
+                user = self.engine.get_user(path[len('/users/'):], query)
+                if user:
+                    self.send_json(user)
+                else:
+                    self.send_json({'error': 'User not found'}, 404)
+            elif path == '/summary':
+                self.send_json(self.engine.get_summary(query))
+            elif path == '/status':
+                self.send_json(self.engine.get_status())
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+        except QueryError as e:
+            self.send_json({'error': str(e)}, 400)
+        except Exception: # the client still gets a JSON response, and the server keeps running
+            traceback.print_exc()
+            self.send_json({'error': 'Internal server error'}, 500)
+
+
+    def send_json(self, data, status_code=200):
+
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        # Requests aren't logged, to keep the terminal output readable
+        pass
+
+
+def serve(load_data, get_sources, host='127.0.0.1', port=8080, reload_interval=60):
+    '''
+    Loads the data and answers queries until the server is stopped (Ctrl+C)
+
+    Args:
+        load_data: function that returns (users, metrics index) from the data directory
+        get_sources: function that returns a dictionary of source file -> modification time
+        host: address to listen on; the default only accepts connections from this machine
+        port: port to listen on
+        reload_interval: how often (in seconds) to check the data directory for changes
+    '''
+    engine = MetricsQueryEngine(load_data, get_sources)
+    MetricsRequestHandler.engine = engine
+
+    watcher = threading.Thread(target=engine.watch_for_changes, args=(reload_interval,),
+                               daemon=True)
+    watcher.start()
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    print(f"Serving user metrics at http://{host}:{port} (press Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping server...")
+    finally:
+        server.server_close()
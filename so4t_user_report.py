@@ -6,17 +6,88 @@ Or, open an issue here: https://github.com/jklick-so/so4t_user_report/issues
 
 # Standard Python libraries
 import argparse
+import concurrent.futures
 import csv
 import json
 import os
-# import pickle
+import re
 import time
-import statistics
 
 # Local libraries
-from so4t_api_v2 import V2Client
-from so4t_api_v3 import V3Client
-# from so4t_web_client import WebClient
+from so4t_incremental import MetricsState
+from so4t_memory import MEGABYTE, MemoryProfiler, estimate_json_memory
+from so4t_metrics_index import SOURCE_FILES as INDEX_SOURCE_FILES, MetricsIndex
+from so4t_reputation_store import ReputationStore, build_reputation_store
+from so4t_metrics import (CHUNK_SIZE, MetricsAggregator, aggregate_in_parallel, compile_counter,
+                          finalize_user_metrics, get_required_datasets, get_required_metrics,
+                          initialize_deleted_user, split_into_chunks, validate_user_id)
+
+
+# API filters built on the 'none' base only return the fields that are explicitly included, so
+# they need to include the response wrapper fields used for pagination and backoff, too
+# Filter documentation: https://api.stackexchange.com/docs/filters
+WRAPPER_FILTER_ATTRIBUTES = [
+    ".backoff",
+    ".has_more",
+    ".items"
+]
+
+# Columns of the user report: user field -> column name, in the order of the report
+REPORT_COLUMNS = {
+    'user_id': 'User ID',
+    'display_name': 'Display Name',
+    'net_reputation': 'Net Reputation',
+    'account_longevity_days': 'Account Longevity (Days)',
+    'account_inactivity_days': 'Account Inactivity (Days)',
+
+    'question_count': 'Questions',
+    'questions_with_no_answers': 'Questions With No Answers',
+    'question_upvotes': 'Question Upvotes',
+    'question_downvotes': 'Question Downvotes',
+
+    'answer_count': 'Answers',
+    'answer_upvotes': 'Answer Upvotes',
+    'answer_downvotes': 'Answer Downvotes',
+    'answers_accepted': 'Answers Accepted',
+    'answer_response_time_median': 'Median Answer Time (Hours)',
+
+    'article_count': 'Articles',
+    'article_upvotes': 'Article Upvotes',
+
+    'comment_count': 'Comments',
+
+    'total_upvotes': 'Total Upvotes',
+    'total_downvotes': 'Total Downvotes',
+
+    'communities': 'Communities', # requires --web-client (or the 'scrape' command)
+    'sme_tags': 'SME Tags',
+
+    'account_status': 'Account Status',
+    'moderator': 'Moderator',
+
+    'email': 'Email',
+    'title': 'Title',
+    'department': 'Department',
+    'external_id': 'External ID',
+    'account_id': 'Account ID'
+}
+
+# Columns that are only in the report if they're selected with --columns
+OPTIONAL_COLUMNS = [
+    'question_upvotes',
+    'question_downvotes',
+    'answer_upvotes',
+    'answer_downvotes',
+    'article_upvotes',
+    'communities'
+]
+DEFAULT_COLUMNS = [column for column in REPORT_COLUMNS if column not in OPTIONAL_COLUMNS]
+
+# Datasets that are only requested from the API (or read from the data directory) if one of the
+# report's columns needs them
+OPTIONAL_DATASETS = ['reputation_history', 'questions', 'articles', 'tags']
+# The metrics index is created from all of the post and reputation datasets
+INDEX_DATASETS = [file_name[:-len('.json')] for file_name in INDEX_SOURCE_FILES]
 
 
 def main():
@@ -24,18 +95,192 @@ def main():
     # Get command-line arguments
     args = get_args()
 
-    if args.no_api:
-        print("Skipping API calls and using data from JSON files in the data directory...")
-        api_data = {}
-        api_data['users'] = read_json('users.json')
-        api_data['reputation_history'] = read_json('reputation_history.json')
-        api_data['questions'] = read_json('questions.json')
-        api_data['articles'] = read_json('articles.json')
-        api_data['tags'] = read_json('tags.json')
-        api_data['communities'] = read_json('communities.json')
-        print("Data successfully loaded from JSON files.")
+    if args.command == 'fetch':
+        fetch_api_data(args)
+        return
+    if args.command == 'scrape':
+        scrape_web_data(args)
+        return
+    if args.command == 'serve':
+        serve_metrics(args)
+        return
+    if args.command == 'batch':
+        from so4t_batch import run_batch
+        report_args = args.report_args
+        if report_args[:1] == ['--']:
+            report_args = report_args[1:]
+        run_batch(args.manifest, args.output_dir, args.max_concurrent, args.max_per_host,
+                  report_args)
+        return
+
+    start_date, end_date = get_date_range(args)
+
+    if args.parquet or args.parquet_data:
+        import so4t_parquet # checks that pyarrow is installed before any data is collected
+
+    memory_budget = args.memory_budget * MEGABYTE if args.memory_budget else None
+    profiler = MemoryProfiler(args.memory_profile, memory_budget)
+
+    # Only the metrics and datasets that the report's columns need are counted and collected
+    metrics = get_required_metrics(args.columns)
+    datasets = get_report_datasets(args)
+
+    # With --user-ids, --department, or --title, only the data of those users is requested from
+    # the API (it's never saved to the data directory, so the budget's fallback doesn't apply)
+    selecting_users = bool(args.user_ids or args.department or args.title)
+    subset_api_data = selecting_users and not args.no_api
+
+    if args.incremental:
+        if args.start_date or args.end_date:
+            print("Incremental updates always cover the full history. The --start-date and "
+                  "--end-date arguments can't be used with --incremental.")
+            raise SystemExit
+        if args.parquet_data:
+            print("Incremental updates don't save all posts to the data directory, so "
+                  "--parquet-data can't be used with --incremental.")
+            raise SystemExit
+        with profiler.stage('process_incremental_data'):
+            users = process_incremental_data(args)
+    elif args.index:
+        if not args.no_api:
+            print("The metrics index is created from the data directory, so --index can only be "
+                  "used with --no-api (or the 'process' command).")
+            raise SystemExit
+        check_data_date_range(start_date, end_date)
+        with profiler.stage('process_indexed_data'):
+            users = process_indexed_data(start_date, end_date)
     else:
-        api_data = get_api_data(args)
+        if args.no_api:
+            check_data_date_range(start_date, end_date)
+            check_data_datasets(datasets)
+
+        if profiler.budget and not args.stream and args.processes == 1 and not subset_api_data:
+            args.stream = not fits_memory_budget(args, profiler, datasets)
+
+        if args.no_api:
+            with profiler.stage('read_api_data'):
+                api_data = read_api_data(args, datasets)
+        elif subset_api_data:
+            with profiler.stage('get_subset_api_data'):
+                api_data = get_subset_api_data(args, datasets)
+        else:
+            with profiler.stage('get_api_data'):
+                api_data = get_api_data(args, datasets)
+            if args.processes > 1:
+                for name in ['reputation_history', 'questions', 'articles']:
+                    api_data[name] = split_into_chunks(api_data[name])
+
+        # If the data turned out to be larger than estimated, it's processed again from the
+        # JSON files in the data directory (which get_api_data has already written), one item
+        # at a time
+        if (profiler.budget and not args.stream and not subset_api_data
+                and profiler.exceeds_budget()):
+            print("The data uses more memory than the memory budget allows. Processing it from "
+                  "the data directory with --stream instead...")
+            api_data = None
+            args.stream = True
+            with profiler.stage('read_api_data'):
+                api_data = read_api_data(args, datasets)
+
+        if args.stream or args.processes > 1:
+            with profiler.stage('process_streamed_data'):
+                users = process_streamed_data(api_data, start_date, end_date, args.processes,
+                                              metrics)
+        else:
+            with profiler.stage('process_api_data'):
+                users = process_api_data(api_data, start_date, end_date, metrics)
+
+    # Other users (e.g. deleted users, or users who answered the selected users' questions) are
+    # left out of the report
+    subset_name = None
+    if selecting_users:
+        users = select_users(users, args)
+        subset_name = get_subset_name(args)
+
+    with profiler.stage('export_processed_user_data'):
+        export_to_json('processed_user_data', users)
+    with profiler.stage('create_user_report'):
+        create_user_report(users, args.start_date, args.end_date, args.parquet, subset_name,
+                           args.columns)
+    if args.parquet_data:
+        with profiler.stage('export_datasets_to_parquet'):
+            export_datasets_to_parquet()
+
+    profiler.save(os.path.join('data', 'memory_profile.json'))
+
+
+def parse_user_ids(value):
+    # Converts the comma-separated list of the --user-ids argument into a set of user IDs
+
+    try:
+        return {int(user_id) for user_id in value.split(',') if user_id.strip()}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid list of user IDs: {value}")
+
+
+def select_users(users, args):
+    # Returns the users that match all of --user-ids, --department, and --title (the department
+    # and title are matched case-insensitively). Exits if no users match
+
+    selected_users = []
+    for user in users:
+        if args.user_ids and user['user_id'] not in args.user_ids:
+            continue
+        if args.department and (user.get('department') or '').lower() != args.department.lower():
+            continue
+        if args.title and (user.get('title') or '').lower() != args.title.lower():
+            continue
+        selected_users.append(user)
+
+    if not selected_users:
+        print("No users match the --user-ids, --department, and --title arguments.")
+        raise SystemExit
+
+    return selected_users
+
+
+def get_subset_name(args):
+    # Returns the part of the report's file name that identifies the selected users
+
+    parts = []
+    if args.department:
+        parts.append(args.department)
+    if args.title:
+        parts.append(args.title)
+    if args.user_ids:
+        parts.append(f"{len(args.user_ids)}_users")
+
+    return re.sub(r'[^A-Za-z0-9_-]+', '-', '_'.join(parts)).strip('-')
+
+
+def parse_columns(value):
+    # Converts the comma-separated list of the --columns argument into a list of user fields
+
+    if value.strip().lower() == 'all':
+        return list(REPORT_COLUMNS)
+
+    columns = [column.strip() for column in value.split(',') if column.strip()]
+    unknown_columns = [column for column in columns if column not in REPORT_COLUMNS]
+    if unknown_columns or not columns:
+        raise argparse.ArgumentTypeError(
+            f"unknown columns: {', '.join(unknown_columns) or value}. Choose from: "
+            f"{', '.join(REPORT_COLUMNS)}")
+
+    return columns
+
+
+def get_report_datasets(args):
+    # Returns the names of the datasets that the report's columns need. Exporting the datasets to
+    # Parquet needs all of them
+
+    if getattr(args, 'parquet_data', False):
+        return set(OPTIONAL_DATASETS)
+
+    return get_required_datasets(getattr(args, 'columns', None) or REPORT_COLUMNS)
+
+
+def get_date_range(args):
+    # Returns the start and end of the report's date range, in epoch seconds
 
     if args.start_date:
         start_date = int(time.mktime(time.strptime(args.start_date, '%Y-%m-%d')))
@@ -47,16 +292,180 @@ def main():
     else:
         end_date = 2524626000 # 2050-01-01
 
-    users = process_api_data(api_data, start_date, end_date)
-    export_to_json('processed_user_data', users)
-    create_user_report(users, args.start_date, args.end_date)
+    return start_date, end_date
+
+
+def fits_memory_budget(args, profiler, datasets):
+    # Returns whether loading the questions, articles, and reputation history (those of them that
+    # are needed) into memory is expected to stay within the memory budget. The estimate is based
+    # on the size of the JSON files in the data directory, i.e. the data of the previous run when
+    # the API is used
+
+    file_paths = [os.path.join('data', f'{name}.json')
+                  for name in ['questions', 'articles', 'reputation_history'] if name in datasets]
+    estimated_memory = estimate_json_memory(file_paths)
+    if estimated_memory is None:
+        if args.no_api:
+            return True # read_api_data reports the missing file
+        print("The size of the data is unknown before the first run, so it will be processed "
+              "with --stream to stay within the memory budget.")
+        return False
+
+    if profiler.exceeds_budget(estimated_memory):
+        print(f"Loading all data is estimated to need {estimated_memory // MEGABYTE} MB, "
+              "which exceeds the memory budget. Using --stream instead.")
+        return False
+
+    return True
+
+
+def get_parent_parsers(suppress_defaults=False):
+    '''
+    Returns the parent parsers of the arguments that are shared by the subcommands. If
+    suppress_defaults is True, the arguments have no defaults, so the subcommands' copies of the
+    arguments don't overwrite the values of the same arguments used before the subcommand
+    '''
+    url_args = argparse.ArgumentParser(add_help=False)
+    url_args.add_argument('--url', 
+                        help='[REQUIRED] Base URL for your Stack Overflow for Teams instance.')
+
+    api_args = argparse.ArgumentParser(add_help=False)
+    api_args.add_argument('--token',
+                        default=os.environ.get('SO4T_TOKEN'),
+                        help='[REQUIRED] API token for your Stack Overflow for Teams instance. '
+                        'Can also be set with the SO4T_TOKEN environment variable.')
+    api_args.add_argument('--key',
+                    type=str,
+                    default=os.environ.get('SO4T_KEY'),
+                    help='API key value. Required if using Stack Overflow Enterprise. Can also be '
+                    'set with the SO4T_KEY environment variable.')
+    api_args.add_argument('--shards',
+                        type=int,
+                        default=1,
+                        help='[OPTIONAL] Number of date ranges that questions and articles are '
+                        'split into, which are fetched from the API in parallel. Speeds up '
+                        'collecting data from large instances.')
+    api_args.add_argument('--full-history',
+                        action='store_true',
+                        help='Gets all reputation history and articles, even if --start-date or '
+                        '--end-date is used, so that the saved data can be used for reports for '
+                        'other dates (with --no-api).')
+    api_args.add_argument('--skip-probe',
+                        action='store_true',
+                        help='Skips testing the API connection before collecting data, which '
+                        'saves a few seconds. If the URL or credentials are wrong, the script '
+                        'fails on the first API call instead.')
+    api_args.add_argument('--web-client',
+                        action='store_true',
+                        help='Enables web-based data collection for data not available via API. '
+                        'Will open a Chrome window and prompt user to login, unless a saved login '
+                        'from a previous run is still valid.')
+
+    processing_args = argparse.ArgumentParser(add_help=False)
+    processing_args.add_argument('--start-date',
+                        type=str,
+                        help='[OPTIONAL] Start date for filtering API data. '
+                        'Must be YYYY-MM-DD format. '
+                        'If not specified, all data will be included.')
+    processing_args.add_argument('--end-date',
+                        type=str,
+                        help='[OPTIONAL] End date for filtering API data. '
+                        'Must be YYYY-MM-DD format. '
+                        'If not specified, all data will be included.')
+    processing_args.add_argument('--stream',
+                        action='store_true',
+                        help='Processes questions, articles, and reputation history as they are '
+                        'received from the API (or read from JSON files) instead of loading them '
+                        'all into memory first. Reduces memory use for large instances; the '
+                        'processed user data will not include the posts for each user.')
+    processing_args.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='[OPTIONAL] Number of processes used to calculate user metrics. Using '
+                        'more than one process splits the questions, articles, and reputation '
+                        'history across CPU cores. Implies --stream.')
+    processing_args.add_argument('--incremental',
+                        action='store_true',
+                        help='Only gets the data that changed since the last run and updates the '
+                        'saved user metrics with it. The first run gets all data. Always reports '
+                        'the full history. With --no-api, recreates the report from the saved '
+                        'user metrics.')
+    processing_args.add_argument('--index',
+                        action='store_true',
+                        help='Used with --no-api. Saves an index of the dated metrics of each '
+                        'user, so that reports for other date ranges are created almost instantly.')
+    processing_args.add_argument('--parquet',
+                        action='store_true',
+                        help='Also writes the user report as a Parquet file, a compressed columnar '
+                        'format with typed columns. Requires the pyarrow library.')
+    processing_args.add_argument('--parquet-data',
+                        action='store_true',
+                        help='Also writes the users, reputation history, questions, answers, '
+                        'comments, and articles as Parquet files in the data directory. Requires '
+                        'the pyarrow library.')
+
+    processing_args.add_argument('--memory-profile',
+                        action='store_true',
+                        help='Records the peak and retained memory of each stage of the script, '
+                        'and where the memory was allocated. Saved to data/memory_profile.json. '
+                        'Makes the script slower.')
+    processing_args.add_argument('--memory-budget',
+                        type=int,
+                        help='[OPTIONAL] Memory limit in megabytes, e.g. 4096. If loading all '
+                        'data into memory would exceed it, the data is processed as with '
+                        '--stream instead.')
+
+    processing_args.add_argument('--columns',
+                        type=parse_columns,
+                        default=DEFAULT_COLUMNS,
+                        help='[OPTIONAL] Comma-separated list of the report\'s columns, e.g. '
+                        'user_id,display_name,answer_count, or "all". Only the data that these '
+                        'columns need is requested from the API. Also adds columns that aren\'t '
+                        'in the report by default: question_upvotes, question_downvotes, '
+                        'answer_upvotes, answer_downvotes, article_upvotes, and communities.')
+
+    processing_args.add_argument('--user-ids',
+                        type=parse_user_ids,
+                        help='[OPTIONAL] Comma-separated list of user IDs, e.g. 5,12,30. Only '
+                        'these users are included in the report, and only their data is '
+                        'requested from the API.')
+    processing_args.add_argument('--department',
+                        type=str,
+                        help='[OPTIONAL] Only includes the users of this department in the report '
+                        '(and only requests their data from the API).')
+    processing_args.add_argument('--title',
+                        type=str,
+                        help='[OPTIONAL] Only includes the users with this job title in the '
+                        'report (and only requests their data from the API).')
+
+    check_deleted_args = argparse.ArgumentParser(add_help=False)
+    check_deleted_args.add_argument('--check-deleted',
+                        action='store_true',
+                        help='Used with --incremental. Also checks for deleted posts, by listing '
+                        'the IDs of all questions, answers, comments, and articles.')
+
+    parent_parsers = [url_args, api_args, processing_args, check_deleted_args]
+    if suppress_defaults:
+        for parent_parser in parent_parsers:
+            for action in parent_parser._actions:
+                action.default = argparse.SUPPRESS
+
+    return parent_parsers
 
 
 def get_args():
 
+    # Arguments shared by the subcommands are defined once, in parent parsers. They can be used
+    # before or after the subcommand (e.g. "--no-api --stream process" or "process --stream")
+    url_args, api_args, processing_args, check_deleted_args = get_parent_parsers()
+    command_url_args, command_api_args, command_processing_args, command_check_deleted_args = \
+        get_parent_parsers(suppress_defaults=True)
+
+    # Without a subcommand, the script runs the full report (the same as the 'report' command)
     parser = argparse.ArgumentParser(
         prog='so4t_user_report.py',
         formatter_class=argparse.RawDescriptionHelpFormatter,
+        parents=[url_args, api_args, processing_args, check_deleted_args],
         description='Uses the Stack Overflow for Teams API to create \
         a CSV report with user metrics.',
         epilog = 'Example for Stack Overflow Business: \n'
@@ -64,90 +473,505 @@ def get_args():
                 '--token "YOUR_TOKEN" \n\n'
                 'Example for Stack Overflow Enterprise: \n'
                 'python3 so4t_user_report.py --url "https://SUBDOMAIN.stackenterprise.co" '
-                '--key "YOUR_KEY" --token "YOUR_TOKEN"\n\n')
-    
-    parser.add_argument('--url', 
-                        type=str,
-                        help='[REQUIRED] Base URL for your Stack Overflow for Teams instance.')
-    parser.add_argument('--token',
-                        type=str,
-                        help='[REQUIRED] API token for your Stack Overflow for Teams instance.')
-    parser.add_argument('--key',
-                    type=str,
-                    help='API key value. Required if using Stack Overflow Enterprise.')
-    parser.add_argument('--start-date',
-                        type=str,
-                        help='[OPTIONAL] Start date for filtering API data. '
-                        'Must be YYYY-MM-DD format. '
-                        'If not specified, all data will be included.')
-    parser.add_argument('--end-date',
-                        type=str,
-                        help='[OPTIONAL] End date for filtering API data. '
-                        'Must be YYYY-MM-DD format. '
-                        'If not specified, all data will be included.')
+                '--key "YOUR_KEY" --token "YOUR_TOKEN"\n\n'
+                'Example of getting the data once, then creating reports for different dates: \n'
+                'python3 so4t_user_report.py fetch --url "https://SUBDOMAIN.stackenterprise.co" '
+                '--key "YOUR_KEY" --token "YOUR_TOKEN"\n'
+                'python3 so4t_user_report.py process --start-date 2024-01-01 '
+                '--end-date 2024-07-01\n\n')
     parser.add_argument('--no-api',
                         action='store_true',
                         help='Skips API calls and uses data from JSON files in the data directory.')
-    # parser.add_argument('--web-client',
-    #                     action='store_true',
-    #                     help='Enables web-based data collection for data not available via API. Will '
-    #                     'open a Chrome window and prompt user to login.')
+    parser.set_defaults(command='report')
+
+    subparsers = parser.add_subparsers(
+        title='commands',
+        metavar='{fetch,process,report,scrape,serve,batch}',
+        help='[OPTIONAL] Run only part of the script. Use "COMMAND --help" for its arguments.')
+
+    fetch_parser = subparsers.add_parser(
+        'fetch', parents=[command_url_args, command_api_args],
+        help='Gets all data via the API (and web client, if enabled) and saves it to JSON files '
+        'in the data directory, without creating a report.')
+    fetch_parser.add_argument('--stream',
+                        action='store_true',
+                        default=argparse.SUPPRESS, # the default is set by the main parser
+                        help='Writes each page of questions, articles, and reputation history to '
+                        'the JSON files as it is received, instead of holding all of it in memory.')
+    fetch_parser.set_defaults(command='fetch')
+
+    process_parser = subparsers.add_parser(
+        'process', parents=[command_processing_args],
+        help='Creates the report from the JSON files in the data directory, without making any '
+        'API calls. The same as --no-api.')
+    process_parser.set_defaults(command='process', no_api=True, check_deleted=False)
+
+    report_parser = subparsers.add_parser(
+        'report', parents=[command_url_args, command_api_args, command_processing_args,
+                           command_check_deleted_args],
+        help='Gets all data via the API and creates the report. This is the default.')
+    report_parser.set_defaults(command='report', no_api=False)
+
+    scrape_parser = subparsers.add_parser(
+        'scrape', parents=[command_url_args],
+        help='Only collects the data that is not available via the API (communities) with the '
+        'web client, and saves it to the data directory.')
+    scrape_parser.set_defaults(command='scrape')
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Starts a local HTTP server that answers queries about user metrics (e.g. for a '
+        'department or date range) from the data directory, reloading it when it changes.')
+    serve_parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address to listen on. Defaults to 127.0.0.1 (this machine only).')
+    serve_parser.add_argument('--port',
+                        type=int,
+                        default=8080,
+                        help='Port to listen on. Defaults to 8080.')
+    serve_parser.add_argument('--reload-interval',
+                        type=int,
+                        default=60,
+                        help='How often (in seconds) to check the data directory for changes. '
+                        'Defaults to 60.')
+    serve_parser.set_defaults(command='serve')
+
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Runs the report for several instances at once, from a manifest file. Arguments '
+        'after "--" are added to the report of every instance, e.g. batch --manifest '
+        'instances.json -- --stream')
+    batch_parser.add_argument('--manifest',
+                        required=True,
+                        help='JSON file with a list of instances, each with a "url", and the '
+                        '"token" and "key" needed for that instance.')
+    batch_parser.add_argument('--output-dir',
+                        default='reports',
+                        help='Directory in which each instance gets a directory for its data and '
+                        'report. Defaults to "reports".')
+    batch_parser.add_argument('--max-concurrent',
+                        type=int,
+                        default=4,
+                        help='Maximum number of instances to run at the same time. Defaults to 4.')
+    batch_parser.add_argument('--max-per-host',
+                        type=int,
+                        default=1,
+                        help='Maximum number of instances to run at the same time that use the '
+                        'same API host (e.g. teams on stackoverflowteams.com). Defaults to 1.')
+    batch_parser.add_argument('report_args',
+                        nargs=argparse.REMAINDER,
+                        help=argparse.SUPPRESS)
+    batch_parser.set_defaults(command='batch')
 
     return parser.parse_args()
 
 
-def get_api_data(args):
+def get_api_data(args, datasets=None):
 
     # Only create a web session if the --web-client flag is used
-    # if args.web_client:
-    #     session_file = 'so4t_session'
-    #     try:
-    #         with open(session_file, 'rb') as f:
-    #             web_client = pickle.load(f)
-    #         if web_client.base_url != args.url or not web_client.test_session():
-    #             raise FileNotFoundError # force creation of new session
-    #     except FileNotFoundError:
-    #         web_client = WebClient(args.url)
-    #         with open(session_file, 'wb') as f:
-    #             pickle.dump(web_client, f)
+    # The web client (and its Selenium/BeautifulSoup dependencies) is only imported when needed
+    # Authentication cookies are saved per URL, so the Chrome login is only needed when they expire
+    if args.web_client:
+        from so4t_web_client import WebClient
+        web_client = WebClient(args.url)
         
     # Instantiate V2Client and V3Client classes to make API calls
-    v2client = V2Client(args.url, args.key, args.token)
-    v3client = V3Client(args.url, args.token)
+    v2client, v3client = create_api_clients(args)
     
     # Get all questions, answers, comments, articles, tags, and SMEs via API
+    # When streaming, questions, articles, and reputation history are generators that fetch
+    # (and export) each page as the data is processed, rather than lists
+    # Datasets that the report doesn't need (see get_report_datasets) are left empty
+    if datasets is None:
+        datasets = set(OPTIONAL_DATASETS)
     so4t_data = {}
     so4t_data['users'] = get_users(v2client, v3client)
-    so4t_data['reputation_history'] = get_reputation_history(v2client, so4t_data['users'])
-    so4t_data['questions'] = get_questions_answers_comments(v2client) # also gets answers/comments
-    so4t_data['articles'] = get_articles(v2client)
-    so4t_data['tags'] = get_tags(v3client) # also gets tag SMEs
+    so4t_data['tags'] = get_tags(v3client) if 'tags' in datasets else [] # also gets tag SMEs
 
     # Get additional data via web scraping
-    # if args.web_client:
-    #     so4t_data['communities'] = web_client.get_communities()
-    # else:
-    #     so4t_data['communities'] = None
+    if args.web_client:
+        so4t_data['communities'] = web_client.get_communities()
+    else:
+        so4t_data['communities'] = None
+
+    from_date, to_date = get_api_date_range(args)
+    for name in ['reputation_history', 'questions', 'articles']:
+        so4t_data[name] = []
+    if 'reputation_history' in datasets:
+        so4t_data['reputation_history'] = get_reputation_history(
+            v2client, so4t_data['users'], args.stream, from_date, to_date)
+    if 'questions' in datasets: # also gets answers/comments
+        so4t_data['questions'] = get_questions_answers_comments(v2client, args.stream,
+                                                                args.shards)
+    if 'articles' in datasets:
+        so4t_data['articles'] = get_articles(v2client, args.stream, args.shards, from_date,
+                                             to_date)
+
+    # Export API data to JSON file. The files of the datasets that weren't collected are kept,
+    # but they're no longer current (see save_data_datasets)
+    for name, data in so4t_data.items():
+        if name not in datasets and name in OPTIONAL_DATASETS:
+            continue
+        if args.stream and name in ['reputation_history', 'questions', 'articles']:
+            so4t_data[name] = export_to_json_stream(name, data)
+        else:
+            export_to_json(name, data)
+    save_data_date_range(from_date, to_date)
+    save_data_datasets(datasets)
+
+    return so4t_data
+
+
+def get_api_date_range(args):
+    '''
+    Returns the date range (epoch seconds) of the reputation history and articles to get from
+    the API, or None for no limit. Their metrics only count items created in the report's date
+    range, so only that date range is needed. Questions are always fetched in full, since
+    answers and comments in the date range can be on older questions, and answer response times
+    include all answers
+    '''
+    # The 'fetch' command has no date range, so its data can be used for any report
+    if getattr(args, 'command', None) == 'fetch' or getattr(args, 'full_history', False):
+        return None, None
+    start_date = getattr(args, 'start_date', None)
+    end_date = getattr(args, 'end_date', None)
+    if not (start_date or end_date):
+        return None, None
+
+    from_date, to_date = get_date_range(args)
+    return (from_date if start_date else None), (to_date if end_date else None)
+
+
+def save_data_date_range(from_date, to_date):
+    # Records the date range of the reputation history and articles in the data directory, so
+    # that reports from the saved data (--no-api) can't use dates outside of it
+
+    file_path = os.path.join('data', 'date_range.json')
+    if from_date or to_date:
+        export_to_json('date_range', {'from_date': from_date, 'to_date': to_date})
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def check_data_date_range(start_date, end_date):
+    # Exits if the data directory only has the reputation history and articles of a date range
+    # that doesn't cover the report's date range
+
+    try:
+        with open(os.path.join('data', 'date_range.json'), 'r') as f:
+            data_date_range = json.load(f)
+    except FileNotFoundError: # the data directory has all data
+        return
+
+    from_date = data_date_range['from_date'] or 0
+    to_date = data_date_range['to_date'] or end_date
+    if start_date < from_date or end_date > to_date:
+        print("The data directory only has the reputation history and articles from "
+              f"{format_date(data_date_range['from_date'])} to "
+              f"{format_date(data_date_range['to_date'])}, which doesn't cover the date range of "
+              "this report. Get the data again without --start-date and --end-date (or with "
+              "--full-history), or use the 'fetch' command.")
+        raise SystemExit
+
+
+def save_data_datasets(datasets):
+    # Records which of the optional datasets were collected along with the users, so that
+    # reports from the saved data (--no-api) can't use the files of an earlier run
+
+    export_to_json('datasets', {'datasets': sorted(datasets)})
+
+
+def check_data_datasets(datasets):
+    # Exits if the data directory doesn't have current data for all of the datasets. Data
+    # directories from before data/datasets.json was added have all datasets of the same run
+
+    try:
+        with open(os.path.join('data', 'datasets.json'), 'r') as f:
+            collected_datasets = set(json.load(f)['datasets'])
+    except FileNotFoundError:
+        collected_datasets = set(OPTIONAL_DATASETS)
+
+    missing_datasets = [name for name in sorted(datasets) if name not in collected_datasets
+                        or not os.path.exists(os.path.join('data', f'{name}.json'))]
+    if missing_datasets:
+        print("The data directory doesn't have current data for: "
+              f"{', '.join(missing_datasets)}. The last run that used the API didn't collect "
+              "it (see data/datasets.json). Get the data again with columns that need it, or "
+              "use the 'fetch' command.")
+        raise SystemExit
+
+
+def format_date(date):
+
+    return time.strftime('%Y-%m-%d', time.localtime(date)) if date else 'any date'
+
+
+def get_subset_api_data(args, datasets=None):
+    '''
+    Gets the data of the users selected with --user-ids, --department, and --title. All users
+    are listed first (a small part of the data), to find the selected users; then only their
+    posts and reputation history are requested, through the per-user API endpoints.
+
+    Each question that a selected user asked, answered, or commented on is requested in full
+    (with all of its answers and comments), so the selected users' metrics are the same as in a
+    report of the whole instance. The data is not saved to the data directory, since it's only
+    part of the data
+    '''
+    if args.web_client:
+        from so4t_web_client import WebClient
+        web_client = WebClient(args.url)
+
+    v2client, v3client = create_api_clients(args)
+
+    so4t_data = {}
+    so4t_data['users'] = select_users(get_users(v2client, v3client), args)
+    print(f"Getting data for {len(so4t_data['users'])} selected users...")
+    if datasets is None:
+        datasets = set(OPTIONAL_DATASETS)
+    so4t_data['tags'] = get_tags(v3client) if 'tags' in datasets else [] # also gets tag SMEs
+    if args.web_client:
+        so4t_data['communities'] = web_client.get_communities()
+    else:
+        so4t_data['communities'] = None
+
+    user_ids = [user['user_id'] for user in so4t_data['users']]
+    from_date, to_date = get_api_date_range(args)
+    for name in ['reputation_history', 'questions', 'articles']:
+        so4t_data[name] = []
+    if 'reputation_history' in datasets:
+        so4t_data['reputation_history'] = get_reputation_history(
+            v2client, so4t_data['users'], from_date=from_date, to_date=to_date)
+    if 'questions' in datasets:
+        so4t_data['questions'] = get_user_questions(v2client, user_ids)
+    if 'articles' in datasets:
+        so4t_data['articles'] = v2client.get_posts_by_user_ids(
+            'articles', user_ids, get_article_filter(v2client), from_date, to_date)
 
-    # Export API data to JSON file
+    return so4t_data
+
+
+def get_user_questions(v2client, user_ids):
+    # Returns the questions that any of the users asked, answered, or commented on, with all of
+    # their answers and comments
+
+    question_filter = get_question_filter(v2client)
+    questions = v2client.get_posts_by_user_ids('questions', user_ids, question_filter)
+
+    # Only the IDs of the posts that the answers and comments are on are needed, which the
+    # default filter includes
+    answers = v2client.get_posts_by_user_ids('answers', user_ids)
+    comments = v2client.get_posts_by_user_ids('comments', user_ids)
+    question_ids = {answer['question_id'] for answer in answers}
+
+    # Comments can be on questions or answers. Post IDs are unique across both, so the IDs are
+    # sent to /answers; the ones that aren't answers are questions
+    post_ids = {comment['post_id'] for comment in comments}
+    if post_ids:
+        commented_answers = v2client.get_answers_by_ids(sorted(post_ids))
+        question_ids.update(answer['question_id'] for answer in commented_answers)
+        question_ids.update(post_ids - {answer['answer_id'] for answer in commented_answers})
+
+    question_ids -= {question['question_id'] for question in questions}
+    if question_ids:
+        questions += v2client.get_questions_by_ids(sorted(question_ids), question_filter)
+
+    return questions
+
+
+def create_api_clients(args):
+    '''
+    Returns the API v2.3 and v3 clients. Their connection tests run at the same time, unless
+    --skip-probe is used, in which case the first API call fails if the connection doesn't work
+    '''
+    # The API clients (and the requests library) are only imported when API calls are made, so
+    # commands that work offline, like 'process', start quickly
+    from so4t_api_v2 import V2Client
+    from so4t_api_v3 import V3Client
+
+    v2client = V2Client(args.url, args.key, args.token, probe=False)
+    v3client = V3Client(args.url, args.token, probe=False)
+    if not args.skip_probe:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            v2_probe = executor.submit(v2client.test_connection)
+            v3_probe = executor.submit(v3client.test_connection)
+            v2client.ssl_verify = v2_probe.result()
+            v3client.ssl_verify = v3_probe.result()
+
+    return v2client, v3client
+
+
+def fetch_api_data(args):
+    # Gets all data and saves it to JSON files, without processing it
+
+    api_data = get_api_data(args)
+    if args.stream: # the streamed datasets are only fetched and exported as they're consumed
+        for name in ['reputation_history', 'questions', 'articles']:
+            for _ in api_data[name]:
+                pass
+
+    print("All data saved to the data directory. To create the report, use the 'process' "
+          "command.")
+
+
+def scrape_web_data(args):
+    # Collects the data that's only available via the web client and saves it to JSON files
+
+    from so4t_web_client import WebClient
+    web_client = WebClient(args.url)
+    export_to_json('communities', web_client.get_communities())
+
+
+def read_api_data(args, datasets=None):
+    # Datasets that the report doesn't need (see get_report_datasets) aren't read
+
+    print("Skipping API calls and using data from JSON files in the data directory...")
+    if datasets is None:
+        datasets = set(OPTIONAL_DATASETS)
+    api_data = {name: [] for name in OPTIONAL_DATASETS}
+    api_data['users'] = read_json('users.json')
+    if 'tags' in datasets:
+        api_data['tags'] = read_json('tags.json')
+    api_data['communities'] = read_json('communities.json')
+
+    if args.processes > 1: # worker processes decode chunks of each file in parallel
+        read_dataset = read_json_chunks
+    elif args.stream: # posts are read one at a time while processing
+        read_dataset = stream_json
+    else:
+        read_dataset = read_json
+    for name in ['questions', 'articles']:
+        if name in datasets:
+            api_data[name] = read_dataset(f'{name}.json')
+    if 'reputation_history' in datasets:
+        if args.processes > 1 or args.stream:
+            api_data['reputation_store'] = open_reputation_store()
+        else:
+            api_data['reputation_history'] = read_json('reputation_history.json')
+    if read_dataset is read_json:
+        print("Data successfully loaded from JSON files.")
+
+    return api_data
+
+
+def get_api_delta(args, state):
+    '''
+    Gets the data that changed since the last sync of the metrics state. Users, tags, and
+    communities are small, so they're always fetched in full. Otherwise, only the reputation
+    events and comments since the last sync are fetched, along with the questions and articles
+    with activity since then, or that were referenced by one of those reputation events or
+    comments (votes, accepted answers, and new comments don't count as activity on a post)
+    '''
+    if args.web_client:
+        from so4t_web_client import WebClient
+        web_client = WebClient(args.url)
+
+    v2client, v3client = create_api_clients(args)
+
+    so4t_data = {}
+    so4t_data['users'] = get_users(v2client, v3client)
+    so4t_data['tags'] = get_tags(v3client) # also gets tag SMEs
+    if args.web_client:
+        so4t_data['communities'] = web_client.get_communities()
+    else:
+        so4t_data['communities'] = None
+
+    # Only the complete datasets are exported; the changed posts are kept in the metrics state
     for name, data in so4t_data.items():
         export_to_json(name, data)
+    save_data_datasets(['tags'])
+
+    so4t_data['reputation_history'] = get_reputation_history(v2client, so4t_data['users'],
+                                                             from_date=state.sync_date)
+    # Post IDs are unique across questions, answers, and articles, so the IDs of all changed
+    # posts can be sent to each endpoint; only the posts of the matching type are returned
+    changed_post_ids = {event['post_id'] for event in so4t_data['reputation_history']
+                        if event.get('post_id')}
+    comment_filter = v2client.create_filter(
+        WRAPPER_FILTER_ATTRIBUTES + ["comment.post_id"], base='none')
+    changed_post_ids.update(comment['post_id'] for comment in
+                            v2client.stream_all_comments(comment_filter,
+                                                         from_date=state.sync_date))
+
+    question_filter = get_question_filter(v2client)
+    questions = v2client.get_all_questions(question_filter, activity_since=state.sync_date)
+    if changed_post_ids:
+        # Answers are updated by re-fetching their question (with all of its answers)
+        answer_filter = v2client.create_filter(
+            WRAPPER_FILTER_ATTRIBUTES + ["answer.question_id"], base='none')
+        changed_question_ids = set(changed_post_ids)
+        for answer in v2client.get_answers_by_ids(changed_post_ids, answer_filter):
+            changed_question_ids.add(answer['question_id'])
+        changed_question_ids -= {question['question_id'] for question in questions}
+        questions += v2client.get_questions_by_ids(changed_question_ids, question_filter)
+    so4t_data['questions'] = questions
+
+    article_filter = get_article_filter(v2client)
+    articles = v2client.get_all_articles(article_filter, activity_since=state.sync_date)
+    if changed_post_ids:
+        changed_post_ids -= {article['article_id'] for article in articles}
+        articles += v2client.get_articles_by_ids(changed_post_ids, article_filter)
+    so4t_data['articles'] = articles
+
+    if args.check_deleted:
+        so4t_data['deleted_posts'] = find_deleted_posts(v2client, state)
 
     return so4t_data
 
 
+def find_deleted_posts(v2client, state):
+    '''
+    Returns a dictionary of post type -> list of IDs of the posts in the metrics state that no
+    longer exist. The IDs of all existing posts are listed with filters that only include the
+    ID, so each page of results is small
+    '''
+    endpoints = {
+        'question': (v2client.stream_all_questions, "/questions"),
+        'answer': (v2client.stream_all_answers, "/answers"),
+        'comment': (v2client.stream_all_comments, "/comments"),
+        'article': (v2client.stream_all_articles, "/articles")
+    }
+
+    deleted_posts = {}
+    for post_type, (stream_function, endpoint) in endpoints.items():
+        id_field = f"{post_type}_id"
+        filter_string = v2client.create_filter(
+            WRAPPER_FILTER_ATTRIBUTES + [f"{post_type}.{id_field}"], base='none')
+        existing_post_ids = {item[id_field] for item in stream_function(filter_string)}
+
+        # If the listing was cut short (e.g. by an API error), every post that wasn't listed
+        # would look deleted, so the check is skipped unless the listing is known to be complete
+        post_count = v2client.get_item_count(endpoint)
+        if post_count is None or len(existing_post_ids) < post_count:
+            print(f"Unable to list all {post_type}s. Skipping the check for deleted {post_type}s.")
+            continue
+
+        deleted_posts[post_type] = [post_id for post_id in state.get_post_ids(post_type)
+                                    if post_id not in existing_post_ids]
+        print(f"Found {len(deleted_posts[post_type])} deleted {post_type}s")
+
+    return deleted_posts
+
+
 def get_users(v2client, v3client):
 
     # Filter documentation: https://api.stackexchange.com/docs/filters
+    # The filter only includes the user fields that are used by the report (e.g. no badge counts,
+    # profile images, or website links), which substantially reduces the size of each response
     if 'soedemo' in v2client.api_url: # for internal testing
         filter_string = ''
-    elif v2client.soe: # Stack Overflow Enterprise requires the generation of a custom filter
-        filter_attributes = [
-            "user.is_deactivated" # this attribute is only available in Enterprise and in API v2
+    else:
+        filter_attributes = WRAPPER_FILTER_ATTRIBUTES + [
+            "user.account_id",
+            "user.creation_date",
+            "user.display_name",
+            "user.last_access_date",
+            "user.link",
+            "user.user_id"
         ]
-        filter_string = v2client.create_filter(filter_attributes)
-    else: # Stack Overflow Business or Basic
-        filter_string = ''
+        if v2client.soe:
+            # this attribute is only available in Enterprise and in API v2
+            filter_attributes.append("user.is_deactivated")
+        filter_string = v2client.create_filter(filter_attributes, base='none')
 
     v2_users = v2client.get_all_users(filter_string)
 
@@ -192,15 +1016,44 @@ def get_users(v2client, v3client):
     return v2_users
 
 
-def get_reputation_history(v2client, users):
+def get_reputation_history(v2client, users, stream=False, from_date=None, to_date=None):
+
+    # Filter documentation: https://api.stackexchange.com/docs/filters
+    # Reputation events are summed per user, which only needs the user, date, and change. The
+    # post ID and event type identify each event, so it can be de-duplicated and traced back to
+    # the voted-on post by incremental updates
+    filter_attributes = WRAPPER_FILTER_ATTRIBUTES + [
+        "reputation_history.creation_date",
+        "reputation_history.post_id",
+        "reputation_history.reputation_change",
+        "reputation_history.reputation_history_type",
+        "reputation_history.user_id"
+    ]
+    filter_string = v2client.create_filter(filter_attributes, base='none')
 
     user_ids = [user['user_id'] for user in users]
-    reputation_history = v2client.get_reputation_history(user_ids)
+    if stream:
+        reputation_history = v2client.stream_reputation_history(user_ids, filter_string,
+                                                                from_date, to_date)
+    else:
+        reputation_history = v2client.get_reputation_history(user_ids, filter_string, from_date,
+                                                             to_date)
 
     return reputation_history
 
 
-def get_questions_answers_comments(v2client):
+def get_questions_answers_comments(v2client, stream=False, shards=1):
+
+    filter_string = get_question_filter(v2client)
+    if stream:
+        questions = v2client.stream_all_questions(filter_string, shards=shards)
+    else:
+        questions = v2client.get_all_questions(filter_string, shards=shards)
+
+    return questions
+
+
+def get_question_filter(v2client):
     
     # The API filter used for the /questions endpoint makes it so that the API returns
     # all answers and comments for each question. This is more efficient than making
@@ -235,12 +1088,24 @@ def get_questions_answers_comments(v2client):
         filter_string = v2client.create_filter(filter_attributes)
     else: # Stack Overflow Business or Basic
         filter_string = '!X9DEEiFwy0OeSWoJzb.QMqab2wPSk.X2opZDa2L'
-    questions = v2client.get_all_questions(filter_string)
 
-    return questions
+    return filter_string
+
+
+def get_articles(v2client, stream=False, shards=1, from_date=None, to_date=None):
 
+    filter_string = get_article_filter(v2client)
+    if stream:
+        articles = v2client.stream_all_articles(filter_string, shards=shards,
+                                                from_date=from_date, to_date=to_date)
+    else:
+        articles = v2client.get_all_articles(filter_string, shards=shards, from_date=from_date,
+                                             to_date=to_date)
+
+    return articles
 
-def get_articles(v2client):
+
+def get_article_filter(v2client):
 
     # Filter documentation: https://api.stackexchange.com/docs/filters
     if v2client.soe:
@@ -258,9 +1123,7 @@ def get_articles(v2client):
     else: # Stack Overflow Business or Basic
         filter_string = '!*Mg4Pjg9LXr9d_(v'
 
-    articles = v2client.get_all_articles(filter_string)
-
-    return articles
+    return filter_string
 
 
 def get_tags(v3client):
@@ -280,23 +1143,175 @@ def get_tags(v3client):
     return tags
 
 
-def process_api_data(api_data, start_date, end_date):
+def process_api_data(api_data, start_date, end_date, metrics=None):
 
     users = api_data['users']
     users = add_new_user_fields(users)
     users = process_tags(users, api_data['tags'])
+    users = process_communities(users, api_data.get('communities'))
     users = process_questions(users, api_data['questions'])
     users = process_articles(users, api_data['articles'])
     users = process_reputation_history(users, api_data['reputation_history'])
-    users = process_users(users, start_date, end_date)
-
-    # tags = process_communities(tags, api_data.get('communities'))
+    users = process_users(users, start_date, end_date, metrics)
 
     export_to_json('user_metrics', users)
     
     return users
 
 
+def process_incremental_data(args):
+    '''
+    Updates the saved metrics state (see so4t_incremental.py) with the data that changed since
+    the last run and returns the users with their metrics for the full history. If there's no
+    saved state yet, all data is fetched to create it
+    '''
+    state_file = os.path.join('data', 'metrics_state.json')
+    state = MetricsState.load(state_file)
+
+    if args.no_api:
+        if not state:
+            print(f"No saved metrics state found ({state_file}). Run with --incremental without "
+                  "--no-api first.")
+            raise SystemExit
+        print("Skipping API calls and using the saved metrics state...")
+        api_data = {}
+        api_data['users'] = read_json('users.json')
+        api_data['tags'] = read_json('tags.json')
+        api_data['communities'] = read_json('communities.json')
+    else:
+        sync_date = int(time.time())
+        if state:
+            last_sync = time.strftime('%Y-%m-%d %H:%M', time.localtime(state.sync_date))
+            print(f"Getting data that changed since the last sync ({last_sync})...")
+            api_data = get_api_delta(args, state)
+        else:
+            print("No saved metrics state found. Getting all data to create it...")
+            state = MetricsState()
+            api_data = get_api_data(args)
+
+        state.start_sync(sync_date)
+        for post_type, post_ids in api_data.get('deleted_posts', {}).items():
+            state.remove_posts(post_type, post_ids)
+        state.apply_questions(api_data['questions'])
+        state.apply_articles(api_data['articles'])
+        state.apply_reputation_history(api_data['reputation_history'])
+        state.save(state_file)
+
+    users = add_new_user_fields(api_data['users'])
+    users = process_tags(users, api_data['tags'])
+    users = process_communities(users, api_data.get('communities'))
+    users = state.get_users(users)
+
+    export_to_json('user_metrics', users)
+
+    return users
+
+
+def process_indexed_data(start_date, end_date):
+    # Calculates user metrics for a date range from the metrics index
+
+    users = get_user_profiles()
+    users = get_metrics_index().get_users(users, start_date, end_date)
+
+    export_to_json('user_metrics', users)
+
+    return users
+
+
+def get_metrics_index():
+    '''
+    Returns the metrics index (see so4t_metrics_index.py). The index is created from the JSON
+    files in the data directory the first time, and recreated whenever one of them has changed
+    '''
+    index_file = os.path.join('data', 'metrics_index.json')
+    check_data_datasets(INDEX_DATASETS)
+    sources = get_data_sources(INDEX_SOURCE_FILES)
+
+    index = MetricsIndex.load(index_file)
+    if not index or index.sources != sources:
+        print("Creating metrics index from the JSON files in the data directory...")
+        with open_reputation_store() as reputation_store:
+            index = MetricsIndex.build(stream_json('questions.json'), stream_json('articles.json'),
+                                       reputation_store)
+        index.sources = sources
+        index.save(index_file)
+
+    return index
+
+
+def get_user_profiles():
+    # Returns the users from the data directory, with all fields except their metrics
+
+    users = read_json('users.json')
+    users = add_new_user_fields(users)
+    users = process_tags(users, read_json('tags.json'))
+    users = process_communities(users, read_json('communities.json'))
+
+    return users
+
+
+def get_data_sources(file_names):
+    # Returns a dictionary of file name -> modification time, for files in the data directory
+
+    return {file_name: os.path.getmtime(os.path.join('data', file_name))
+            for file_name in file_names}
+
+
+def serve_metrics(args):
+    # Answers queries about user metrics over HTTP, from the data in the data directory
+
+    from so4t_server import serve
+
+    source_files = ['users.json', 'tags.json', 'communities.json'] + INDEX_SOURCE_FILES
+    if os.path.exists(os.path.join('data', 'date_range.json')):
+        print("Warning: the data directory only has the reputation history and articles of the "
+              "date range of the last report (see data/date_range.json). Metrics for other "
+              "dates will be incomplete.")
+    serve(lambda: (get_user_profiles(), get_metrics_index()),
+          lambda: get_data_sources(source_files),
+          args.host, args.port, args.reload_interval)
+
+
+def process_streamed_data(api_data, start_date, end_date, processes=1, metrics=None):
+    '''
+    Streaming alternative to process_api_data. Questions (with their answers and comments),
+    articles, and reputation events are counted toward each user's metrics as they're received,
+    then discarded, so the posts are never all held in memory at once
+
+    With more than one process, the questions, articles, and reputation history in api_data
+    must be iterables of chunks (see split_into_chunks and read_json_chunks), which are
+    aggregated by a pool of worker processes
+    '''
+    users = api_data['users']
+    users = add_new_user_fields(users)
+    users = process_tags(users, api_data['tags'])
+    users = process_communities(users, api_data.get('communities'))
+
+    # Data read from JSON files has the reputation history in a reputation store instead
+    reputation_store = api_data.get('reputation_store')
+    dataset_names = ['questions', 'articles']
+    if not reputation_store:
+        dataset_names.append('reputation_history')
+
+    aggregator = MetricsAggregator(users, start_date, end_date, metrics=metrics)
+    if processes > 1:
+        datasets = [(name, api_data[name]) for name in dataset_names]
+        aggregate_in_parallel(aggregator, datasets, processes)
+    else:
+        aggregator.add_questions(api_data['questions'])
+        aggregator.add_articles(api_data['articles'])
+        if not reputation_store:
+            aggregator.add_reputation_history(api_data['reputation_history'])
+    if reputation_store:
+        with reputation_store:
+            aggregator.add_reputation_store(reputation_store)
+    users = aggregator.get_users()
+
+    export_to_json('user_metrics', users)
+
+    return users
+
+
 def add_new_user_fields(users):
 
     for user in users:
@@ -374,6 +1389,34 @@ def process_tags(users, tags):
     return users
 
 
+def process_communities(users, communities):
+    '''
+    Add the names of the communities each user is a member of to a new field on the user object
+    Community membership is indexed by user ID first, so that joining it onto the users is a
+    single dictionary lookup per user
+    '''
+    if not communities: # web client not used or communities feature not turned on
+        return users
+
+    community_memberships = index_community_members(communities)
+    for user in users:
+        user['communities'] = community_memberships.get(user['user_id'], [])
+
+    return users
+
+
+def index_community_members(communities):
+    '''
+    Returns a dictionary of user ID -> list of names of the communities the user is a member of
+    '''
+    community_memberships = {}
+    for community in communities:
+        for member in community['members']:
+            community_memberships.setdefault(member['id'], []).append(community['name'])
+
+    return community_memberships
+
+
 def process_questions(users, questions):
 
     for question in questions:
@@ -456,105 +1499,53 @@ def process_articles(users, articles):
     return users
 
 
-def process_users(users, start_date, end_date):
+def process_users(users, start_date, end_date, metrics=None):
+    # Only the metrics in `metrics` are counted (all of them, if it's None)
 
+    count_question = compile_counter('question', metrics)
+    count_answer = compile_counter('answer', metrics)
+    count_article = compile_counter('article', metrics)
+    count_comment = compile_counter('comment', metrics)
+    count_reputation_event = compile_counter('reputation', metrics)
 
     for user in users:
         for question in user['questions']:
-            if question['creation_date'] > start_date and question['creation_date'] < end_date:
-                user['question_count'] += 1
-                user['question_upvotes'] += question['up_vote_count']
-                user['question_downvotes'] += question['down_vote_count']
-                if question['answer_count'] == 0:
-                    user['questions_with_no_answers'] += 1
+            count_question(user, question, start_date, end_date)
 
         for answer in user['answers']:
-            if answer['creation_date'] > start_date and answer['creation_date'] < end_date:
-                user['answer_count'] += 1
-                user['answer_upvotes'] += answer['up_vote_count']
-                user['answer_downvotes'] += answer['down_vote_count']
-                if answer['is_accepted']:
-                    user['answers_accepted'] += 1
+            count_answer(user, answer, start_date, end_date)
 
         for article in user['articles']:
-            if article['creation_date'] > start_date and article['creation_date'] < end_date:
-                user['article_count'] += 1
-                user['article_upvotes'] += article['score']
+            count_article(user, article, start_date, end_date)
 
         for comment in user['comments']:
-            if comment['creation_date'] > start_date and comment['creation_date'] < end_date:
-                user['comment_count'] += 1
+            count_comment(user, comment, start_date, end_date)
 
         for event in user['reputation_history']:
-            if event['creation_date'] > start_date and event['creation_date'] < end_date:
-                user['net_reputation'] += event['reputation_change']
-
-        for answer_response_time in user['answer_response_times']:
-            if answer_response_time <= 0:
-                user['answer_response_times'].remove(answer_response_time)
-
-        if user['answer_response_times']:
-            user['answer_response_time_median'] = round(
-                statistics.median(user['answer_response_times']), 2)
-        else:
-            user['answer_response_time_median'] = ''
+            count_reputation_event(user, event, start_date, end_date)
 
-        user['total_upvotes'] = user['question_upvotes'] + user['answer_upvotes'] + \
-            user['article_upvotes']
-        user['total_downvotes'] = user['question_downvotes'] + user['answer_downvotes']
+        finalize_user_metrics(user)
 
     return users
 
 
-def create_user_report(users, start_date, end_date):
+def create_user_report(users, start_date, end_date, parquet=False, subset_name=None,
+                       columns=DEFAULT_COLUMNS):
 
-    # Create a list of user dictionaries, sorted by net reputation
-    sorted_users = sorted(users, key=lambda k: k['net_reputation'], reverse=True)
+    # Create a list of user dictionaries, sorted by net reputation (if it's in the report)
+    if 'net_reputation' in columns:
+        users = sorted(users, key=lambda k: k['net_reputation'], reverse=True)
 
     # Select fields for the user report
     user_metrics = []
-    for user in sorted_users:
+    for user in users:
         try:
-            user_metric = {
-                'User ID': user['user_id'],
-                'Display Name': user['display_name'],
-                'Net Reputation': user['net_reputation'],
-                'Account Longevity (Days)': user['account_longevity_days'],
-                'Account Inactivity (Days)': user['account_inactivity_days'],
-
-                'Questions': user['question_count'],
-                'Questions With No Answers': user['questions_with_no_answers'],
-                # 'Question Upvotes': user['question_upvotes'],
-                # 'Question Downvotes': user['question_downvotes'],
-
-                'Answers': user['answer_count'],
-                # 'Answer Upvotes': user['answer_upvotes'],
-                # 'Answer Downvotes': user['answer_downvotes'],
-                'Answers Accepted': user['answers_accepted'],
-                'Median Answer Time (Hours)': user['answer_response_time_median'],
-
-                'Articles': user['article_count'],
-                # 'Article Upvotes': user['article_upvotes'],
-
-                'Comments': user['comment_count'],
-
-                'Total Upvotes': user['total_upvotes'],
-                'Total Downvotes': user['total_downvotes'],
-
-                # 'Searches': user['searches'],
-                # 'Communities': user['communities'],
-                'SME Tags': ', '.join(user['sme_tags']),
-                # 'Watched Tags': user['watched_tags'],
-
-                'Account Status': user['account_status'],
-                'Moderator': user['moderator'],
-
-                'Email': user['email'],
-                'Title': user['title'],
-                'Department': user['department'],
-                'External ID': user['external_id'],
-                'Account ID': user['account_id']
-            }
+            user_metric = {}
+            for column in columns:
+                value = user[column]
+                if isinstance(value, list): # e.g. SME tags or communities
+                    value = ', '.join(value)
+                user_metric[REPORT_COLUMNS[column]] = value
         except KeyError as e:
             print(f"KeyError: missing [{e.args[0]}] key for user {user['user_id']}")
             print(f"Link to user: {user.get('link')}")
@@ -565,11 +1556,25 @@ def create_user_report(users, start_date, end_date):
         user_metrics.append(user_metric)
     
 
-    # Export user metrics to CSV
+    # Export user metrics to CSV (and Parquet, if requested)
     if start_date and end_date:
-        export_to_csv(f'user_metrics_{start_date}_to_{end_date}', user_metrics)
+        report_name = f'user_metrics_{start_date}_to_{end_date}'
     else:
-        export_to_csv('user_metrics', user_metrics)
+        report_name = 'user_metrics'
+    if subset_name:
+        report_name += f'_{subset_name}'
+    export_to_csv(report_name, user_metrics)
+    if parquet:
+        from so4t_parquet import export_report_to_parquet
+        export_report_to_parquet(report_name, user_metrics)
+
+
+def export_datasets_to_parquet():
+    # Converts the JSON files of the raw datasets to Parquet files, reading them as a stream
+
+    from so4t_parquet import export_dataset_to_parquet
+    for dataset_name in ['users', 'reputation_history', 'questions', 'articles']:
+        export_dataset_to_parquet(dataset_name, stream_json(dataset_name + '.json'))
 
 
 def get_user_index(users, user_id):
@@ -581,74 +1586,6 @@ def get_user_index(users, user_id):
     return None # if user is not found
 
 
-def initialize_deleted_user(user_id, display_name):
-
-    user = {
-        'user_id': user_id,
-        'display_name': f"{display_name} (DELETED)",
-
-        'questions': [],
-        'question_count': 0,
-        'questions_with_no_answers': 0,
-        'question_upvotes': 0,
-        'question_downvotes': 0,
-
-        'answers': [],
-        'answer_count': 0,
-        'answer_upvotes': 0,
-        'answer_downvotes': 0,
-        'answers_accepted': 0,
-        'answer_response_times': [],
-
-        'articles': [],
-        'article_count': 0,
-        'article_upvotes': 0,
-
-        'comments': [],
-        'comment_count': 0,
-
-        'total_upvotes': 0,
-        'reputation_history': [],
-        'net_reputation': 0,
-
-        'searches': [],
-        'communities': [],
-        'sme_tags': [],
-        'watched_tags': [],
-        
-        'moderator': '',
-        'email': '',
-        'title': '',
-        'department': '',
-        'external_id': '',
-        'account_id': '',
-        'account_longevity_days': '',
-        'account_inactivity_days': '',
-        'account_status': 'Deleted'
-    }
-
-    return user
-
-
-def validate_user_id(user):
-    """
-    Checks to see if a user_id is present. If not, the user has been deleted. In this case, the
-    user_id can be extracted from the display_name. For example, if a deleted user's display_name
-    is 'user123', the user_id will be 123."""
-
-    try:
-        user_id = user['user_id']
-    except KeyError: # if user_id is not present, the user was deleted
-        try:
-            user_id = int(user['display_name'].split('user')[1])
-        except IndexError:
-            # This shouldn't happen, but if it does, the user_id will be the display name
-            # This seems to only happen in the internal testing environment
-            user_id = user['display_name']
-
-    return user_id
-
-
 def export_to_csv(data_name, data):
 
     date = time.strftime("%Y-%m-%d")
@@ -679,6 +1616,31 @@ def export_to_json(data_name, data):
     print(f'JSON file created: {file_name}')
 
 
+def export_to_json_stream(data_name, data):
+    '''
+    Generator that writes each item of `data` to a JSON file as it passes through, so that
+    streamed data can be exported without holding all of it in memory. The file contains a
+    JSON list (one item per line) and can be read with either read_json or stream_json
+    '''
+    file_name = data_name + '.json'
+    directory = 'data'
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    file_path = os.path.join(directory, file_name)
+
+    with open(file_path, 'w') as f:
+        f.write('[')
+        separator = '\n'
+        for item in data:
+            f.write(separator + json.dumps(item))
+            separator = ',\n'
+            yield item
+        f.write('\n]\n')
+
+    print(f'JSON file created: {file_name}')
+
+
 def read_json(file_name):
     
     directory = 'data'
@@ -693,6 +1655,123 @@ def read_json(file_name):
     return data
 
 
+def open_reputation_store():
+    '''
+    Opens the binary copy of reputation_history.json (see so4t_reputation_store.py), which is
+    created the first time it's needed, and recreated whenever the JSON file has changed
+    '''
+    directory = 'data'
+    json_file_path = os.path.join(directory, 'reputation_history.json')
+    store_file_path = os.path.join(directory, 'reputation_history.bin')
+
+    try:
+        json_modified = os.path.getmtime(json_file_path)
+    except FileNotFoundError:
+        print(f"File not found: {json_file_path}")
+        raise FileNotFoundError
+
+    if not os.path.exists(store_file_path) or os.path.getmtime(store_file_path) < json_modified:
+        print("Creating reputation store from reputation_history.json...")
+        build_reputation_store(stream_json('reputation_history.json'), store_file_path)
+
+    return ReputationStore(store_file_path)
+
+
+def stream_json(file_name, chunk_size=1048576):
+    '''
+    Generator that yields the items of a JSON file containing a list, one at a time, reading
+    the file in chunks rather than loading all of it into memory
+    '''
+    directory = 'data'
+    file_path = os.path.join(directory, file_name)
+    decoder = json.JSONDecoder()
+
+    try:
+        f = open(file_path, 'r')
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        raise FileNotFoundError
+
+    with f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            print(f"Expected a JSON list in {file_path}")
+            raise SystemExit
+        index = 1
+
+        while True:
+            # Skip over whitespace and the commas between items, reading more if needed
+            while index < len(buffer) and buffer[index] in ' \t\r\n,':
+                index += 1
+            if index == len(buffer):
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    print(f"Unexpected end of file: {file_path}")
+                    raise SystemExit
+                buffer, index = chunk, 0
+                continue
+
+            if buffer[index] == ']': # end of the list
+                return
+
+            try:
+                item, index = decoder.raw_decode(buffer, index)
+            except json.decoder.JSONDecodeError: # item continues past the end of the buffer
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, index = buffer[index:] + chunk, 0
+                continue
+
+            yield item
+
+            # Discard the part of the buffer that has already been decoded
+            if index > chunk_size:
+                buffer, index = buffer[index:], 0
+
+
+def read_json_chunks(file_name, chunk_size=CHUNK_SIZE):
+    '''
+    Generator that splits a JSON file containing a list into chunks of JSON text, each one a
+    list of up to `chunk_size` items. The chunks are not decoded here, so that decoding can be
+    done by worker processes in parallel
+
+    Item boundaries are found from the layout of the files written by this script: with
+    export_to_json (indent=4), each item ends with a line that is exactly "    }"; with
+    export_to_json_stream, each item is on its own line. Any other layout is decoded here instead
+    '''
+    directory = 'data'
+    file_path = os.path.join(directory, file_name)
+
+    try:
+        f = open(file_path, 'r')
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        raise FileNotFoundError
+
+    with f:
+        if f.readline().strip() != '[': # not a layout written by this script (or an empty list)
+            yield from split_into_chunks(stream_json(file_name), chunk_size)
+            return
+
+        lines = []
+        item_count = 0
+        for line in f:
+            stripped_line = line.rstrip().rstrip(',')
+            if stripped_line in ['', ']']:
+                continue
+            lines.append(line)
+            if stripped_line == '    }' or (line.startswith('{') and stripped_line.endswith('}')):
+                item_count += 1
+                if item_count == chunk_size:
+                    yield '[' + ''.join(lines).rstrip().rstrip(',') + ']'
+                    lines = []
+                    item_count = 0
+
+        if lines:
+            yield '[' + ''.join(lines).rstrip().rstrip(',') + ']'
+
+
 if __name__ == '__main__':
 
     main()
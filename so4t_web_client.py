@@ -1,16 +1,46 @@
 # Standard Python libraries
+import concurrent.futures
+import importlib.util
 import re
+import threading
 import time
 
 # Third-party libraries
 import requests
 from selenium import webdriver
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Local libraries
+from so4t_cache import read_cache, write_cache
+
+# lxml is an optional, considerably faster parser backend for BeautifulSoup. If it isn't
+# installed, fall back to Python's built-in (pure-Python) parser
+if importlib.util.find_spec('lxml'):
+    HTML_PARSER = 'lxml'
+else:
+    HTML_PARSER = 'html.parser'
+
+# Class of the pagination links at the bottom of paginated pages
+PAGINATION_CLASS = {'class': 's-pagination--item js-pagination-item'}
+
+# HTTP status codes that indicate a transient problem worth retrying
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# Scraped user data is reused until the user's last access date changes, or for this long (in
+# seconds) at most, to pick up changes that aren't made by the user (e.g. by an admin)
+USER_CACHE_PERIOD = 7 * 24 * 60 * 60
+
+
+def class_pattern(class_name):
+    # While parsing, a SoupStrainer sees the raw class attribute (e.g. "d-grid gs16") rather than
+    # the individual class names, so a single class name has to be matched within it
+    return re.compile(rf'(^|\s){re.escape(class_name)}(\s|$)')
 
 
 class WebClient(object):
     
-    def __init__(self, url):
+    def __init__(self, url, max_workers=8, request_interval=0.05, max_retries=3,
+                 user_cache_period=USER_CACHE_PERIOD):
     
         if "stackoverflowteams.com" in url: # Stack Overflow Business or Basic
             self.soe = False
@@ -18,6 +48,17 @@ class WebClient(object):
             self.soe = True
         
         self.base_url = url
+
+        # Per-user scraping runs on a bounded pool of worker threads that share one session
+        # `request_interval` is the politeness limit: the minimum number of seconds between any
+        # two requests sent to the site, regardless of how many workers are running
+        self.max_workers = max_workers
+        self.request_interval = request_interval
+        self.max_retries = max_retries
+        self.user_cache_period = user_cache_period # 0 scrapes every user on every run
+        self.throttle_lock = threading.Lock()
+        self.next_request_time = 0
+
         self.s = self.create_session() # create a Requests session with authentication cookies
         self.admin = self.validate_admin_permissions() # check if user has admin permissions
 
@@ -26,11 +67,25 @@ class WebClient(object):
 
         s = requests.Session()
 
-        # Configure Chrome driver
-        options = webdriver.ChromeOptions()
-        options.add_argument("--window-size=500,800")
-        options.add_experimental_option("excludeSwitches", ['enable-automation'])
-        driver = webdriver.Chrome(options=options)
+        # Size the connection pool to the number of worker threads so that concurrent scraping
+        # reuses connections instead of opening (and discarding) new ones
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_workers,
+                                                pool_maxsize=self.max_workers)
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+
+        # Reuse the authentication cookies from a previous run if they're still valid
+        if self.load_session_cookies(s):
+            print('Found saved authentication cookies. Testing session...')
+            self.s = s # test_session() uses the class session
+            try:
+                if self.test_session():
+                    print('Saved session is valid. Skipping login.')
+                    return s
+            except requests.exceptions.RequestException:
+                pass
+            print('Saved session is no longer valid. A new login is required.')
+            s.cookies.clear()
 
         # Check if URL is valid
         try:
@@ -50,6 +105,12 @@ class WebClient(object):
             print("Please check your URL and try again.")
             raise SystemExit
         
+        # Configure Chrome driver
+        options = webdriver.ChromeOptions()
+        options.add_argument("--window-size=500,800")
+        options.add_experimental_option("excludeSwitches", ['enable-automation'])
+        driver = webdriver.Chrome(options=options)
+
         # Open a Chrome window and log in to the site
         print('Opening a Chrome window to authenticate Stack Overflow for Teams...')
         driver.get(self.base_url)
@@ -67,13 +128,59 @@ class WebClient(object):
             s.cookies.set(cookie['name'], cookie['value'])
         driver.close()
         driver.quit()
+
+        self.save_session_cookies(cookies)
         
         return s
     
 
+    def load_session_cookies(self, s):
+        # Loads saved authentication cookies for this base URL into the Requests session
+        # Expired cookies are skipped. Short-lived cookies (e.g. analytics or load balancer
+        # cookies) expire long before the login does, so testing the session decides whether
+        # it's still valid. Returns False if there are no unexpired cookies to test
+
+        saved_session = read_cache('sessions').get(self.base_url)
+        if not saved_session:
+            return False
+
+        cookies = [cookie for cookie in saved_session['cookies']
+                   if not cookie.get('expiry') or cookie['expiry'] > time.time()]
+        if not cookies:
+            print('Saved authentication cookies have expired.')
+            return False
+
+        for cookie in cookies:
+            s.cookies.set(cookie['name'], cookie['value'])
+
+        return True
+
+
+    def save_session_cookies(self, cookies):
+        # Saves the authentication cookies from the Selenium driver, keyed by base URL, so that
+        # subsequent runs can skip the browser login. The file is only readable by the current
+        # user, since the cookies grant access to the site
+
+        sessions = read_cache('sessions')
+        sessions[self.base_url] = {
+            'cookies': [
+                {
+                    'name': cookie['name'],
+                    'value': cookie['value'],
+                    'expiry': cookie.get('expiry')
+                }
+                for cookie in cookies
+            ],
+            'creation_date': int(time.time())
+        }
+        write_cache('sessions', sessions, private=True)
+        print('Authentication cookies saved for future runs.')
+
+
     def test_session(self):
 
-        soup = self.get_page_soup(f"{self.base_url}/users")
+        soup = self.get_page_soup(f"{self.base_url}/users",
+                                  parse_only=SoupStrainer('li', {'role': 'none'}))
         if soup.find('li', {'role': 'none'}): # this element is only shows if the user is logged in
             return True
         else:
@@ -114,7 +221,8 @@ class WebClient(object):
 
         print("Getting communities")
         communities_url = f"{self.base_url}/communities"
-        communities_page = self.get_page_soup(communities_url)
+        communities_page = self.get_page_soup(
+            communities_url, parse_only=SoupStrainer('div', {'class': class_pattern('d-grid')}))
         community_grid = communities_page.find('div', {'class': 'd-grid'})
 
         try:
@@ -144,30 +252,59 @@ class WebClient(object):
                 }
                 community['tags'].append(tag_info)
 
-            # Get community members
-            print(f"Getting membership for the {community['name']} community")
-            members_url = f"{community['url']}/members"
-            member_table = self.get_page_soup(members_url).find('tbody')
+            communities.append(community)
 
-            try:
-                member_rows = member_table.find_all('tr')
-            except AttributeError: # no members found
+        # Get community members. The first members page of every community is fetched
+        # concurrently, which also reveals how many pages each community has; then all of the
+        # remaining pages (for large communities) are fetched concurrently
+        print(f"Getting membership for {len(communities)} communities")
+        members_urls = [f"{community['url']}/members" for community in communities]
+        first_pages = self.scrape_pages(members_urls, self.scrape_community_members_page)
+
+        remaining_pages = []
+        for community, (members, page_count) in zip(communities, first_pages):
+            community['members'] += members
+            for page in range(2, page_count + 1):
+                remaining_pages.append((community, f"{community['url']}/members?page={page}"))
+
+        if remaining_pages:
+            print(f"Getting {len(remaining_pages)} additional pages of community members")
+            page_urls = [page_url for community, page_url in remaining_pages]
+            results = self.scrape_pages(page_urls, self.scrape_community_members_page)
+            for (community, page_url), (members, page_count) in zip(remaining_pages, results):
+                community['members'] += members
+
+        for community in communities:
+            if not community['members']:
                 print(f"No members found for the {community['name']} community")
-                continue
 
-            for row in member_rows:
-                name_column = row.find('th')
-                name_field = name_column.find_all('a')[-1]
-                member = {
-                    'name': self.strip_html(name_field.text),
-                    'id': int(name_field['href'].split('/')[-1]),
-                    'url': f"{self.base_url}/users/{name_field['href'].split('/')[-1]}"
-                }
-                community['members'].append(member)
+        return communities
 
-            communities.append(community)
 
-        return communities
+    def scrape_community_members_page(self, page_url):
+        # Returns a tuple of (list of members on the page, number of member pages)
+        # Only the member table and links (which include the pagination links) are parsed
+
+        soup = self.get_page_soup(page_url, parse_only=SoupStrainer(['tbody', 'a']))
+        page_count = self.count_pages(soup)
+
+        try:
+            member_rows = soup.find('tbody').find_all('tr')
+        except AttributeError: # no members found
+            return [], page_count
+
+        members = []
+        for row in member_rows:
+            name_column = row.find('th')
+            name_field = name_column.find_all('a')[-1]
+            member = {
+                'name': self.strip_html(name_field.text),
+                'id': int(name_field['href'].split('/')[-1]),
+                'url': f"{self.base_url}/users/{name_field['href'].split('/')[-1]}"
+            }
+            members.append(member)
+
+        return members, page_count
 
 
     def get_user_title_and_dept(self, users):
@@ -183,24 +320,28 @@ class WebClient(object):
             users: list of user dictionaries with 'title' and 'department' keys added
         """
 
-        for user in users:
-            if user['user_id'] <= 1: # skip the Community user and user groups
-                continue
+        print("Getting title and department for each user...")
+        return self.scrape_users(users, self.scrape_user_title_and_dept, 'title and department')
 
-            print(f"Getting title and department for user ID {user['user_id']}")
-            user_url = f"{self.base_url}/users/{user['user_id']}"
-            soup = self.get_page_soup(user_url)
-            title_dept = soup.find('div', {'class': 'mb8 fc-light fs-title lh-xs'})
-            try:
-                user['department'] = title_dept.text.split(', ')[-1]
-                user['title'] = title_dept.text.split(f", {user['department']}")[0]
-            except AttributeError: # if no title/dept returned, `text` method will not work on None
-                user['department'] = ''
-            except IndexError: # if using old title format
-                user['title'] = title_dept.text
-                user['department'] = ''
-        
-        return users
+
+    def scrape_user_title_and_dept(self, user):
+        # Returns a dictionary with the 'title' and 'department' scraped from the profile page
+
+        user_url = f"{self.base_url}/users/{user['user_id']}"
+        title_dept_class = {'class': 'mb8 fc-light fs-title lh-xs'}
+        soup = self.get_page_soup(user_url, parse_only=SoupStrainer('div', title_dept_class))
+        title_dept = soup.find('div', title_dept_class)
+        user_fields = {}
+        try:
+            user_fields['department'] = title_dept.text.split(', ')[-1]
+            user_fields['title'] = title_dept.text.split(f", {user_fields['department']}")[0]
+        except AttributeError: # if no title/dept returned, `text` method will not work on None
+            user_fields['department'] = ''
+        except IndexError: # if using old title format
+            user_fields['title'] = title_dept.text
+            user_fields['department'] = ''
+
+        return user_fields
     
 
     def get_user_watched_tags(self, users):
@@ -224,23 +365,24 @@ class WebClient(object):
             print('Not able to obtain user watched tags. This requires admin permissions.')
             return users
 
-        for user in users:
-            if user['user_id'] <= 1: # skip the Community user and user groups
-                continue
+        print("Getting watched tags for each user...")
+        return self.scrape_users(users, self.scrape_user_watched_tags, 'watched tags')
 
-            print(f"Getting watched tags for user ID {user['user_id']}")
-            watched_tags_url = f"{self.base_url}/users/tag-notifications/{user['user_id']}"
-            soup = self.get_page_soup(watched_tags_url)
-            try:
-                watched_tag_rows = soup.find('table', {'class': '-settings'}).find_all('tr')
-                user['watched_tags'] = [self.strip_html(tag.find('td').text) 
-                                        for tag in watched_tag_rows]
-            except AttributeError: # if user has no watched tags
-                print(f"User ID {user['user_id']} does not have a watched tags page")
-                user['watched_tags'] = []
-                pass
 
-        return users
+    def scrape_user_watched_tags(self, user):
+        # Returns a dictionary with the 'watched_tags' scraped from the tag notifications page
+
+        watched_tags_url = f"{self.base_url}/users/tag-notifications/{user['user_id']}"
+        settings_table = SoupStrainer('table', {'class': class_pattern('-settings')})
+        soup = self.get_page_soup(watched_tags_url, parse_only=settings_table)
+        try:
+            watched_tag_rows = soup.find('table', {'class': '-settings'}).find_all('tr')
+            watched_tags = [self.strip_html(tag.find('td').text) for tag in watched_tag_rows]
+        except AttributeError: # if user has no watched tags
+            print(f"User ID {user['user_id']} does not have a watched tags page")
+            watched_tags = []
+
+        return {'watched_tags': watched_tags}
 
 
     def get_user_login_history(self, users):
@@ -265,31 +407,189 @@ class WebClient(object):
             print('Not able to obtain user login history. This requires admin permissions.')
             return users
 
-        for user in users:
-            if user['user_id'] <= 1: # skip the Community user and user groups
+        print("Getting login history for each user...")
+        return self.scrape_users(users, self.scrape_user_login_history, 'login history')
+
+
+    def scrape_user_login_history(self, user):
+        # Returns a dictionary with the 'login_history' scraped from the account page, presented
+        # as a list of timestamps
+
+        account_url = f"{self.base_url}/accounts/{user['account_id']}"
+        # Only headings and tables are parsed; the login history table is the sibling that
+        # directly follows the "Login Histories" heading
+        soup = self.get_page_soup(account_url, parse_only=SoupStrainer(['h2', 'table']))
+        try:
+            login_history = soup.find(
+                'h2', string=re.compile('Login Histories')).find_next_sibling('table')
+        except AttributeError: # if user has no login history
+            return {'login_history': []}
+        
+        login_timestamps = []
+        for row in login_history.find_all('tr'):
+            if row.find('th'): # skip the header row
                 continue
+            timestamp = row.find('td').find('span')['title']
+            # create datetime object from timestamp string
+            # timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%SZ')
+            login_timestamps.append(timestamp)
 
-            print(f"Getting login history for account ID {user['account_id']}")
-            account_url = f"{self.base_url}/accounts/{user['account_id']}"
-            soup = self.get_page_soup(account_url)
-            try:
-                login_history = soup.find(
-                    'h2', string=re.compile('Login Histories')).find_next_sibling('table')
-            except AttributeError: # if user has no login history
-                user['login_history'] = []
+        return {'login_history': login_timestamps}
+
+
+    def get_user_profile_data(self, users, title_and_dept=True, watched_tags=True,
+                              login_history=True):
+        """
+        This function combines get_user_title_and_dept, get_user_watched_tags, and
+        get_user_login_history into a single pass over the users. Each worker visits every page
+        belonging to a user once and pulls all of the requested fields from it, rather than
+        crawling the whole user list once per field
+
+        Args:
+            users: list of user dictionaries obtained from the /users API endpoint
+            title_and_dept: bool, whether to scrape 'title' and 'department'
+            watched_tags: bool, whether to scrape 'watched_tags'
+            login_history: bool, whether to scrape 'login_history'
+
+        Returns:
+            users: list of user dictionaries with the requested keys added
+        """
+
+        scrape_functions = []
+        if title_and_dept:
+            scrape_functions.append(self.scrape_user_title_and_dept)
+
+        # Watched tags and login history require Stack Overflow Enterprise and admin permissions
+        if (watched_tags or login_history) and not (self.soe and self.admin):
+            print('Not able to obtain user watched tags or login history. These require '
+                  'Stack Overflow Enterprise and admin permissions.')
+        else:
+            if watched_tags:
+                scrape_functions.append(self.scrape_user_watched_tags)
+            if login_history:
+                scrape_functions.append(self.scrape_user_login_history)
+
+        if not scrape_functions:
+            return users
+
+        def scrape_user_profile(user):
+            user_fields = {}
+            for scrape_function in scrape_functions:
+                user_fields.update(scrape_function(user))
+            return user_fields
+
+        # Cached profile data is only reused for the same combination of fields
+        cache_key = '+'.join(scrape_function.__name__ for scrape_function in scrape_functions)
+
+        print("Getting profile data for each user...")
+        return self.scrape_users(users, scrape_user_profile, 'profile data', cache_key)
+
+
+    def scrape_pages(self, page_urls, scrape_function, *args):
+        """
+        Runs `scrape_function(page_url, *args)` for every page URL on the bounded pool of worker
+        threads, sharing the authenticated session and politeness limit with the per-user
+        scraping
+
+        Args:
+            page_urls: list of page URLs
+            scrape_function: function that takes a page URL (plus `args`) and returns its results
+            args: additional arguments passed to `scrape_function`
+
+        Returns:
+            results: list of results from `scrape_function`, in the same order as `page_urls`
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(scrape_function, page_url, *args)
+                       for page_url in page_urls]
+            return [future.result() for future in futures]
+
+
+    def scrape_users(self, users, scrape_function, description, cache_key=None):
+        """
+        Runs `scrape_function` for every user on a bounded pool of worker threads that share the
+        authenticated session. Each scrape function takes a user dictionary and returns a
+        dictionary of scraped fields, which are merged back onto the user dictionary here, on
+        the calling thread, so the user list is never modified concurrently
+
+        The scraped fields are cached per user, along with the user's last access date. A user
+        is only scraped again if their last access date has changed since then, or if the
+        cached fields are older than the user cache period
+
+        Args:
+            users: list of user dictionaries obtained from the /users API endpoint
+            scrape_function: function that takes a user dictionary and returns a dictionary
+            description: str, what is being scraped (used for progress messages)
+            cache_key: str, identifies the scraped fields in the cache (default: `description`)
+
+        Returns:
+            users: list of user dictionaries with the scraped fields added
+        """
+
+        cache_key = cache_key or description
+        user_caches = read_cache('scraped_users')
+        user_cache = user_caches.setdefault(self.base_url, {})
+
+        # skip the Community user and user groups, and the users whose cached fields are current
+        users_to_scrape = []
+        cached_count = 0
+        for user in users:
+            if user['user_id'] <= 1:
                 continue
-            
-            login_timestamps = []
-            for row in login_history.find_all('tr'):
-                if row.find('th'): # skip the header row
-                    continue
-                timestamp = row.find('td').find('span')['title']
-                # create datetime object from timestamp string
-                # timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%SZ')
-                login_timestamps.append(timestamp)
-            user['login_history'] = login_timestamps
+            cached_fields = self.get_cached_user_fields(user_cache, user, cache_key)
+            if cached_fields is None:
+                users_to_scrape.append(user)
+            else:
+                user.update(cached_fields)
+                cached_count += 1
+        user_count = len(users_to_scrape)
+        if cached_count:
+            print(f"Using saved {description} for {cached_count} users who haven't been active "
+                  f"since it was saved. Getting {description} for {user_count} users...")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(scrape_function, user): user for user in users_to_scrape}
+            for completed, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                user = futures[future]
+                try:
+                    user_fields = future.result()
+                except requests.exceptions.RequestException as e:
+                    print(f"Unable to get {description} for user ID {user['user_id']}: {e}")
+                else:
+                    user.update(user_fields)
+                    user_cache.setdefault(str(user['user_id']), {})[cache_key] = {
+                        'last_access_date': user.get('last_access_date'),
+                        'scrape_date': int(time.time()),
+                        'fields': user_fields
+                    }
+
+                if completed % 100 == 0 or completed == user_count:
+                    print(f"Got {description} for {completed} of {user_count} users")
+
+        # Login history, titles, and departments are personal data, so the cache is private
+        if self.user_cache_period and users_to_scrape:
+            write_cache('scraped_users', user_caches, private=True)
 
         return users
+
+
+    def get_cached_user_fields(self, user_cache, user, cache_key):
+        # Returns the cached fields of a user, or None if the user needs to be scraped again
+
+        if not self.user_cache_period or not user.get('last_access_date'):
+            return None
+        try:
+            cached = user_cache[str(user['user_id'])][cache_key]
+        except KeyError:
+            return None
+
+        if cached['last_access_date'] != user['last_access_date']:
+            return None
+        if time.time() - cached['scrape_date'] > self.user_cache_period:
+            return None
+
+        return cached['fields']
     
 
     def get_webhooks(self, communities=None):
@@ -314,50 +614,58 @@ class WebClient(object):
             print('Not able to obtain webhook data. User is not an admin or URL is invalid')
             return None
         
+        # Index community tags by community name, so that webhooks scoped to a community can be
+        # resolved with a single lookup instead of a scan of the community list
+        community_tags = {}
+        for community in communities or []:
+            community_tags[community['name']] = [tag['name'] for tag in community['tags']]
+
         webhooks = []
         if self.soe: # Stack Overflow Enterprise
             webhooks_url = f"{self.base_url}/enterprise/webhooks"
             page_count = self.get_page_count(webhooks_url + '?page=1&pagesize=50')
-            for page in range(1, page_count + 1):
-                print(f"Getting webhooks from page {page} of {page_count}")
-                page_url = webhooks_url + f'?page={page}&pagesize=50'
-                webhooks += self.scrape_webhooks_page(page_url, communities)
+            print(f"Getting webhooks from {page_count} pages")
+            page_urls = [webhooks_url + f'?page={page}&pagesize=50'
+                         for page in range(1, page_count + 1)]
+            for page_webhooks in self.scrape_pages(page_urls, self.scrape_webhooks_page,
+                                                   community_tags):
+                webhooks += page_webhooks
             print(f"Found {len(webhooks)} webhooks")
 
         else: # Stack Overflow Business or Basic
             slack_webhooks_url = f"{self.base_url}/admin/integrations/slack"
             print(f"Getting webhooks from {slack_webhooks_url}")
-            webhooks += self.scrape_webhooks_page(slack_webhooks_url, communities)
+            webhooks += self.scrape_webhooks_page(slack_webhooks_url, community_tags)
             print(f"Found {len(webhooks)} Slack webhooks")
 
             msteams_webhooks_url = f"{self.base_url}/admin/integrations/microsoft-teams"
             print(f"Getting webhooks from {msteams_webhooks_url}")
-            webhooks += self.scrape_webhooks_page(msteams_webhooks_url, communities)
+            webhooks += self.scrape_webhooks_page(msteams_webhooks_url, community_tags)
             print(f"Found {len(webhooks)} Microsoft Teams webhooks")
 
         return webhooks
     
 
-    def scrape_webhooks_page(self, page_url, communities):
+    def scrape_webhooks_page(self, page_url, community_tags):
         # For Stack Overflow Enterprise, the webhook_type is a column in the table
         # For Stack Overflow Business or Basic, the webhook type isn't in the table, so it's
         # inferred from the URL
 
-        response = self.get_page_response(page_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = self.get_page_soup(page_url, parse_only=SoupStrainer('tr'))
         webhook_rows = soup.find_all('tr')
 
         if self.soe: # Stack Overflow Enterprise
-            webhooks = self.process_webhooks(webhook_rows, communities)
+            webhooks = self.process_webhooks(webhook_rows, community_tags)
         else: # Stack Overflow Business or Basic
             # type should be the the last part of the URL
             type = page_url.split('/')[-1]
-            webhooks = self.process_webhooks(webhook_rows, communities, webhook_type=type)
+            webhooks = self.process_webhooks(webhook_rows, community_tags, webhook_type=type)
 
         return webhooks
 
 
-    def process_webhooks(self, webhook_rows, communities, webhook_type=None):
+    def process_webhooks(self, webhook_rows, community_tags, webhook_type=None):
+        # community_tags is a dictionary of community name -> list of tag names
 
         # A webhook description has three parts: tags, activity type, and channel
         # Example scenarios to be accounted for:
@@ -410,10 +718,11 @@ class WebClient(object):
                     tags = description.split(' posts to ')[0].split(' ')
                 elif ' in ' in description: # community is specified; use community tags
                     community_name = description.split(' in ')[1].split(' to')[0]
-                    for community in communities:
-                        if community['name'] == community_name:
-                            break
-                    tags = [tag['name'] for tag in community['tags']]
+                    try:
+                        tags = community_tags[community_name]
+                    except KeyError: # community was not found (or communities weren't scraped)
+                        print(f"Unable to find tags for the {community_name} community")
+                        tags = []
                     activities, description = self.process_webhook_activities(
                         description, activity_types)
                 else: 
@@ -468,8 +777,32 @@ class WebClient(object):
         
     def get_page_response(self, url):
         # Uses the Requests session to get page response
+        # Connection errors and server-side throttling/errors are retried with an increasing
+        # delay, up to `max_retries` attempts
+
+        for attempt in range(1, self.max_retries + 1):
+            self.wait_for_request_slot()
+            try:
+                response = self.s.get(url)
+            except requests.exceptions.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                print(f'Connection error getting page {url}. Retrying...')
+                time.sleep(2 ** attempt)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                # Honor the server's Retry-After header if present (429 Too Many Requests)
+                try:
+                    retry_delay = int(response.headers.get('Retry-After', 2 ** attempt))
+                except ValueError:
+                    retry_delay = 2 ** attempt
+                print(f'Received status code {response.status_code} for {url}. '
+                      f'Retrying in {retry_delay} seconds...')
+                time.sleep(retry_delay)
+                continue
+            break
 
-        response = self.s.get(url)
         if not response.status_code == 200:
             print(f'Error getting page {url}')
             print(f'Response code: {response.status_code}')
@@ -477,12 +810,28 @@ class WebClient(object):
         return response
     
 
-    def get_page_soup(self, url):
+    def wait_for_request_slot(self):
+        # Politeness limit: reserves the next available request slot, shared across all worker
+        # threads, and sleeps until it arrives. The lock is only held while reserving the slot
+
+        with self.throttle_lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + self.request_interval
+
+        if request_time > now:
+            time.sleep(request_time - now)
+    
+
+    def get_page_soup(self, url, parse_only=None):
         # Uses the Requests session to get page response and returns a BeautifulSoup object
+        # `parse_only` is an optional SoupStrainer; when given, only the matching elements (and
+        # their contents) are built into the tree, which is much faster than parsing the whole
+        # page when a call site only needs one element
 
         response = self.get_page_response(url)
         try:
-            return BeautifulSoup(response.text, 'html.parser')
+            return BeautifulSoup(response.text, HTML_PARSER, parse_only=parse_only)
         except AttributeError:
             return None
         
@@ -490,9 +839,15 @@ class WebClient(object):
     def get_page_count(self, url):
         # Returns the number of pages that need to be scraped
 
-        response = self.get_page_response(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        pagination = soup.find_all('a', {'class': 's-pagination--item js-pagination-item'})
+        soup = self.get_page_soup(url, parse_only=SoupStrainer('a', PAGINATION_CLASS))
+        return self.count_pages(soup)
+
+
+    def count_pages(self, soup):
+        # Returns the number of pages, based on the pagination links of an already parsed page
+        # The last pagination link is "Next"; the one before it is the last page number
+
+        pagination = soup.find_all('a', PAGINATION_CLASS)
         try:
             page_count = int(pagination[-2].text)
         except IndexError: # only one page
@@ -0,0 +1,5 @@
+# The script's modules are in the repository's root directory, not in a package
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
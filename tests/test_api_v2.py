@@ -0,0 +1,166 @@
+import concurrent.futures
+import random
+
+import pytest
+
+from so4t_api_v2 import V2Client
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, params=None, verify=None):
+        return self.response
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # the client reads the SSL verification cache
+    return V2Client('https://example.stackenterprise.co', key='key', probe=False)
+
+
+def count_items(dates, failures=()):
+    # Returns a get_item_count replacement that counts the items created between the dates of
+    # the request; the calls numbered in `failures` fail
+
+    calls = []
+
+    def get_item_count(endpoint, params=None):
+        calls.append(params)
+        if len(calls) in failures:
+            return None
+        return sum(params['fromdate'] <= date <= params['todate'] for date in dates)
+
+    return get_item_count
+
+
+def assert_covers(shards, from_date, to_date, dates):
+    # The date ranges are in order, don't overlap, stay within the dates, and include every item
+
+    assert shards
+    assert shards[0][0] >= from_date and shards[-1][1] <= to_date
+    for (_, previous_to_date), (next_from_date, _) in zip(shards, shards[1:]):
+        assert previous_to_date < next_from_date
+    for date in dates:
+        assert any(shard_from <= date <= shard_to for shard_from, shard_to in shards)
+
+
+def test_date_shards_cover_all_items(client):
+
+    generator = random.Random(1)
+    dates = [generator.randint(1000, 100000) for _ in range(500)]
+    client.get_item_count = count_items(dates)
+
+    shards = client.get_date_shards('/questions', 4, 1, 200000)
+
+    assert len(shards) > 1
+    assert_covers(shards, 1, 200000, dates)
+
+
+def test_date_shards_skip_only_counted_empty_ranges(client):
+
+    dates = [150000 + i for i in range(100)]
+    client.get_item_count = count_items(dates)
+
+    shards = client.get_date_shards('/questions', 4, 1, 200000)
+
+    # Everything before the first item was counted as empty, so it's left out
+    assert shards[0][0] > 1
+    assert_covers(shards, 1, 200000, dates)
+
+
+def test_date_shards_without_a_total_use_one_range(client):
+
+    client.get_item_count = count_items([5, 10, 15], failures={1})
+
+    assert client.get_date_shards('/questions', 4, 1, 100) == [(1, 100)]
+
+
+@pytest.mark.parametrize('failure', [2, 3, 4])
+def test_date_shards_keep_ranges_when_a_count_fails(client, failure):
+
+    generator = random.Random(failure)
+    dates = [generator.randint(1, 100000) for _ in range(300)]
+    client.get_item_count = count_items(dates, failures={failure})
+
+    shards = client.get_date_shards('/articles', 8, 1, 100000)
+
+    assert_covers(shards, 1, 100000, dates)
+
+
+def test_item_count_failure_returns_none(client):
+
+    client.session = FakeSession(FakeResponse(429, {'error_id': 502}))
+    assert client.get_item_count('/questions') is None
+
+    client.session = FakeSession(FakeResponse(200, {'total': 0}))
+    assert client.get_item_count('/questions') == 0
+
+
+def test_date_shards_are_no_larger_than_the_maximum(client):
+
+    dates = list(range(1, 100001, 10)) # 10,000 items, evenly spread
+    client.get_item_count = count_items(dates)
+
+    shards = client.get_date_shards('/questions', 2, 1, 100000, max_shard_size=1000)
+
+    assert_covers(shards, 1, 100000, dates)
+    for shard_from, shard_to in shards:
+        assert sum(shard_from <= date <= shard_to for date in dates) <= 1000
+
+
+def test_sharded_crawl_holds_a_limited_number_of_shards(client):
+
+    shards = [(day * 100, day * 100 + 99) for day in range(20)]
+    client.get_date_shards = lambda endpoint, shard_count, from_date, to_date: shards
+    fetched_shards = []
+
+    def get_items(endpoint_url, params):
+        fetched_shards.append(params['fromdate'])
+        # Adjacent shards overlap by one second, so the first item of a shard is repeated
+        dates = range(params['todate'], params['fromdate'] - 1, -1)
+        return [{'question_id': date} for date in dates]
+
+    client.get_items = get_items
+    items = client.stream_items_in_shards('/questions', 'question_id', {'todate': 2000}, 3)
+
+    question_ids = [next(items)['question_id']]
+    assert len(fetched_shards) <= 3
+
+    question_ids += [item['question_id'] for item in items]
+    assert question_ids == list(range(2000, -1, -1))
+
+
+class PagedSession(object):
+    # Returns three pages of items for any request
+
+    def get(self, url, params=None, verify=None):
+        page = params['page']
+        return FakeResponse(200, {'items': [{'page': page}], 'has_more': page < 3})
+
+
+def test_client_can_be_shared_between_threads(client):
+
+    client.session = PagedSession()
+    params = {'page': 1, 'pagesize': 100}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(client.get_items, client.api_url + '/questions', params)
+                   for _ in range(8)]
+        results = [future.result() for future in futures]
+
+    assert results == [[{'page': 1}, {'page': 2}, {'page': 3}]] * 8
+    assert params == {'page': 1, 'pagesize': 100} # the caller's parameters aren't changed
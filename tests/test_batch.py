@@ -0,0 +1,149 @@
+import json
+import os
+
+import pytest
+
+import so4t_batch
+from so4t_batch import read_manifest, run_batch, start_report
+
+
+def write_manifest(tmp_path, instances):
+
+    manifest_file = str(tmp_path / 'instances.json')
+    with open(manifest_file, 'w') as f:
+        json.dump(instances, f)
+    return manifest_file
+
+
+class FakeProcess(object):
+    # A report that finishes after being polled a few times
+
+    def __init__(self, scheduler, instance, polls=3):
+
+        self.scheduler = scheduler
+        self.instance = instance
+        self.polls = polls
+        self.returncode = None
+
+    def poll(self):
+
+        self.polls -= 1
+        if self.polls > 0:
+            return None
+        if self.returncode is None:
+            self.returncode = 0
+            self.scheduler.running.remove(self.instance)
+        return self.returncode
+
+
+class FakeScheduler(object):
+    # Replaces start_report; records how many reports run at once, in total and per host
+
+    def __init__(self, tmp_path):
+
+        self.tmp_path = tmp_path
+        self.running = []
+        self.started = []
+        self.max_running = 0
+        self.max_running_per_host = {}
+
+    def start_report(self, instance, output_directory, report_args):
+
+        instance['log'] = open(str(self.tmp_path / f"{instance['name']}.log"), 'w')
+        instance['start_time'] = 0
+        self.running.append(instance)
+        self.started.append(instance['name'])
+        self.max_running = max(self.max_running, len(self.running))
+        host_running = sum(1 for running in self.running if running['host'] == instance['host'])
+        self.max_running_per_host[instance['host']] = max(
+            self.max_running_per_host.get(instance['host'], 0), host_running)
+        return FakeProcess(self, instance)
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+
+    scheduler = FakeScheduler(tmp_path)
+    monkeypatch.setattr(so4t_batch, 'start_report', scheduler.start_report)
+    monkeypatch.setattr(so4t_batch, 'POLL_INTERVAL', 0)
+    return scheduler
+
+
+def make_instances(hosts, per_host):
+
+    return [{'name': f"{host}-{i}", 'url': f"https://{host}", 'key': 'k'}
+            for host in hosts for i in range(per_host)]
+
+
+def test_batch_runs_at_most_max_concurrent_reports(tmp_path, scheduler):
+
+    manifest_file = write_manifest(tmp_path, make_instances(['a', 'b', 'c', 'd'], 2))
+    run_batch(manifest_file, str(tmp_path / 'output'), 3, 8, [])
+
+    assert scheduler.max_running == 3
+    assert sorted(scheduler.started) == sorted(f"{host}-{i}" for host in 'abcd' for i in [0, 1])
+
+
+def test_batch_runs_at_most_max_per_host_reports(tmp_path, scheduler):
+
+    manifest_file = write_manifest(tmp_path, make_instances(['a', 'b'], 4))
+    run_batch(manifest_file, str(tmp_path / 'output'), 8, 2, [])
+
+    assert scheduler.max_running_per_host == {'a': 2, 'b': 2}
+    assert scheduler.max_running == 4
+    assert len(scheduler.started) == 8
+
+
+class RecordingPopen(object):
+
+    calls = []
+
+    def __init__(self, command, cwd, env, stdout, stderr, stdin):
+
+        RecordingPopen.calls.append({'command': command, 'cwd': cwd, 'env': env})
+
+
+def test_each_instance_gets_its_own_output_directory_and_credentials(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(so4t_batch.subprocess, 'Popen', RecordingPopen)
+    monkeypatch.setattr(RecordingPopen, 'calls', [])
+    monkeypatch.setenv('SO4T_KEY', 'key from the environment')
+    monkeypatch.setenv('SO4T_TOKEN', 'token from the environment')
+    instances = read_manifest(write_manifest(tmp_path, [
+        {'url': 'https://stackoverflowteams.com/c/team-a', 'token': 'token-a'},
+        {'url': 'https://example.stackenterprise.co', 'key': 'key-b', 'args': ['--stream']}
+    ]))
+
+    output_directory = str(tmp_path / 'output')
+    for instance in instances:
+        start_report(instance, output_directory, ['--shards', '2'])
+        instance['log'].close()
+
+    first, second = RecordingPopen.calls
+    assert first['cwd'] == os.path.join(output_directory, 'team-a')
+    assert second['cwd'] == os.path.join(output_directory, 'example.stackenterprise.co')
+    assert os.path.exists(os.path.join(first['cwd'], 'so4t_user_report.log'))
+    assert os.path.exists(os.path.join(second['cwd'], 'so4t_user_report.log'))
+
+    # Credentials of the environment aren't passed on to instances that don't use them
+    assert first['env']['SO4T_TOKEN'] == 'token-a' and 'SO4T_KEY' not in first['env']
+    assert second['env']['SO4T_KEY'] == 'key-b' and 'SO4T_TOKEN' not in second['env']
+    for call in RecordingPopen.calls:
+        assert not {'token-a', 'key-b'} & set(call['command'])
+    assert second['command'][-3:] == ['--shards', '2', '--stream']
+
+
+@pytest.mark.parametrize('name', ['../outside', 'a/b', 'a\\b', '..', '.', ''])
+def test_unsafe_instance_names_are_rejected(tmp_path, name):
+
+    manifest_file = write_manifest(tmp_path, [{'name': name, 'url': 'https://x.example'}])
+    with pytest.raises(SystemExit):
+        read_manifest(manifest_file)
+
+
+def test_unsafe_team_names_are_rejected(tmp_path):
+
+    manifest_file = write_manifest(tmp_path, [
+        {'url': 'https://stackoverflowteams.com/c/../../outside'}])
+    with pytest.raises(SystemExit):
+        read_manifest(manifest_file)
@@ -0,0 +1,175 @@
+import os
+import stat
+import time
+
+import pytest
+import requests
+
+from so4t_api_v2 import V2Client
+from so4t_api_v3 import V3Client
+from so4t_cache import get_cached_ssl_verify, read_cache, save_ssl_verify, write_cache
+from so4t_web_client import WebClient
+
+
+def test_write_and_read_cache(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    write_cache('filters', {'questions': 'abc'})
+
+    assert read_cache('filters') == {'questions': 'abc'}
+    assert read_cache('missing') == {}
+
+
+def test_private_cache_is_only_readable_by_the_user(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    old_umask = os.umask(0) # even with a permissive umask
+    try:
+        write_cache('sessions', {'cookies': []}, private=True)
+    finally:
+        os.umask(old_umask)
+
+    mode = stat.S_IMODE(os.stat(os.path.join('.so4t_cache', 'sessions.json')).st_mode)
+    assert mode == 0o600
+
+
+class FakeSession:
+    # Records the SSL verification setting of each request; certificates can be verified
+
+    def __init__(self):
+
+        self.verify = []
+
+    def get(self, url, params=None, verify=True):
+
+        self.verify.append(verify)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+
+@pytest.mark.parametrize('make_client', [
+    lambda url: V2Client(url, key='k', probe=False),
+    lambda url: V3Client(url, token='t', probe=False)
+])
+def test_connection_test_tries_ssl_verification_first(tmp_path, monkeypatch, make_client):
+
+    monkeypatch.chdir(tmp_path)
+    url = 'https://example.stackenterprise.co'
+    save_ssl_verify(url, False) # e.g. the certificate has been fixed since then
+
+    client = make_client(url)
+    client.session = FakeSession()
+    assert client.test_connection()
+    assert client.session.verify == [True]
+    assert get_cached_ssl_verify(url)
+
+
+def test_skipped_connection_test_warns_about_cached_ssl_setting(tmp_path, monkeypatch, capsys):
+
+    monkeypatch.chdir(tmp_path)
+    url = 'https://example.stackenterprise.co'
+    save_ssl_verify(url, False)
+    capsys.readouterr()
+
+    assert not V2Client(url, key='k', probe=False).ssl_verify
+    assert 'SSL verification is turned off' in capsys.readouterr().out
+
+
+def make_web_client(base_url):
+
+    web_client = WebClient.__new__(WebClient) # without logging in
+    web_client.base_url = base_url
+    return web_client
+
+
+def test_expired_cookies_are_skipped(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    web_client = make_web_client('https://example.stackenterprise.co')
+    web_client.save_session_cookies([
+        {'name': 'auth', 'value': 'a', 'expiry': int(time.time()) + 3600},
+        {'name': 'analytics', 'value': 'b', 'expiry': int(time.time()) - 60},
+        {'name': 'session', 'value': 'c'}
+    ])
+
+    session = requests.Session()
+    assert web_client.load_session_cookies(session)
+    assert dict(session.cookies) == {'auth': 'a', 'session': 'c'}
+
+
+def test_only_expired_cookies_need_a_login(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    web_client = make_web_client('https://example.stackenterprise.co')
+    web_client.save_session_cookies([
+        {'name': 'auth', 'value': 'a', 'expiry': int(time.time()) - 60}
+    ])
+
+    assert not web_client.load_session_cookies(requests.Session())
+    assert not make_web_client('https://other.example').load_session_cookies(requests.Session())
+
+
+def make_scraping_client(base_url, user_cache_period=7 * 24 * 60 * 60):
+
+    web_client = make_web_client(base_url)
+    web_client.max_workers = 4
+    web_client.user_cache_period = user_cache_period
+    return web_client
+
+
+class ScrapeFunction(object):
+    # Records the users it's called for; fails for the users in `failing_user_ids`
+
+    def __init__(self, failing_user_ids=()):
+        self.user_ids = []
+        self.failing_user_ids = failing_user_ids
+
+    def __call__(self, user):
+        self.user_ids.append(user['user_id'])
+        if user['user_id'] in self.failing_user_ids:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return {'title': f"Title {user['user_id']}"}
+
+
+def make_scrape_users():
+
+    return [{'user_id': user_id, 'last_access_date': 1000} for user_id in [-1, 1, 2, 3, 4]]
+
+
+def test_scraped_fields_are_added_to_every_user(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    scrape_function = ScrapeFunction()
+    users = make_scraping_client('https://a.example').scrape_users(
+        make_scrape_users(), scrape_function, 'titles')
+
+    # The Community user (-1) and user groups (1) are skipped
+    assert sorted(scrape_function.user_ids) == [2, 3, 4]
+    assert [user.get('title') for user in users] == [None, None, 'Title 2', 'Title 3', 'Title 4']
+
+
+def test_users_are_only_scraped_again_when_they_were_active(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    web_client = make_scraping_client('https://a.example')
+    web_client.scrape_users(make_scrape_users(), ScrapeFunction(failing_user_ids=[4]), 'titles')
+
+    users = make_scrape_users()
+    users[3]['last_access_date'] = 2000 # user 3 was active since the last run
+    scrape_function = ScrapeFunction()
+    users = web_client.scrape_users(users, scrape_function, 'titles')
+
+    # User 4 failed last time, so they weren't cached
+    assert sorted(scrape_function.user_ids) == [3, 4]
+    assert users[2]['title'] == 'Title 2' # from the cache
+
+    # The cache is per instance, and can be turned off
+    scrape_function = ScrapeFunction()
+    make_scraping_client('https://b.example').scrape_users(
+        make_scrape_users(), scrape_function, 'titles')
+    assert sorted(scrape_function.user_ids) == [2, 3, 4]
+    scrape_function = ScrapeFunction()
+    make_scraping_client('https://a.example', user_cache_period=0).scrape_users(
+        make_scrape_users(), scrape_function, 'titles')
+    assert sorted(scrape_function.user_ids) == [2, 3, 4]
@@ -0,0 +1,186 @@
+import argparse
+import copy
+
+import so4t_user_report
+from so4t_incremental import MetricsState
+from so4t_metrics import METRIC_COUNTERS, MetricsAggregator
+from so4t_user_report import add_new_user_fields, get_api_delta
+
+
+def owner(user_id):
+
+    return {'user_id': user_id, 'display_name': f"User {user_id}"}
+
+
+def make_question(question_id, user_id, creation_date, answers=(), comments=()):
+
+    return {'question_id': question_id, 'owner': owner(user_id), 'creation_date': creation_date,
+            'up_vote_count': 1, 'down_vote_count': 0, 'answer_count': len(answers),
+            'answers': list(answers), 'comments': list(comments)}
+
+
+def make_answer(answer_id, user_id, creation_date, accepted=False, comments=()):
+
+    return {'answer_id': answer_id, 'owner': owner(user_id), 'creation_date': creation_date,
+            'up_vote_count': 2, 'down_vote_count': 1, 'is_accepted': accepted,
+            'comments': list(comments)}
+
+
+def make_comment(comment_id, user_id, creation_date):
+
+    return {'comment_id': comment_id, 'owner': owner(user_id), 'creation_date': creation_date}
+
+
+def make_users(user_ids):
+
+    return add_new_user_fields([{'user_id': user_id, 'display_name': f"User {user_id}",
+                                 'creation_date': 0, 'last_access_date': 0}
+                                for user_id in user_ids])
+
+
+def recompute(questions, articles, reputation_history):
+    # The metrics of all users, calculated from scratch
+
+    aggregator = MetricsAggregator(make_users([1, 2, 3]), 0, 2524626000)
+    aggregator.add_questions(copy.deepcopy(questions))
+    aggregator.add_articles(copy.deepcopy(articles))
+    aggregator.add_reputation_history(reputation_history)
+    return get_metrics(aggregator.get_users())
+
+
+def get_metrics(users):
+
+    return {user['user_id']: ({counter: user[counter] for counter in METRIC_COUNTERS},
+                              user['answer_response_time_median'])
+            for user in users}
+
+
+def test_incremental_update_matches_full_recompute():
+
+    questions = [
+        make_question(10, 1, 1000, answers=[make_answer(20, 2, 2000, accepted=True)],
+                      comments=[make_comment(30, 3, 1500)]),
+        make_question(11, 2, 3000, answers=[make_answer(21, 1, 7000)]),
+        make_question(12, 4, 4000) # user 4 is a deleted user
+    ]
+    articles = [{'article_id': 40, 'owner': owner(3), 'creation_date': 5000, 'score': 4}]
+    reputation_history = [{'user_id': 1, 'creation_date': 1000, 'reputation_change': 10}]
+
+    state = MetricsState()
+    state.start_sync(10000)
+    state.apply_questions(questions)
+    state.apply_articles(articles)
+    state.apply_reputation_history(reputation_history)
+
+    # Then a question is edited (new votes, a new answer, and a removed comment), another one is
+    # deleted, a question is added, and new reputation is earned
+    edited_question = make_question(10, 1, 1000, answers=[
+        make_answer(20, 2, 2000, accepted=True), make_answer(22, 3, 12000)])
+    edited_question['up_vote_count'] = 5
+    new_question = make_question(13, 3, 11000, comments=[make_comment(31, 1, 11500)])
+    new_events = [{'user_id': 2, 'creation_date': 11000, 'reputation_change': 15}]
+
+    state.start_sync(20000)
+    state.remove_posts('question', [11])
+    state.apply_questions([edited_question, new_question])
+    state.apply_reputation_history(new_events)
+    incremental = get_metrics(state.get_users(make_users([1, 2, 3])))
+
+    full = recompute([edited_question, questions[2], new_question], articles,
+                     reputation_history + new_events)
+    assert incremental == full
+
+
+def test_repeated_reputation_events_are_counted_once():
+
+    event = {'user_id': 1, 'creation_date': 15000, 'reputation_change': 10}
+
+    state = MetricsState()
+    state.start_sync(10000)
+    state.apply_reputation_history([event])
+    state = MetricsState({'users': state.users, 'posts': state.posts, 'sync_date': 10000,
+                          'recent_reputation_events': sorted(state.counted_reputation_events)})
+    state.start_sync(20000)
+    state.apply_reputation_history([event]) # the next sync receives the event again
+
+    users = state.get_users(make_users([1]))
+    assert users[0]['net_reputation'] == 10
+
+
+class FakeDeltaClient:
+    # Serves the posts of an instance where only new comments were added since the last sync
+
+    def __init__(self, questions, comments):
+
+        self.questions = questions
+        self.comments = comments
+
+    def create_filter(self, filter_attributes='', base='default'):
+
+        return ''
+
+    def stream_all_comments(self, filter_string='', from_date=None):
+
+        return ({'post_id': comment['post_id']} for comment in self.comments
+                if comment['creation_date'] >= from_date)
+
+    def get_all_questions(self, filter_string='', activity_since=None, shards=1):
+
+        return [] # new comments aren't activity on a question
+
+    def get_answers_by_ids(self, answer_ids, filter_string=''):
+
+        return [{'answer_id': answer['answer_id'], 'question_id': question['question_id']}
+                for question in self.questions for answer in question['answers']
+                if answer['answer_id'] in answer_ids]
+
+    def get_questions_by_ids(self, question_ids, filter_string=''):
+
+        return [copy.deepcopy(question) for question in self.questions
+                if question['question_id'] in question_ids]
+
+    def get_all_articles(self, filter_string='', activity_since=None, shards=1):
+
+        return []
+
+    def get_articles_by_ids(self, article_ids, filter_string=''):
+
+        return []
+
+
+def test_new_comments_on_old_posts_are_fetched(monkeypatch, tmp_path):
+
+    questions = [
+        make_question(10, 1, 1000, answers=[make_answer(20, 2, 2000)]),
+        make_question(11, 2, 3000)
+    ]
+    state = MetricsState()
+    state.start_sync(10000)
+    state.apply_questions(questions)
+    state.save(str(tmp_path / 'metrics_state.json'))
+    state = MetricsState.load(str(tmp_path / 'metrics_state.json'))
+
+    # Then comments are added to the old answer and question, without any other activity
+    questions[0]['answers'][0]['comments'].append(make_comment(30, 3, 12000))
+    questions[1]['comments'].append(make_comment(31, 1, 13000))
+    comments = [{'post_id': 20, 'creation_date': 12000},
+                {'post_id': 11, 'creation_date': 13000}]
+    client = FakeDeltaClient(questions, comments)
+
+    monkeypatch.setattr(so4t_user_report, 'create_api_clients', lambda args: (client, None))
+    monkeypatch.setattr(so4t_user_report, 'get_users', lambda v2client, v3client: [])
+    monkeypatch.setattr(so4t_user_report, 'get_tags', lambda v3client: [])
+    monkeypatch.setattr(so4t_user_report, 'export_to_json', lambda name, data: None)
+    monkeypatch.setattr(so4t_user_report, 'get_reputation_history',
+                        lambda v2client, users, from_date=None: [])
+    monkeypatch.setattr(so4t_user_report, 'get_question_filter', lambda v2client: '')
+    monkeypatch.setattr(so4t_user_report, 'get_article_filter', lambda v2client: '')
+
+    args = argparse.Namespace(web_client=False, check_deleted=False)
+    delta = get_api_delta(args, state)
+    assert sorted(question['question_id'] for question in delta['questions']) == [10, 11]
+
+    state.start_sync(20000)
+    state.apply_questions(delta['questions'])
+    incremental = get_metrics(state.get_users(make_users([1, 2, 3])))
+    assert incremental == recompute(questions, [], [])
@@ -0,0 +1,153 @@
+import random
+
+from so4t_metrics import (METRIC_COUNTERS, MetricsAggregator, aggregate_in_parallel,
+                          compile_counter, finalize_user_metrics, get_required_datasets,
+                          get_required_metrics, initialize_deleted_user, split_into_chunks)
+
+
+def make_question(creation_date, answer_count=0, up_vote_count=3, down_vote_count=1):
+
+    return {'creation_date': creation_date, 'answer_count': answer_count,
+            'up_vote_count': up_vote_count, 'down_vote_count': down_vote_count}
+
+
+def test_counter_counts_all_metrics_of_an_item_type():
+
+    user = dict.fromkeys(METRIC_COUNTERS, 0)
+    count_question = compile_counter('question')
+
+    count_question(user, make_question(150), 100, 200)
+    count_question(user, make_question(160, answer_count=2), 100, 200)
+
+    assert user['question_count'] == 2
+    assert user['questions_with_no_answers'] == 1
+    assert user['question_upvotes'] == 6
+    assert user['question_downvotes'] == 2
+    assert user['answer_count'] == 0
+
+
+def test_counter_only_counts_items_in_the_date_range():
+    # Both ends of the date range are excluded
+
+    user = dict.fromkeys(METRIC_COUNTERS, 0)
+    count_question = compile_counter('question')
+
+    for creation_date in [99, 100, 200, 201]:
+        count_question(user, make_question(creation_date), 100, 200)
+
+    assert user['question_count'] == 0
+
+
+def test_counter_only_counts_the_selected_metrics():
+
+    user = dict.fromkeys(METRIC_COUNTERS, 0)
+    count_answer = compile_counter('answer', ['answers_accepted'])
+
+    count_answer(user, {'creation_date': 150, 'up_vote_count': 2, 'down_vote_count': 0,
+                        'is_accepted': True}, 100, 200)
+
+    assert user['answers_accepted'] == 1
+    assert user['answer_count'] == 0
+    assert user['answer_upvotes'] == 0
+
+
+def test_counter_without_metrics_does_nothing():
+
+    user = {}
+    compile_counter('article', [])(user, {'creation_date': 150, 'score': 1}, 100, 200)
+
+    assert user == {}
+
+
+def test_required_metrics_include_those_of_derived_metrics():
+
+    assert get_required_metrics(['user_id', 'total_downvotes', 'answer_count']) == [
+        'question_downvotes', 'answer_count', 'answer_downvotes']
+
+
+def test_required_datasets():
+
+    assert get_required_datasets(['user_id', 'display_name']) == set()
+    assert get_required_datasets(['answer_count', 'comment_count']) == {'questions'}
+    assert get_required_datasets(['answer_response_time_median']) == {'questions'}
+    assert get_required_datasets(['total_upvotes', 'net_reputation', 'sme_tags']) == {
+        'questions', 'articles', 'reputation_history', 'tags'}
+
+
+def test_totals_are_calculated_from_their_metrics():
+
+    user = dict.fromkeys(METRIC_COUNTERS, 0)
+    user.update(question_upvotes=1, answer_upvotes=2, article_upvotes=4, question_downvotes=8,
+                answer_downvotes=16, answer_response_times=[3.0, -1.0, 1.0])
+
+    finalize_user_metrics(user)
+
+    assert user['total_upvotes'] == 7
+    assert user['total_downvotes'] == 24
+    assert user['answer_response_time_median'] == 2.0
+
+
+def make_dataset(seed):
+    # Returns random questions (with answers and comments), articles, and reputation history of
+    # users 1-10; users 9 and 10 aren't in the list of users, i.e. they're deleted users
+
+    generator = random.Random(seed)
+
+    def owner():
+        user_id = generator.randint(1, 10)
+        return {'user_id': user_id, 'display_name': f"User {user_id}"}
+
+    def comments():
+        return [{'owner': owner(), 'creation_date': generator.randint(0, 1000)}
+                for _ in range(generator.randint(0, 2))]
+
+    questions = []
+    for _ in range(300):
+        creation_date = generator.randint(0, 1000)
+        answers = [{'owner': owner(), 'creation_date': creation_date + generator.randint(-5, 50),
+                    'up_vote_count': generator.randint(0, 3), 'down_vote_count': 0,
+                    'is_accepted': generator.random() < 0.3, 'comments': comments()}
+                   for _ in range(generator.randint(0, 3))]
+        questions.append({'owner': owner(), 'creation_date': creation_date,
+                          'answer_count': len(answers), 'up_vote_count': generator.randint(0, 5),
+                          'down_vote_count': generator.randint(0, 1), 'answers': answers,
+                          'comments': comments()})
+    articles = [{'owner': owner(), 'creation_date': generator.randint(0, 1000),
+                 'score': generator.randint(0, 4)} for _ in range(50)]
+    reputation_history = [{'user_id': generator.randint(1, 10),
+                           'creation_date': generator.randint(0, 1000),
+                           'reputation_change': generator.choice([-2, 5, 10, 15])}
+                          for _ in range(500)]
+
+    return questions, articles, reputation_history
+
+
+def make_users():
+
+    users = []
+    for user_id in range(1, 9):
+        user = initialize_deleted_user(user_id, f"User {user_id}")
+        user['display_name'] = f"User {user_id}"
+        users.append(user)
+    return users
+
+
+def test_parallel_aggregation_matches_a_single_process():
+
+    questions, articles, reputation_history = make_dataset(1)
+
+    aggregator = MetricsAggregator(make_users(), 200, 800)
+    aggregator.add_questions(questions)
+    aggregator.add_articles(articles)
+    aggregator.add_reputation_history(reputation_history)
+    expected = aggregator.get_users()
+
+    aggregator = MetricsAggregator(make_users(), 200, 800)
+    aggregate_in_parallel(aggregator, [
+        ('questions', split_into_chunks(questions, 40)),
+        ('articles', split_into_chunks(articles, 7)),
+        ('reputation_history', split_into_chunks(reputation_history, 60))
+    ], processes=2)
+
+    assert aggregator.get_users() == expected
+    assert [user['user_id'] for user in expected][8:] # deleted users were found
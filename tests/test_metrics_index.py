@@ -0,0 +1,108 @@
+import copy
+import json
+import os
+
+import pytest
+
+from so4t_metrics import MetricsAggregator, initialize_deleted_user
+from so4t_metrics_index import MetricsIndex
+from so4t_reputation_store import ReputationStore, build_reputation_store
+from so4t_user_report import get_metrics_index
+from test_metrics import make_dataset, make_users
+
+
+def make_index_dataset():
+    # User 12 only has reputation events; user 11 is a deleted user who only has reputation events
+
+    questions, articles, reputation_history = make_dataset(2)
+    reputation_history += [{'user_id': 12, 'creation_date': 300, 'reputation_change': 10},
+                           {'user_id': 11, 'creation_date': 400, 'reputation_change': 5}]
+
+    return questions, articles, reputation_history
+
+
+def make_index_users():
+
+    users = make_users()
+    users.append(initialize_deleted_user(12, "User 12"))
+    users[-1]['display_name'] = "User 12"
+    return users
+
+
+@pytest.fixture
+def index_dataset(tmp_path):
+
+    questions, articles, reputation_history = make_index_dataset()
+    store_file_path = str(tmp_path / 'reputation_history.bin')
+    build_reputation_store(reputation_history, store_file_path)
+    with ReputationStore(store_file_path) as reputation_store:
+        index = MetricsIndex.build(copy.deepcopy(questions), copy.deepcopy(articles),
+                                   reputation_store)
+
+    return index, questions, articles, reputation_history
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    (0, 2524626000),
+    (200, 800),
+    (500, 501),
+    (-1, 0),
+    (300, 400) # both ends fall on reputation events, which are excluded
+])
+def test_index_matches_aggregator(index_dataset, start_date, end_date):
+
+    index, questions, articles, reputation_history = index_dataset
+
+    aggregator = MetricsAggregator(make_index_users(), start_date, end_date)
+    aggregator.add_questions(copy.deepcopy(questions))
+    aggregator.add_articles(copy.deepcopy(articles))
+    aggregator.add_reputation_history(reputation_history)
+    expected = aggregator.get_users()
+
+    users = index.get_users(make_index_users(), start_date, end_date)
+    assert users == expected
+    assert [user['user_id'] for user in users][9:] == [9, 10] # but not user 11
+
+
+def test_index_matches_aggregator_at_item_dates(index_dataset):
+
+    index, questions, articles, reputation_history = index_dataset
+    dates = sorted({question['creation_date'] for question in questions})
+
+    for start_date, end_date in [(dates[10], dates[20]), (dates[0], dates[-1])]:
+        aggregator = MetricsAggregator(make_index_users(), start_date, end_date)
+        aggregator.add_questions(copy.deepcopy(questions))
+        aggregator.add_articles(copy.deepcopy(articles))
+        aggregator.add_reputation_history(reputation_history)
+        assert index.get_users(make_index_users(), start_date, end_date) == aggregator.get_users()
+
+
+def write_data_file(file_name, data, modified=None):
+
+    file_path = os.path.join('data', file_name)
+    with open(file_path, 'w') as f:
+        json.dump(data, f)
+    if modified:
+        os.utime(file_path, (modified, modified))
+
+
+def test_index_is_rebuilt_when_a_source_file_changes(tmp_path, monkeypatch, capsys):
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    questions, articles, reputation_history = make_index_dataset()
+    write_data_file('questions.json', questions, modified=1000000)
+    write_data_file('articles.json', articles, modified=1000000)
+    write_data_file('reputation_history.json', reputation_history, modified=1000000)
+
+    users = get_metrics_index().get_users(make_index_users(), 0, 2524626000)
+    assert 'Creating metrics index' in capsys.readouterr().out
+    get_metrics_index()
+    assert 'Creating metrics index' not in capsys.readouterr().out
+
+    articles.append({'owner': {'user_id': 1, 'display_name': "User 1"}, 'creation_date': 500,
+                     'score': 2})
+    write_data_file('articles.json', articles, modified=2000000)
+    updated_users = get_metrics_index().get_users(make_index_users(), 0, 2524626000)
+    assert 'Creating metrics index' in capsys.readouterr().out
+    assert updated_users[0]['article_count'] == users[0]['article_count'] + 1
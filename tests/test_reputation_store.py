@@ -0,0 +1,124 @@
+import os
+import random
+import time
+
+import pytest
+
+from so4t_metrics import MetricsAggregator
+from so4t_reputation_store import ReputationStore, build_reputation_store
+from so4t_user_report import export_to_json, open_reputation_store
+from test_metrics import make_users
+
+
+def make_event(user_id, creation_date, reputation_change, post_id=None,
+               reputation_history_type='post_upvoted'):
+
+    event = {'user_id': user_id, 'creation_date': creation_date,
+             'reputation_change': reputation_change,
+             'reputation_history_type': reputation_history_type}
+    if post_id:
+        event['post_id'] = post_id
+    return event
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    # Builds a store from a list of events, and closes it after the test
+
+    stores = []
+
+    def open_store(reputation_history):
+        file_path = str(tmp_path / 'reputation_history.bin')
+        build_reputation_store(reputation_history, file_path)
+        stores.append(ReputationStore(file_path))
+        return stores[-1]
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def test_empty_store(open_store):
+
+    store = open_store([])
+    assert store.event_count == 0
+    assert store.get_net_reputation(1, 0, 2524626000) == 0
+    assert store.get_events(1) == []
+
+
+def test_unknown_users_have_no_events(open_store):
+
+    store = open_store([make_event(1, 100, 10), make_event(3, 100, 5)])
+    for user_id in [0, 2, 4, -1]:
+        assert store.get_user_range(user_id) == (0, 0)
+        assert store.get_net_reputation(user_id, 0, 2524626000) == 0
+        assert store.get_events(user_id) == []
+
+
+def test_window_excludes_both_ends(open_store):
+
+    store = open_store([make_event(1, date, 1) for date in [100, 200, 300]])
+    assert store.get_net_reputation(1, 100, 300) == 1
+    assert store.get_net_reputation(1, 99, 301) == 3
+    assert store.get_net_reputation(1, 100, 101) == 0
+    assert store.get_net_reputation(1, 300, 400) == 0
+    assert store.get_net_reputation(1, 200, 200) == 0
+
+
+def test_events_round_trip(open_store):
+
+    events = [
+        make_event(2, 300, -2, post_id=40, reputation_history_type='post_downvoted'),
+        make_event(1, 200, 15, post_id=20, reputation_history_type='answer_accepted'),
+        make_event(1, 100, 10, post_id=10),
+        make_event(1, 150, 1, reputation_history_type='association_bonus')
+    ]
+    store = open_store(events)
+
+    assert store.get_events(1) == [events[2], events[3], events[1]] # oldest first
+    assert store.get_events(2) == [events[0]]
+
+
+def test_net_reputation_matches_brute_force(open_store):
+
+    generator = random.Random(3)
+    events = [make_event(generator.randint(1, 20), generator.randint(0, 100),
+                         generator.choice([-2, -1, 2, 5, 10, 15]))
+              for _ in range(2000)]
+    store = open_store(events)
+
+    for _ in range(500):
+        user_id = generator.randint(0, 21)
+        start_date = generator.randint(-5, 105)
+        end_date = generator.randint(start_date, 110)
+        expected = sum(event['reputation_change'] for event in events
+                       if event['user_id'] == user_id
+                       and start_date < event['creation_date'] < end_date)
+        assert store.get_net_reputation(user_id, start_date, end_date) == expected
+
+
+def test_store_is_rebuilt_when_the_json_file_is_newer(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    export_to_json('reputation_history', [make_event(1, 100, 10)])
+    with open_reputation_store() as store:
+        assert store.get_net_reputation(1, 0, 2524626000) == 10
+
+    export_to_json('reputation_history', [make_event(1, 100, 10), make_event(1, 200, 5)])
+    modified = time.time() + 10 # newer than the store
+    os.utime(os.path.join('data', 'reputation_history.json'), (modified, modified))
+    with open_reputation_store() as store:
+        assert store.get_net_reputation(1, 0, 2524626000) == 15
+
+
+def test_aggregator_skips_the_store_without_net_reputation(open_store):
+
+    store = open_store([make_event(1, 100, 10)])
+
+    aggregator = MetricsAggregator(make_users(), 0, 2524626000, metrics=['answer_count'])
+    aggregator.add_reputation_store(store)
+    assert aggregator.get_users()[0]['net_reputation'] == 0
+
+    aggregator = MetricsAggregator(make_users(), 0, 2524626000) # all metrics
+    aggregator.add_reputation_store(store)
+    assert aggregator.get_users()[0]['net_reputation'] == 10
@@ -0,0 +1,120 @@
+import http.server
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from so4t_metrics import METRIC_COUNTERS
+from so4t_server import (MetricsQueryEngine, MetricsRequestHandler, QueryError,
+                         get_date_range)
+
+
+class FakeIndex(object):
+    # Gives each user the net reputation and median answer time in their profile
+
+    def get_users(self, users, start_date, end_date):
+        for user in users:
+            user.update(dict.fromkeys(METRIC_COUNTERS, 0))
+            user['net_reputation'] = user['reputation']
+        return users
+
+
+USERS = [
+    {'user_id': 1, 'reputation': 10, 'title': 'Developer', 'department': 'Engineering',
+     'moderator': True, 'answer_response_time_median': 2.5},
+    {'user_id': 2, 'reputation': 30, 'title': None, 'department': 'engineering',
+     'moderator': False, 'answer_response_time_median': ''},
+    {'user_id': 3, 'reputation': 20, 'title': '', 'department': 'Sales',
+     'moderator': False, 'answer_response_time_median': 1.0},
+    {'user_id': 4, 'reputation': 0, 'title': 'Manager', 'department': None,
+     'moderator': False, 'answer_response_time_median': None}
+]
+
+
+@pytest.fixture
+def engine():
+
+    return MetricsQueryEngine(lambda: ([dict(user) for user in USERS], FakeIndex()),
+                              lambda: {'users.json': 1})
+
+
+def get_user_ids(result):
+
+    return [user['user_id'] for user in result['users']]
+
+
+def test_users_are_sorted_by_net_reputation(engine):
+
+    assert get_user_ids(engine.get_users({})) == [2, 3, 1, 4]
+    assert get_user_ids(engine.get_users({'order': ['asc'], 'limit': ['2']})) == [4, 1]
+
+
+@pytest.mark.parametrize('order', ['desc', 'asc'])
+def test_missing_values_are_sorted_last(engine, order):
+    # The missing titles and median answer times are a mix of None and ''
+
+    result = engine.get_users({'sort': ['title'], 'order': [order]})
+    assert get_user_ids(result)[2:] in ([2, 3], [3, 2])
+
+    result = engine.get_users({'sort': ['answer_response_time_median'], 'order': [order],
+                               'limit': ['2']})
+    assert get_user_ids(result) == ([1, 3] if order == 'desc' else [3, 1])
+
+
+def test_users_are_filtered(engine):
+
+    assert get_user_ids(engine.get_users({'department': ['ENGINEERING']})) == [2, 1]
+    assert get_user_ids(engine.get_users({'moderator': ['true']})) == [1]
+    assert engine.get_summary({'department': ['sales']})['user_count'] == 1
+
+
+@pytest.mark.parametrize('query', [
+    {'sort': ['password']},
+    {'limit': ['ten']},
+    {'moderator': ['maybe']},
+    {'start_date': ['2024-13-01']}
+])
+def test_invalid_queries(engine, query):
+
+    with pytest.raises(QueryError):
+        engine.get_users(query)
+
+
+def test_date_range_defaults_to_all_data():
+
+    start_date, end_date = get_date_range({'start_date': ['2024-01-01']})
+    assert start_date > 0
+    assert end_date == 2524626000
+
+
+def test_unexpected_errors_are_json_responses(engine):
+
+    class BrokenEngine(object):
+        def get_status(self):
+            raise RuntimeError("broken")
+
+    class Handler(MetricsRequestHandler):
+        pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        Handler.engine = engine
+        with urllib.request.urlopen(url + '/users?sort=title') as response:
+            assert json.load(response)['count'] == 4
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/users?limit=ten')
+        assert error.value.code == 400
+
+        Handler.engine = BrokenEngine()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/status')
+        assert error.value.code == 500
+        assert json.load(error.value) == {'error': 'Internal server error'}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,316 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+import so4t_user_report
+from so4t_incremental import MetricsState, get_reputation_event_key
+from so4t_metrics import MetricsAggregator
+from so4t_user_report import (DEFAULT_COLUMNS, REPORT_COLUMNS, add_new_user_fields,
+                              check_data_datasets, check_data_date_range, create_user_report,
+                              find_deleted_posts, get_api_data, get_api_date_range, get_args,
+                              get_date_range, get_metrics_index, get_reputation_history,
+                              parse_columns, save_data_date_range, select_users)
+
+
+class FakeV2Client(object):
+    # Lists the posts in `existing_posts` (post type -> IDs); counts come from `item_counts`
+
+    def __init__(self, existing_posts, item_counts):
+        self.existing_posts = existing_posts
+        self.item_counts = item_counts
+
+    def create_filter(self, filter_attributes='', base='default'):
+        return 'filter'
+
+    def list_posts(self, post_type):
+        return lambda filter_string: [{f"{post_type}_id": post_id}
+                                      for post_id in self.existing_posts.get(post_type, [])]
+
+    def __getattr__(self, name):
+        # stream_all_questions, stream_all_answers, ...
+        post_type = name.replace('stream_all_', '').rstrip('s')
+        return self.list_posts(post_type)
+
+    def get_item_count(self, endpoint, params=None):
+        return self.item_counts.get(endpoint)
+
+
+def make_state(post_keys):
+
+    state = MetricsState()
+    for post_key in post_keys:
+        state.posts[post_key] = {'user_id': 1, 'metrics': {}}
+    return state
+
+
+def test_deleted_posts_are_the_unlisted_posts():
+
+    state = make_state(['question/1', 'question/2', 'question/3'])
+    v2client = FakeV2Client({'question': [1, 3]}, {'/questions': 2, '/answers': 0,
+                                                   '/comments': 0, '/articles': 0})
+
+    assert find_deleted_posts(v2client, state)['question'] == [2]
+
+
+def test_deleted_posts_check_is_skipped_if_the_count_fails():
+
+    state = make_state(['question/1', 'question/2', 'question/3'])
+    # The listing stopped early, and the count to verify it failed
+    v2client = FakeV2Client({'question': [1]}, {'/answers': 0, '/comments': 0, '/articles': 0})
+
+    assert 'question' not in find_deleted_posts(v2client, state)
+
+
+def test_deleted_posts_check_is_skipped_if_the_listing_is_incomplete():
+
+    state = make_state(['question/1', 'question/2', 'question/3'])
+    v2client = FakeV2Client({'question': [1]}, {'/questions': 3, '/answers': 0,
+                                                '/comments': 0, '/articles': 0})
+
+    assert 'question' not in find_deleted_posts(v2client, state)
+
+
+def make_args(user_ids=None, department=None, title=None):
+
+    return argparse.Namespace(user_ids=user_ids, department=department, title=title)
+
+
+SUBSET_USERS = [
+    {'user_id': 1, 'department': 'Engineering', 'title': 'Developer'},
+    {'user_id': 2, 'department': 'engineering', 'title': None},
+    {'user_id': 3, 'department': 'Sales', 'title': 'Developer'}
+]
+
+
+def test_select_users_matches_all_arguments():
+
+    selected = select_users(SUBSET_USERS, make_args(department='ENGINEERING'))
+    assert [user['user_id'] for user in selected] == [1, 2]
+
+    selected = select_users(SUBSET_USERS, make_args(user_ids={1, 3}, title='developer'))
+    assert [user['user_id'] for user in selected] == [1, 3]
+
+
+def test_select_users_exits_if_no_users_match(capsys):
+
+    with pytest.raises(SystemExit):
+        select_users(SUBSET_USERS, make_args(department='nosuch'))
+    assert "No users match" in capsys.readouterr().out
+
+
+def test_parse_columns():
+
+    assert parse_columns('user_id, answer_upvotes,display_name') == [
+        'user_id', 'answer_upvotes', 'display_name']
+    assert parse_columns('all') == list(REPORT_COLUMNS)
+    assert set(DEFAULT_COLUMNS) < set(REPORT_COLUMNS)
+
+
+def test_parse_columns_rejects_unknown_columns():
+
+    with pytest.raises(argparse.ArgumentTypeError, match='password'):
+        parse_columns('user_id,password')
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_columns(',')
+
+
+def test_report_has_the_selected_columns(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    users = [{'user_id': 1, 'net_reputation': 5, 'communities': ['A', 'B']},
+             {'user_id': 2, 'net_reputation': 9, 'communities': []}]
+
+    create_user_report(users, None, None, columns=['user_id', 'communities', 'net_reputation'])
+
+    with open(next(tmp_path.glob('*_user_metrics.csv')), newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows == [['User ID', 'Communities', 'Net Reputation'],
+                    ['2', '', '9'],
+                    ['1', 'A, B', '5']]
+
+
+def make_date_args(start_date=None, end_date=None, full_history=False):
+
+    return argparse.Namespace(start_date=start_date, end_date=end_date,
+                              full_history=full_history)
+
+
+def test_api_date_range_is_the_report_date_range():
+
+    args = make_date_args('2024-01-01', '2024-07-01')
+    assert get_api_date_range(args) == get_date_range(args)
+    assert get_api_date_range(make_date_args(start_date='2024-01-01'))[1] is None
+    assert get_api_date_range(make_date_args(end_date='2024-07-01'))[0] is None
+
+
+def test_api_date_range_is_unlimited_for_full_history():
+
+    assert get_api_date_range(make_date_args()) == (None, None)
+    assert get_api_date_range(make_date_args('2024-01-01', full_history=True)) == (None, None)
+    assert get_api_date_range(argparse.Namespace()) == (None, None) # the 'fetch' command
+
+
+def test_reports_from_saved_data_must_be_within_its_date_range(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    check_data_date_range(0, 2524626000) # no saved date range: all data was saved
+
+    save_data_date_range(1000, 5000)
+    check_data_date_range(1000, 5000)
+    check_data_date_range(2000, 3000)
+    for start_date, end_date in [(0, 3000), (2000, 6000)]:
+        with pytest.raises(SystemExit):
+            check_data_date_range(start_date, end_date)
+
+    save_data_date_range(None, None)
+    check_data_date_range(0, 2524626000)
+
+
+def read_data_file(file_name):
+
+    with open(os.path.join('data', file_name), 'r') as f:
+        return json.load(f)
+
+
+def test_datasets_that_werent_collected_are_kept_but_not_current(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(so4t_user_report, 'create_api_clients', lambda args: (None, None))
+    monkeypatch.setattr(so4t_user_report, 'get_users', lambda v2client, v3client: [])
+    monkeypatch.setattr(so4t_user_report, 'get_tags', lambda v3client: [{'name': 'python'}])
+    monkeypatch.setattr(so4t_user_report, 'get_reputation_history',
+                        lambda v2client, users, stream, from_date, to_date: [{'user_id': 1}])
+    monkeypatch.setattr(so4t_user_report, 'get_questions_answers_comments',
+                        lambda v2client, stream, shards: [{'question_id': 1}])
+    monkeypatch.setattr(so4t_user_report, 'get_articles',
+                        lambda v2client, stream, shards, from_date, to_date: [{'article_id': 1}])
+    args = argparse.Namespace(web_client=False, stream=False, shards=1, start_date=None,
+                              end_date=None, full_history=False)
+
+    get_api_data(args) # all datasets
+    check_data_datasets(['questions', 'articles', 'reputation_history', 'tags'])
+
+    monkeypatch.setattr(so4t_user_report, 'get_questions_answers_comments',
+                        lambda v2client, stream, shards: [{'question_id': 2}])
+    get_api_data(args, {'questions'})
+    assert read_data_file('questions.json') == [{'question_id': 2}]
+    assert read_data_file('articles.json') == [{'article_id': 1}] # from the first run
+    check_data_datasets(['questions'])
+    for dataset in ['articles', 'reputation_history', 'tags']:
+        with pytest.raises(SystemExit):
+            check_data_datasets(['questions', dataset])
+
+
+def test_data_directories_without_a_datasets_record_need_the_files(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    with open(os.path.join('data', 'questions.json'), 'w') as f:
+        json.dump([], f)
+
+    check_data_datasets(['questions'])
+    with pytest.raises(SystemExit):
+        check_data_datasets(['articles'])
+
+
+def test_metrics_index_needs_all_of_its_source_files(tmp_path, monkeypatch, capsys):
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    for file_name in ['questions.json', 'articles.json']:
+        with open(os.path.join('data', file_name), 'w') as f:
+            json.dump([], f)
+
+    with pytest.raises(SystemExit):
+        get_metrics_index()
+    assert 'reputation_history' in capsys.readouterr().out
+
+
+class FilterRecordingClient(object):
+    # Records the filter attributes; returns events with only the fields the filter includes
+
+    def create_filter(self, filter_attributes='', base='default'):
+        self.filter_attributes = filter_attributes
+        return 'filter'
+
+    def get_reputation_history(self, user_ids, filter_string, from_date=None, to_date=None):
+        event = {'user_id': user_ids[0], 'creation_date': 1500, 'reputation_change': 10,
+                 'post_id': 7, 'reputation_history_type': 'post_upvoted', 'link': 'x'}
+        fields = {attribute.split('.', 1)[1] for attribute in self.filter_attributes
+                  if attribute.startswith('reputation_history.')}
+        return [{field: value for field, value in event.items() if field in fields}]
+
+
+def test_reputation_history_filter_includes_the_fields_that_are_used():
+
+    v2client = FilterRecordingClient()
+    events = get_reputation_history(v2client, [{'user_id': 5}])
+
+    # Every attribute is a field of the reputation_history type (or of the response wrapper)
+    for attribute in v2client.filter_attributes:
+        assert attribute.startswith(('reputation_history.', '.'))
+
+    aggregator = MetricsAggregator(make_report_users([5]), 1000, 2000)
+    aggregator.add_reputation_history(events)
+    assert aggregator.get_users()[0]['net_reputation'] == 10
+
+    state = MetricsState()
+    state.start_sync(1000)
+    state.apply_reputation_history(events)
+    assert get_reputation_event_key(events[0]) == '5/1500/7/post_upvoted/10'
+
+
+def make_report_users(user_ids):
+
+    return add_new_user_fields([{'user_id': user_id, 'display_name': f"User {user_id}",
+                                 'creation_date': 0, 'last_access_date': 0}
+                                for user_id in user_ids])
+
+
+def parse_args(monkeypatch, arguments):
+
+    monkeypatch.setattr(sys, 'argv', ['so4t_user_report.py'] + arguments)
+    return get_args()
+
+
+def test_arguments_can_be_used_before_the_command(monkeypatch):
+
+    args = parse_args(monkeypatch, ['--start-date', '2020-09-14', '--end-date', '2020-09-16',
+                                    'process'])
+    assert (args.command, args.start_date, args.end_date) == ('process', '2020-09-14',
+                                                              '2020-09-16')
+    assert args.no_api
+
+    args = parse_args(monkeypatch, ['--url', 'https://x.example', '--token', 'T', 'fetch'])
+    assert (args.command, args.url, args.token) == ('fetch', 'https://x.example', 'T')
+    assert not args.stream
+
+    args = parse_args(monkeypatch, ['--no-api', '--stream', '--processes', '2', 'process'])
+    assert args.stream and args.processes == 2
+
+    args = parse_args(monkeypatch, ['--stream', 'fetch'])
+    assert args.stream
+
+
+def test_arguments_can_be_used_after_the_command(monkeypatch):
+
+    args = parse_args(monkeypatch, ['process', '--stream', '--columns', 'user_id'])
+    assert args.stream and args.columns == ['user_id']
+    assert args.processes == 1 and args.start_date is None
+
+    args = parse_args(monkeypatch, ['report', '--url', 'https://x.example', '--shards', '4'])
+    assert (args.command, args.url, args.shards, args.no_api) == ('report', 'https://x.example',
+                                                                  4, False)
+
+    args = parse_args(monkeypatch, ['--url', 'https://x.example'])
+    assert args.command == 'report' and args.columns == DEFAULT_COLUMNS
+
+
+def test_fetch_gets_all_dates(monkeypatch):
+
+    args = parse_args(monkeypatch, ['--start-date', '2024-01-01', 'fetch'])
+    assert get_api_date_range(args) == (None, None)